@@ -1,40 +1,441 @@
-def responder_pergunta(pergunta, dados):
-    pergunta = pergunta.lower()
-
-    if "base" in pergunta:
-        resultado = (
-            dados.groupby("BASE")["VALOR_DESCONTO"]
-            .sum()
-            .reset_index()
-            .sort_values("VALOR_DESCONTO", ascending=False)
-        )
-        return resultado, "📌 Total de desconto por Base"
-
-    elif "cidade" in pergunta:
-        resultado = (
-            dados.groupby("CIDADE")["VALOR_DESCONTO"]
-            .sum()
-            .reset_index()
-            .sort_values("VALOR_DESCONTO", ascending=False)
-        )
-        return resultado, "📌 Total de desconto por Cidade"
-
-    elif "distribuidora" in pergunta:
-        resultado = (
-            dados.groupby("DISTRIBUIDORA")["VALOR_DESCONTO"]
-            .sum()
-            .reset_index()
-            .sort_values("VALOR_DESCONTO", ascending=False)
-        )
-        return resultado, "📌 Total de desconto por Distribuidora"
-
-    elif "avaria" in pergunta or "extravio" in pergunta:
-        resultado = (
-            dados.groupby("OBSERVACAO")["VALOR_DESCONTO"]
-            .sum()
-            .reset_index()
-        )
-        return resultado, "📌 Descontos por Tipo (Avaria / Extravio)"
+import re
+from datetime import date, timedelta
+from functools import lru_cache
 
+import pandas as pd
+
+import database
+from cidades import normalizar_nome
+from database import DIMENSOES_RESUMO, cache_por_versao, conexao, contar_valores, versao_dados
+
+# =========================
+# PERGUNTAS EM LINGUAGEM NATURAL
+# =========================
+# Interpretador local (sem rede) de perguntas como "top 10 cidades por
+# desconto em março na distribuidora X". A pergunta vira um plano (fonte,
+# dimensão, métrica, filtros, período, ordem e limite) e o plano vira um
+# único SELECT agregado com parâmetros, rodado no SQLite: só o resultado, com
+# poucas linhas, chega ao pandas. Planos ficam em um lru_cache (chave: texto
+# normalizado, dia e versão da tabela) e resultados no cache_por_versao.
+#
+# Filtros são reconhecidos pelos valores que existem no banco (distribuidoras,
+# cidades, bases, tipos...), então não é preciso escrever "distribuidora =".
+EXEMPLOS = (
+    "desconto por base",
+    "top 10 cidades por desconto em março na distribuidora X",
+    "quantidade de descontos por mês nos últimos 6 meses",
+    "ocorrências por filial este ano",
+)
+
+# fonte -> {coluna agrupada: padrão que a menciona}
+DIMENSOES = {
+    "descontos": {
+        "BASE": r"\bbases?\b",
+        "CIDADE": r"\bcidades?\b",
+        "DISTRIBUIDORA": r"\bdistribuidoras?\b",
+        "OBSERVACAO": r"\btipos?\b",
+        "MOTIVO": r"\bmotivos?\b",
+        "FECHAMENTO": r"\bfechamentos?\b|\bperiodos?\b|\bpor mes\b|\bmensal\b|\bmes a mes\b|\bcada mes\b",
+    },
+    "ocorrencias": {
+        "distribuidora": r"\bdistribuidoras?\b",
+        "filial": r"\bfilia(?:l|is)\b",
+        "cidade_nf": r"\bcidades?\b",
+        "ocorrencia": r"\btipos?\b",
+        "status_rpg": r"\bstatus\b",
+        "mes": r"\bperiodos?\b|\bpor mes\b|\bmensal\b|\bmes a mes\b|\bcada mes\b",
+    },
+}
+
+# Dimensões que não são uma coluna da tabela.
+EXPRESSOES = {"mes": "substr(emissao_nf, 1, 7)"}
+
+# Dimensões de tempo: saem em ordem cronológica quando não há ranking.
+DIMENSOES_TEMPO = ("FECHAMENTO", "mes")
+
+ROTULOS = {
+    "BASE": "Base",
+    "CIDADE": "Cidade",
+    "DISTRIBUIDORA": "Distribuidora",
+    "OBSERVACAO": "Tipo",
+    "MOTIVO": "Motivo",
+    "FECHAMENTO": "Fechamento",
+    "distribuidora": "Distribuidora",
+    "filial": "Filial",
+    "cidade_nf": "Cidade",
+    "ocorrencia": "Tipo de ocorrência",
+    "status_rpg": "Status RPG",
+    "mes": "Mês",
+}
+
+# fonte -> {métrica: (expressão SQL, nome da coluna, descrição)}
+METRICAS = {
+    "descontos": {
+        "total": ("ROUND(SUM(VALOR_DESCONTO), 2)", "VALOR_DESCONTO", "total de desconto"),
+        "quantidade": ("COUNT(*)", "QUANTIDADE", "quantidade de descontos"),
+        "media": ("ROUND(AVG(VALOR_DESCONTO), 2)", "DESCONTO_MEDIO", "desconto médio"),
+    },
+    "ocorrencias": {
+        "total": ("ROUND(SUM(valor_ocorrencia), 2)", "valor_ocorrencia", "valor de ocorrência"),
+        "valor_nf": ("ROUND(SUM(valor_nf), 2)", "valor_nf", "valor das NFs"),
+        "quantidade": ("COUNT(*)", "quantidade", "quantidade de ocorrências"),
+        "media": ("ROUND(AVG(valor_ocorrencia), 2)", "valor_medio", "valor médio de ocorrência"),
+    },
+}
+
+# A primeira que aparecer na pergunta vale; sem nenhuma, "total".
+PADROES_METRICA = (
+    ("valor_nf", r"\bvalor (?:da |das )?nfs?\b"),
+    ("quantidade", r"\bquant(?:os|as|idade)\b|\bnumero de\b|\bcontagem\b|\bqtd\b"),
+    ("media", r"\bmedi[oa]s?\b"),
+)
+
+# Colunas cujos valores, citados na pergunta, viram filtro (na ordem de
+# preferência quando o mesmo valor existe em mais de uma).
+COLUNAS_VALORES = {
+    "descontos": ("DISTRIBUIDORA", "CIDADE", "BASE", "OBSERVACAO"),
+    "ocorrencias": ("distribuidora", "cidade_nf", "filial", "ocorrencia", "status_rpg"),
+}
+
+COLUNAS_PERIODO = {"descontos": "FECHAMENTO", "ocorrencias": "emissao_nf"}
+
+MESES = {
+    "janeiro": 1, "fevereiro": 2, "marco": 3, "abril": 4, "maio": 5, "junho": 6,
+    "julho": 7, "agosto": 8, "setembro": 9, "outubro": 10, "novembro": 11, "dezembro": 12,
+}
+ABREVIACOES_MESES = {nome[:3]: numero for nome, numero in MESES.items()}
+
+PADRAO_FONTE = r"\bdescontos?\b|\bocorrencias?\b"
+# Métrica e dimensões que só existem em ocorrências: a pergunta vai para lá
+# mesmo sem a palavra "ocorrências".
+PADRAO_SO_OCORRENCIAS = r"\bvalor (?:da |das )?nfs?\b|\bfilia(?:l|is)\b|\bstatus\b"
+
+# Coluna de tipo de cada fonte. Uma pergunta só com tipos ("avaria") compara
+# todos os tipos, como sempre foi.
+COLUNAS_TIPO = {"descontos": "OBSERVACAO", "ocorrencias": "ocorrencia"}
+# "top 10", "10 maiores", "os 5 primeiros"...
+PADROES_LIMITE = (
+    r"\btop\s*(\d+)\b",
+    r"\b(\d+)\s+(?:maiores|menores|primeir[oa]s|principais|mais|menos)\b",
+    r"\b(?:os|as)\s+(\d+)\b",
+)
+
+
+class PerguntaSemSuporte(ValueError):
+    # Pergunta entendida, mas sobre algo que a fonte não tem.
+    pass
+
+
+def _normalizar(texto):
+    # "Março, São Félix!" -> "marco sao felix"
+    return " ".join(re.sub(r"[^\w/]+", " ", normalizar_nome(texto).lower()).split())
+
+
+def _apagar(texto, inicio, fim):
+    # Tira um trecho já interpretado sem mudar as posições do resto.
+    return texto[:inicio] + " " * (fim - inicio) + texto[fim:]
+
+
+# =========================
+# PERÍODOS
+# =========================
+def _somar_meses(ano, mes, meses):
+    indice = ano * 12 + mes - 1 + meses
+    return date(indice // 12, indice % 12 + 1, 1)
+
+
+def _intervalo_mes(ano, mes):
+    return date(ano, mes, 1), _somar_meses(ano, mes, 1), f"{mes:02d}/{ano}"
+
+
+def _mes_sem_ano(mes, hoje):
+    # "março" é o último março que já começou.
+    return _intervalo_mes(hoje.year if mes <= hoje.month else hoje.year - 1, mes)
+
+
+def _periodo(texto, hoje):
+    # Devolve ((início, fim exclusivo, rótulo) ou None, texto sem o trecho).
+    nomes = "|".join(MESES)
+    abreviacoes = "|".join(ABREVIACOES_MESES)
+    anterior = _somar_meses(hoje.year, hoje.month, -1)
+    regras = (
+        (r"\bultimos (\d+) meses\b", lambda m: (
+            _somar_meses(hoje.year, hoje.month, 1 - int(m[1])),
+            _somar_meses(hoje.year, hoje.month, 1),
+            f"últimos {m[1]} meses"
+        )),
+        (r"\bultimos (\d+) dias\b", lambda m: (
+            hoje - timedelta(days=int(m[1])), hoje + timedelta(days=1), f"últimos {m[1]} dias"
+        )),
+        (r"\b(?:n?est|n?ess)e mes\b|\bmes atual\b", lambda m: _intervalo_mes(hoje.year, hoje.month)),
+        (r"\bmes passado\b|\bultimo mes\b", lambda m: _intervalo_mes(anterior.year, anterior.month)),
+        (r"\b(?:n?est|n?ess)e ano\b|\bano atual\b", lambda m: (date(hoje.year, 1, 1), date(hoje.year + 1, 1, 1), str(hoje.year))),
+        (r"\bano passado\b", lambda m: (date(hoje.year - 1, 1, 1), date(hoje.year, 1, 1), str(hoje.year - 1))),
+        (rf"\b({nomes})\b(?:\s+(?:de\s+)?(\d{{4}}))?", lambda m: (
+            _intervalo_mes(int(m[2]), MESES[m[1]]) if m[2] else _mes_sem_ano(MESES[m[1]], hoje)
+        )),
+        (rf"\b({abreviacoes})/(\d{{4}})\b", lambda m: _intervalo_mes(int(m[2]), ABREVIACOES_MESES[m[1]])),
+        (r"\b(\d{1,2})/(\d{4})\b", lambda m: _intervalo_mes(int(m[2]), int(m[1])) if 1 <= int(m[1]) <= 12 else None),
+        (r"\b(20\d{2})\b", lambda m: (date(int(m[1]), 1, 1), date(int(m[1]) + 1, 1, 1), m[1])),
+    )
+    for padrao, intervalo in regras:
+        encontrado = re.search(padrao, texto)
+        periodo = intervalo(encontrado) if encontrado else None
+        if periodo:
+            return periodo, _apagar(texto, *encontrado.span())
+    return None, texto
+
+
+# =========================
+# VALORES CONHECIDOS (FILTROS)
+# =========================
+@cache_por_versao()
+def _indice_valores(fonte):
+    # Um único regex com todos os valores (os mais longos primeiro, para
+    # "SAO FELIX DO CORIBE" ganhar de "SAO FELIX") e, por valor normalizado,
+    # as colunas e as grafias em que ele aparece no banco.
+    mapa = {}
+    for coluna in COLUNAS_VALORES[fonte]:
+        for valor in contar_valores(fonte, coluna)["valor"]:
+            normalizado = _normalizar(valor)
+            if len(normalizado) < 3 or normalizado.isdigit():
+                continue
+            mapa.setdefault(normalizado, {}).setdefault(coluna, []).append(valor)
+
+    if not mapa:
+        return None, mapa
+    alternativas = "|".join(re.escape(valor) for valor in sorted(mapa, key=len, reverse=True))
+    return re.compile(rf"(?<!\w)(?:{alternativas})(?!\w)"), mapa
+
+
+def _coluna_citada(antes, colunas, fonte):
+    # A dimensão escrita logo antes do valor ("base salvador", "na
+    # distribuidora de X") decide a coluna. Devolve (coluna, onde a palavra
+    # começa) ou (None, None).
+    for coluna in colunas:
+        padrao = DIMENSOES[fonte].get(coluna)
+        encontrado = padrao and re.search(rf"(?:{padrao})\s+(?:d[aeo]s?\s+)?$", antes)
+        if encontrado:
+            return coluna, encontrado.start()
+    return None, None
+
+
+def _filtros(texto, fonte):
+    regex, mapa = _indice_valores(fonte)
+    filtros = {}
+    if regex is None:
+        return filtros, texto
+
+    for encontrado in regex.finditer(texto):
+        colunas = mapa[encontrado[0]]
+        # Mesmo valor em mais de uma coluna (base e cidade com o mesmo nome):
+        # vale a dimensão escrita logo antes dele, senão a primeira da lista.
+        # A palavra da dimensão sai junto com o valor, para não virar
+        # agrupamento ("por cidade na base salvador" agrupa por cidade).
+        coluna, inicio = _coluna_citada(texto[:encontrado.start()], colunas, fonte)
+        if coluna is None:
+            coluna = next(c for c in COLUNAS_VALORES[fonte] if c in colunas)
+            inicio = encontrado.start()
+        filtros.setdefault(coluna, []).extend(colunas[coluna])
+        texto = _apagar(texto, inicio, encontrado.end())
+    return filtros, texto
+
+
+# =========================
+# PLANO
+# =========================
+def _limite(texto):
+    for padrao in PADROES_LIMITE:
+        encontrado = re.search(padrao, texto)
+        if encontrado:
+            return int(encontrado[1]) or None, _apagar(texto, *encontrado.span(1))
+    # "qual cidade teve mais desconto" -> só a primeira.
+    if re.search(r"\bqua(?:l|is)\b", texto) and re.search(r"\b(?:mais|maior|menos|menor)\b", texto):
+        return None if re.search(r"\bquais\b", texto) else 1, texto
+    return None, texto
+
+
+def _dimensao(texto, fonte, filtros):
+    # Entre as dimensões citadas, "por X" sempre agrupa; depois, as que não
+    # têm valor filtrado, na ordem em que aparecem.
+    citadas = []
+    for coluna, padrao in DIMENSOES[fonte].items():
+        encontrado = re.search(padrao, texto)
+        if encontrado:
+            prefixo = texto[:encontrado.start()].rstrip()
+            citadas.append((not prefixo.endswith(" por") and prefixo != "por", coluna in filtros, encontrado.start(), coluna))
+    if citadas:
+        return min(citadas)[3]
+    # Sem dimensão, valores de uma coluna só ("salvador e itabuna") são
+    # comparados entre si.
+    if len(filtros) == 1:
+        return next(iter(filtros))
+    return None
+
+
+def _titulo(plano):
+    _, _, descricao = METRICAS[plano["fonte"]][plano["metrica"]]
+    titulo = descricao[0].upper() + descricao[1:]
+    if plano["dimensao"]:
+        titulo += f" por {ROTULOS[plano['dimensao']]}"
+    if plano["limite"]:
+        titulo = f"{'Menores' if plano['crescente'] else 'Top'} {plano['limite']} - {titulo}"
+
+    detalhes = [
+        f"{ROTULOS[coluna]}: {', '.join(sorted({str(v).strip() for v in valores}))}"
+        for coluna, valores in plano["filtros"].items()
+    ]
+    if plano["periodo"]:
+        detalhes.append(f"Período: {plano['periodo'][2]}")
+    return "📌 " + " | ".join([titulo] + detalhes)
+
+
+def _compilar(plano):
+    # Plano -> um SELECT agregado com parâmetros.
+    fonte = plano["fonte"]
+    dimensao = plano["dimensao"]
+    expressao, nome, _ = METRICAS[fonte][plano["metrica"]]
+    params = []
+
+    if not dimensao:
+        ordem = ""
+    elif plano["crescente"] is None:
+        ordem = f" ORDER BY {dimensao}"
+    else:
+        ordem = f" ORDER BY {nome} {'ASC' if plano['crescente'] else 'DESC'}"
+
+    # Sem filtro nem período, os totais por dimensão já estão prontos.
+    if (
+        fonte == "descontos" and dimensao in DIMENSOES_RESUMO
+        and not plano["filtros"] and not plano["periodo"] and plano["metrica"] != "media"
+    ):
+        valor = "ROUND(total, 2)" if plano["metrica"] == "total" else "quantidade"
+        sql = f"SELECT valor AS {dimensao}, {valor} AS {nome} FROM resumo_descontos WHERE dimensao = ?{ordem}"
+        params.append(dimensao)
+    else:
+        clausulas = []
+        for coluna, valores in plano["filtros"].items():
+            clausulas.append(f"{coluna} IN ({', '.join('?' * len(valores))})")
+            params.extend(valores)
+        if plano["periodo"]:
+            coluna = COLUNAS_PERIODO[fonte]
+            clausulas.append(f"{coluna} >= ? AND {coluna} < ?")
+            params.extend(data.isoformat() for data in plano["periodo"][:2])
+
+        selecao = expressao
+        agrupamento = ""
+        if dimensao:
+            clausulas.append(f"{EXPRESSOES.get(dimensao, dimensao)} IS NOT NULL")
+            coluna = f"{EXPRESSOES[dimensao]} AS {dimensao}" if dimensao in EXPRESSOES else dimensao
+            selecao = f"{coluna}, {expressao}"
+            agrupamento = f" GROUP BY {dimensao}"
+        where = f" WHERE {' AND '.join(clausulas)}" if clausulas else ""
+        sql = f"SELECT {selecao} AS {nome} FROM {fonte}{where}{agrupamento}{ordem}"
+
+    if plano["limite"]:
+        sql += " LIMIT ?"
+        params.append(plano["limite"])
+    return sql, tuple(params)
+
+
+@lru_cache(maxsize=256)
+def _planejar(texto, fonte, hoje, caminho_banco, versao):
+    # caminho_banco e versao só entram na chave: com dados novos os valores
+    # conhecidos (filtros) podem mudar.
+    periodo, resto = _periodo(texto, hoje)
+    limite, resto = _limite(resto)
+    filtros, resto = _filtros(resto, fonte)
+    metrica = next(
+        (m for m, padrao in PADROES_METRICA if m in METRICAS[fonte] and re.search(padrao, resto)),
+        "total"
+    )
+    dimensao = _dimensao(resto, fonte, filtros)
+    if dimensao == COLUNAS_TIPO[fonte] and list(filtros) == [dimensao] and not re.search(DIMENSOES[fonte][dimensao], resto):
+        filtros = {}
+
+    entendido = dimensao or filtros or periodo or limite or metrica != "total" or re.search(PADRAO_FONTE, texto)
+    if not entendido:
+        return None
+
+    if limite or dimensao not in DIMENSOES_TEMPO or re.search(r"\b(?:mais|maior|maiores|menos|menor|menores)\b", resto):
+        crescente = bool(re.search(r"\b(?:menos|menor|menores)\b", resto))
     else:
-        return None, "❌ Não entendi a pergunta. Tente: base, cidade, distribuidora, avaria."
+        crescente = None
+
+    plano = {
+        "fonte": fonte,
+        "dimensao": dimensao,
+        "metrica": metrica,
+        "filtros": filtros,
+        "periodo": periodo,
+        "limite": limite,
+        "crescente": crescente,
+    }
+    plano["sql"], plano["params"] = _compilar(plano)
+    plano["titulo"] = _titulo(plano)
+    return plano
+
+
+def _fonte(texto):
+    if re.search(r"\bocorrencias?\b", texto):
+        return "ocorrencias"
+    if re.search(PADRAO_SO_OCORRENCIAS, texto):
+        # Responder com o total de desconto seria responder outra pergunta.
+        if re.search(r"\bdescontos?\b", texto):
+            raise PerguntaSemSuporte("Valor da NF, filial e status existem só nas ocorrências.")
+        return "ocorrencias"
+    return "descontos"
+
+
+def interpretar(pergunta, hoje=None):
+    texto = _normalizar(pergunta)
+    fonte = _fonte(texto)
+    return _planejar(texto, fonte, hoje or date.today(), database.DB_PATH, versao_dados(fonte))
+
+
+# =========================
+# RESPOSTA
+# =========================
+@cache_por_versao()
+def _executar(fonte, sql, params):
+    with conexao() as conn:
+        return pd.read_sql(sql, conn, params=params)
+
+
+def _agrupar(dados, plano):
+    # Caminho antigo, para quando um DataFrame de descontos já carregado é passado.
+    _, nome, _ = METRICAS["descontos"][plano["metrica"]]
+    for coluna, valores in plano["filtros"].items():
+        dados = dados[dados[coluna].isin(valores)]
+    if plano["periodo"]:
+        datas = dados["FECHAMENTO"].astype(str)
+        inicio, fim, _ = plano["periodo"]
+        dados = dados[(datas >= inicio.isoformat()) & (datas < fim.isoformat())]
+
+    agregacao = {"total": "sum", "quantidade": "size", "media": "mean"}[plano["metrica"]]
+    if not plano["dimensao"]:
+        return pd.DataFrame({nome: [round(dados["VALOR_DESCONTO"].agg(agregacao), 2)]})
+
+    resultado = (
+        dados.groupby(plano["dimensao"], observed=True)["VALOR_DESCONTO"]
+        .agg(agregacao)
+        .round(2)
+        .rename(nome)
+        .reset_index()
+    )
+    if plano["crescente"] is not None:
+        resultado = resultado.sort_values(nome, ascending=plano["crescente"])
+    return resultado.head(plano["limite"]) if plano["limite"] else resultado
+
+
+def responder_pergunta(pergunta, dados=None):
+    try:
+        plano = interpretar(pergunta)
+    except PerguntaSemSuporte as erro:
+        return None, f"❌ {erro} Tente, por exemplo: valor da nf por distribuidora nas ocorrências."
+    if plano is None:
+        return None, f"❌ Não entendi a pergunta. Tente, por exemplo: {'; '.join(EXEMPLOS)}."
+
+    if dados is not None and plano["fonte"] == "descontos" and plano["dimensao"] in (None, *dados.columns):
+        return _agrupar(dados, plano), plano["titulo"]
+    return _executar(plano["fonte"], plano["sql"], plano["params"]), plano["titulo"]
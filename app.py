@@ -1,26 +1,58 @@
 import streamlit as st
+import math
 import pandas as pd
 from datetime import date
-from io import BytesIO
 
-from ai_assistant import responder_pergunta
+import colunar
+import desempenho
+from ai_assistant import EXEMPLOS, responder_pergunta
+from cidades import buscar_filial, sugerir_cidades
+from exportacao import FORMATOS, LINHAS_POR_ABA, exportar
+from ingestao import enfileirar_importacoes, iniciar_fila_importacao
+from relatorios import (
+    DIMENSOES_DESCONTOS,
+    DIMENSOES_OCORRENCIAS,
+    LIMITE_DETALHE,
+    descontos_por,
+    envelhecimento_pendencias,
+    indicadores_descontos,
+    indicadores_ocorrencias,
+    ocorrencias_por,
+    pendencias_na_faixa
+)
 from database import (
-    criar_tabela,
-    criar_tabela_uploads,
-    criar_tabela_ocorrencias,
+    migrar,
     inserir_ocorrencia,
     atualizar_ocorrencia,
+    atualizar_ocorrencias_em_lote,
+    atualizar_ocorrencias_filtradas,
     deletar_ocorrencia,
-    carregar_ocorrencias,
+    consultar_ocorrencias,
+    contar_ocorrencias,
+    facetas,
+    consultar_pendencias,
+    contar_pendencias,
+    sincronizar_tabela,
+    filtrar_quadro,
+    iterar_linhas,
+    consultar_tabela,
+    buscar_texto,
+    contar_tabela,
+    versao_dados,
+    COLUNAS_OCORRENCIAS,
     limpar_dados,
-    inserir_dados,
-    carregar_dados,
-    registrar_upload,
-    criar_tabela_pendencias,
+    carregar_importacoes,
+    carregar_rejeitadas,
+    STATUS_IMPORTACAO_ATIVOS,
+    contar_descontos,
     inserir_pendencia,
-    carregar_pendencias,
     atualizar_pendencia,
-    deletar_pendencia
+    atualizar_pendencias_em_lote,
+    atualizar_pendencias_filtradas,
+    deletar_pendencia,
+    DIAS_ARQUIVAMENTO,
+    arquivar_em_segundo_plano,
+    desarquivar
 )
 
 # ---------- INIT ----------
@@ -29,10 +61,12 @@ st.set_page_config(
     layout="wide"
 )
 
-criar_tabela()
-criar_tabela_uploads()
-criar_tabela_ocorrencias()
-criar_tabela_pendencias()
+migrar()
+iniciar_fila_importacao()
+# Snapshot colunar (opcional): põe em dia as partições que mudaram.
+colunar.atualizar_em_segundo_plano()
+# Encerradas antigas vão para as tabelas de arquivo (uma vez por dia).
+arquivar_em_segundo_plano()
 
 st.title("📦 RPG | Sistema de Gestão de Ocorrências")
 
@@ -45,24 +79,167 @@ menu = st.sidebar.selectbox(
         "📊 Relatórios",
         "🤖 IA - Perguntas",
         "📄 Pendências de Comprovante"
-    ]
+    ] + (["⚙️ Desempenho"] if desempenho.MENU_ADMIN else [])
 )
 
+desempenho.iniciar_rerun(menu)
+
 # ---------- CIDADES X FILIAIS ----------
-@st.cache_data
-def carregar_cidades_filiais():
-    return pd.read_excel("CIDADES X FILIAIS.xlsx")
+def buscar_filial_por_cidade(cidade):
+    return buscar_filial(cidade)
+
+# ---------- DATAS ----------
+# Se uma coluna de data tiver algum texto fora do padrão, otimizar_tipos a
+# deixa como category: o valor da linha pode ser Timestamp ou texto.
+def como_data(valor):
+    data = pd.to_datetime(valor, errors="coerce", format="ISO8601")
+    return None if pd.isna(data) else data.date()
+
+
+def data_para_banco(valor):
+    # Data vira AAAA-MM-DD; texto que não é data volta como estava.
+    data = como_data(valor)
+    if data is not None:
+        return data.strftime("%Y-%m-%d")
+    return None if pd.isna(valor) else str(valor)
+
+# ---------- NÚMEROS ----------
+# Mesma ideia das datas: coluna numérica com texto legado (ex.: "R$ 10,50")
+# chega como texto, e o campo abre vazio em vez de quebrar a página.
+def como_numero(valor, inteiro=False):
+    numero = pd.to_numeric(valor, errors="coerce")
+    if pd.isna(numero):
+        return None
+    return int(numero) if inteiro else float(numero)
+
+
+def numero_para_banco(numero, original):
+    # Campo deixado vazio mantém o valor que já estava gravado.
+    if numero is not None:
+        return numero
+    return None if pd.isna(original) else original
+
+# ---------- EXPORTAÇÃO ----------
+@st.cache_data(max_entries=8, show_spinner="Gerando arquivo...")
+def gerar_exportacao(tabela, filtros, ordenar_por, decrescente, formato, nome_aba, colunas_data, versao, incluir_arquivo=False):
+    # versao só entra na chave do cache: quando os dados mudam, o arquivo é refeito.
+    linhas = iterar_linhas(tabela, filtros, ordenar_por, decrescente, incluir_arquivo=incluir_arquivo)
+    colunas = next(linhas)
+    return exportar(formato, colunas, linhas, nome_aba, colunas_data)
+
+def botao_exportacao(
+    rotulo, tabela, filtros, nome_arquivo, nome_aba, colunas_data=(), ordenar_por="id", decrescente=True, incluir_arquivo=False
+):
+    # O arquivo só é montado quando o usuário pede, não a cada rerun da página.
+    versao = versao_dados(tabela)
+    col_formato, col_botoes = st.columns([1, 2])
+
+    with col_formato:
+        formato = st.radio("Formato", list(FORMATOS), horizontal=True, key=f"formato_{tabela}")
+        if formato == "Excel":
+            total = contar_tabela(tabela, filtros, incluir_arquivo=incluir_arquivo)
+            if total > LINHAS_POR_ABA:
+                st.caption(
+                    f"{total:,} linhas passam do limite do Excel por aba; o arquivo sai dividido em "
+                    f"{math.ceil(total / LINHAS_POR_ABA)} abas. Para uma tabela só, use CSV."
+                )
 
-df_cidades = carregar_cidades_filiais()
+    chave = (formato, repr(filtros), ordenar_por, decrescente, versao, incluir_arquivo)
+    estado = f"exportacao_{tabela}"
+
+    with col_botoes:
+        if st.button(f"📦 Gerar arquivo de {rotulo}", key=f"gerar_{tabela}"):
+            st.session_state[estado] = chave
+
+        if st.session_state.get(estado) == chave:
+            extensao, mime = FORMATOS[formato]
+            st.download_button(
+                f"📥 Exportar {rotulo}",
+                data=gerar_exportacao(
+                    tabela, filtros, ordenar_por, decrescente, formato, nome_aba, colunas_data, versao, incluir_arquivo
+                ),
+                file_name=f"{nome_arquivo}.{extensao}",
+                mime=mime,
+                on_click="ignore"
+            )
 
-def buscar_filial_por_cidade(cidade):
-    if not cidade:
-        return ""
-    cidade = cidade.strip().upper()
-    df = df_cidades.copy()
-    df["CIDADE"] = df["CIDADE"].astype(str).str.strip().str.upper()
-    resultado = df.loc[df["CIDADE"] == cidade, "FILIAL"]
-    return resultado.iloc[0] if not resultado.empty else ""
+# ---------- FILTROS ----------
+def filtros_facetados(tabela, grupos, rotulos, incluir_arquivo=False):
+    # grupos: colunas de filtro de cada coluna da tela. As opções vêm do banco
+    # (valores distintos com contagem) e se restringem pelos outros filtros.
+    chaves = {coluna: f"filtro_{tabela}_{coluna}" for grupo in grupos for coluna in grupo}
+    selecionados = {coluna: st.session_state.get(chave, []) for coluna, chave in chaves.items()}
+    opcoes = facetas(tabela, selecionados, incluir_arquivo=incluir_arquivo)
+
+    filtros = {}
+    for coluna_tela, grupo in zip(st.columns(len(grupos)), grupos):
+        with coluna_tela:
+            for coluna in grupo:
+                contagem = dict(zip(opcoes[coluna]["valor"], opcoes[coluna]["quantidade"]))
+                valores = list(contagem) + [v for v in selecionados[coluna] if v not in contagem]
+                filtros[coluna] = st.multiselect(
+                    rotulos[coluna],
+                    valores,
+                    key=chaves[coluna],
+                    format_func=lambda v, contagem=contagem: f"{v} ({contagem.get(v, 0)})"
+                )
+    return filtros
+
+# ---------- BUSCA ----------
+def caixa_de_busca(tabela, rotulo, colunas):
+    # Busca por palavras no texto livre (índice FTS5), do mais relevante ao menos.
+    texto = st.text_input(rotulo, key=f"busca_{tabela}", placeholder="Digite palavras do texto")
+    if texto.strip():
+        resultado = buscar_texto(tabela, texto)
+        st.caption(f"{len(resultado)} resultado(s), do mais relevante para o menos relevante")
+        st.dataframe(resultado[list(colunas) + ["trecho"]], use_container_width=True, hide_index=True)
+
+# ---------- EDIÇÃO EM LOTE ----------
+def editor_em_lote(df, chave, bloqueadas=("id",)):
+    # A página inteira vira uma tabela editável; o data_editor guarda só as
+    # células alteradas ({posição da linha: {coluna: valor}}), que viram uma
+    # lista de alterações por id para gravar de uma vez.
+    # As posições só valem para as linhas em que a edição foi feita, então a
+    # chave do widget inclui os ids na tela: outra página, filtro, ordem ou
+    # dados que mudaram começam um editor vazio, em vez de aplicar as edições
+    # em outros ids. Devolve (chave do widget, alterações).
+    ids = df["id"].tolist()
+    chave = f"{chave}_{hash(tuple(ids))}"
+    categorias = df.select_dtypes("category").columns
+    st.data_editor(
+        df.astype({coluna: object for coluna in categorias}),
+        use_container_width=True,
+        hide_index=True,
+        disabled=list(bloqueadas),
+        key=chave
+    )
+    editadas = st.session_state.get(chave, {}).get("edited_rows", {})
+    return chave, [{"id": ids[int(posicao)], **valores} for posicao, valores in editadas.items()]
+
+# ---------- ARQUIVO ----------
+def painel_arquivadas(tabela, df, descrever):
+    # Com as arquivadas na tela a página é só de consulta; para editar, a
+    # linha volta para a tabela ativa.
+    st.divider()
+    st.subheader("📦 Arquivadas")
+    st.caption(
+        f"Itens encerrados há mais de {DIAS_ARQUIVAMENTO} dias saem da tabela ativa. "
+        "Desligue a opção de arquivadas para editar, ou desarquive a linha abaixo."
+    )
+
+    rotulos = {r["id"]: descrever(r) for r in df[df["arquivada"] == 1].to_dict("records")}
+    id_escolhido = st.selectbox(
+        "Linha arquivada",
+        list(rotulos),
+        index=None,
+        format_func=rotulos.get,
+        placeholder="Escolha uma linha para desarquivar",
+        key=f"arquivada_{tabela}"
+    )
+    if id_escolhido is not None and st.button("📤 Desarquivar", key=f"desarquivar_{tabela}"):
+        desarquivar(tabela, [id_escolhido])
+        st.success("Linha devolvida para a tabela ativa!")
+        st.rerun()
 
 # ---------------- INÍCIO ----------------
 if menu == "🏠 Início":
@@ -77,38 +254,209 @@ elif menu == "📤 Upload de Planilhas":
         limpar_dados()
         st.success("Dados removidos!")
 
-    uploaded_file = st.file_uploader("Selecione a planilha", type=["xlsx"])
+    uploaded_files = st.file_uploader("Selecione as planilhas", type=["xlsx"], accept_multiple_files=True)
+    todas_abas = st.checkbox("Ler todas as abas de cada planilha (abas sem as colunas de descontos são ignoradas)")
+
+    # As planilhas são lidas em segundo plano, em paralelo: a página não trava
+    # e um rerun não interrompe a importação no meio. O lote entra inteiro.
+    if uploaded_files and st.button(f"📥 Importar {len(uploaded_files)} planilha(s)"):
+        ids = enfileirar_importacoes([(f.name, f.getvalue()) for f in uploaded_files], todas_abas)
+        if ids:
+            st.success(f"{len(ids)} planilha(s) enviada(s) para a fila.")
+        else:
+            st.info("Essas planilhas já estão na fila.")
+
+    importacoes = carregar_importacoes()
+    em_andamento = importacoes["status"].isin(STATUS_IMPORTACAO_ATIVOS).any()
+
+    @st.fragment(run_every=2 if em_andamento else None)
+    def painel_importacoes():
+        importacoes = carregar_importacoes()
+        if importacoes.empty:
+            st.caption("Nenhuma importação ainda.")
+            return
+
+        st.markdown("### 📋 Importações")
+        for job in importacoes[importacoes["status"].isin(STATUS_IMPORTACAO_ATIVOS)].itertuples():
+            st.progress(
+                min(job.linhas_lidas / job.total_estimado, 1.0) if job.total_estimado else 0.0,
+                text=f"#{job.id} {job.nome_arquivo}: {job.status.lower()} ({job.linhas_lidas} linhas lidas)"
+            )
+        st.dataframe(importacoes, use_container_width=True, hide_index=True)
+
+    painel_importacoes()
+
+    # Linhas que a validação recusou, para corrigir na planilha e reenviar.
+    com_rejeitadas = importacoes[importacoes["linhas_rejeitadas"].fillna(0) > 0]
+    if not com_rejeitadas.empty:
+        with st.expander(f"⚠️ Linhas rejeitadas ({int(com_rejeitadas['linhas_rejeitadas'].sum())})"):
+            rotulos = {
+                job.id: f"#{job.id} {job.nome_arquivo} ({int(job.linhas_rejeitadas)} linhas)"
+                for job in com_rejeitadas.itertuples()
+            }
+            id_importacao = st.selectbox("Importação", list(rotulos), format_func=rotulos.get, key="importacao_rejeitadas")
+            rejeitadas = carregar_rejeitadas(id_importacao)
+            st.dataframe(rejeitadas, use_container_width=True, hide_index=True)
+            st.download_button(
+                "📥 Baixar rejeitadas (CSV)",
+                data=exportar("CSV", list(rejeitadas.columns), rejeitadas.itertuples(index=False, name=None)),
+                file_name=f"rejeitadas_importacao_{id_importacao}.csv",
+                mime="text/csv",
+                on_click="ignore"
+            )
 
-    if uploaded_file:
-        df = pd.read_excel(uploaded_file)
-        inserir_dados(df)
-        registrar_upload(uploaded_file.name)
-        st.success("Planilha carregada com sucesso!")
-        st.dataframe(df, use_container_width=True)
+    desempenho.marcar("importações")
 
 # ---------------- RELATÓRIOS ----------------
 elif menu == "📊 Relatórios":
     st.subheader("📊 Relatórios")
-    dados = carregar_dados()
 
-    if dados.empty:
-        st.warning("Nenhum dado encontrado.")
-    else:
-        st.dataframe(dados, use_container_width=True)
+    # Só agregados vêm do banco; o detalhe é lido quando um grupo é escolhido.
+    aba_descontos, aba_ocorrencias, aba_pendencias = st.tabs(
+        ["💸 Descontos", "📝 Ocorrências", "📄 Pendências"]
+    )
+
+    with aba_descontos:
+        if contar_descontos() == 0:
+            st.warning("Nenhum dado encontrado.")
+        else:
+            filtros = filtros_facetados(
+                "descontos",
+                [["DISTRIBUIDORA", "FECHAMENTO"], ["BASE", "CIDADE"], ["OBSERVACAO"]],
+                {
+                    "DISTRIBUIDORA": "Distribuidora",
+                    "FECHAMENTO": "Fechamento",
+                    "BASE": "Base",
+                    "CIDADE": "Cidade",
+                    "OBSERVACAO": "Tipo",
+                }
+            )
+            caixa_de_busca(
+                "descontos",
+                "🔎 Buscar na Observação",
+                ["id", "NF", "DISTRIBUIDORA", "FECHAMENTO", "VALOR_DESCONTO"]
+            )
+
+            kpi = indicadores_descontos(filtros)
+            col1, col2, col3, col4 = st.columns(4)
+            col1.metric("Total descontado", f"R$ {kpi['total']:,.2f}")
+            col2.metric("Descontos", kpi["quantidade"])
+            col3.metric("Desconto médio", f"R$ {kpi['medio']:,.2f}")
+            col4.metric("Distribuidoras", kpi["distribuidoras"])
+
+            rotulo = st.radio("Agrupar por", list(DIMENSOES_DESCONTOS), horizontal=True, key="dimensao_descontos")
+            dimensao = DIMENSOES_DESCONTOS[rotulo]
+            resumo = descontos_por(dimensao, filtros)
+
+            st.bar_chart(resumo.head(30), x=dimensao, y="VALOR_DESCONTO")
+            st.dataframe(resumo, use_container_width=True, hide_index=True)
+
+            valor = st.selectbox(
+                f"🔍 Detalhar {rotulo}",
+                resumo[dimensao].tolist(),
+                index=None,
+                placeholder="Escolha um grupo para ver os descontos"
+            )
+            if valor is not None:
+                filtros_detalhe = {**filtros, dimensao: [valor]}
+                st.caption(
+                    f"{contar_tabela('descontos', filtros_detalhe)} desconto(s) | "
+                    f"mostrando até {LIMITE_DETALHE}, do maior para o menor"
+                )
+                st.dataframe(
+                    consultar_tabela(
+                        "descontos", filtros_detalhe, limite=LIMITE_DETALHE, ordenar_por="VALOR_DESCONTO"
+                    ),
+                    use_container_width=True,
+                    hide_index=True
+                )
+
+    desempenho.marcar("descontos")
+
+    with aba_ocorrencias:
+        arquivadas = st.checkbox("Incluir ocorrências arquivadas", key="relatorio_ocorrencias_arquivo")
+        kpi = indicadores_ocorrencias(incluir_arquivo=arquivadas)
+        if kpi["quantidade"] == 0:
+            st.info("Nenhuma ocorrência cadastrada.")
+        else:
+            col1, col2, col3, col4 = st.columns(4)
+            col1.metric("Ocorrências", kpi["quantidade"])
+            col2.metric("Valor das NFs", f"R$ {kpi['valor_nf']:,.2f}")
+            col3.metric("Valor das ocorrências", f"R$ {kpi['valor_ocorrencia']:,.2f}")
+            col4.metric("Ocorrência / NF", f"{kpi['percentual']:.2f}%")
+
+            rotulo = st.radio("Agrupar por", list(DIMENSOES_OCORRENCIAS), horizontal=True, key="dimensao_ocorrencias")
+            dimensao = DIMENSOES_OCORRENCIAS[rotulo]
+            resumo = ocorrencias_por(dimensao, incluir_arquivo=arquivadas)
+
+            st.bar_chart(resumo.head(30), x=dimensao, y=["valor_nf", "valor_ocorrencia"], stack=False)
+            st.dataframe(resumo, use_container_width=True, hide_index=True)
+
+            valor = st.selectbox(
+                f"🔍 Detalhar {rotulo}",
+                resumo[dimensao].tolist(),
+                index=None,
+                placeholder="Escolha um grupo para ver as ocorrências"
+            )
+            if valor is not None:
+                filtros_detalhe = {dimensao: [valor]}
+                st.caption(
+                    f"{contar_tabela('ocorrencias', filtros_detalhe, incluir_arquivo=arquivadas)} ocorrência(s) | "
+                    f"mostrando até {LIMITE_DETALHE}, do maior valor para o menor"
+                )
+                st.dataframe(
+                    consultar_tabela(
+                        "ocorrencias", filtros_detalhe, limite=LIMITE_DETALHE, ordenar_por="valor_ocorrencia",
+                        incluir_arquivo=arquivadas
+                    ),
+                    use_container_width=True,
+                    hide_index=True
+                )
+
+    desempenho.marcar("ocorrências")
+
+    with aba_pendencias:
+        incluir = st.checkbox("Incluir regularizadas (e arquivadas)", key="aging_regularizadas")
+        hoje = date.today().isoformat()
+        aging = envelhecimento_pendencias(hoje, incluir)
+
+        if aging.empty:
+            st.info("Nenhuma pendência em aberto.")
+        else:
+            st.caption("Pendências por tempo desde a emissão da NF")
+            st.bar_chart(aging)
+            st.dataframe(aging, use_container_width=True)
+
+            faixa = st.selectbox(
+                "🔍 Detalhar faixa",
+                aging.index.tolist(),
+                index=None,
+                placeholder="Escolha uma faixa para ver as pendências"
+            )
+            if faixa is not None:
+                st.dataframe(
+                    pendencias_na_faixa(hoje, faixa, incluir),
+                    use_container_width=True,
+                    hide_index=True
+                )
+
+    desempenho.marcar("pendências")
 
 # ---------------- IA ----------------
 elif menu == "🤖 IA - Perguntas":
     st.subheader("🤖 Perguntas inteligentes")
-    dados = carregar_dados()
+    st.caption("Exemplos: " + " · ".join(f"“{exemplo}”" for exemplo in EXEMPLOS))
 
     pergunta = st.text_input("Digite sua pergunta")
 
     if pergunta:
-        resultado, titulo = responder_pergunta(pergunta, dados)
+        resultado, titulo = responder_pergunta(pergunta)
         st.write(titulo)
         if resultado is not None:
             st.dataframe(resultado, use_container_width=True)
 
+    desempenho.marcar("resposta")
+
 # ---------- CADASTRO DE OCORRÊNCIAS ----------
 elif menu == "📝 Cadastro de Ocorrências":
 
@@ -125,6 +473,11 @@ elif menu == "📝 Cadastro de Ocorrências":
         filial = buscar_filial_por_cidade(cidade_nf)
         st.text_input("Filial (automática)", filial, disabled=True)
 
+        if cidade_nf and not filial:
+            sugestoes = sugerir_cidades(cidade_nf)
+            if sugestoes:
+                st.caption("Cidade não encontrada. Você quis dizer: " + ", ".join(sugestoes) + "?")
+
         ocorrencia = st.selectbox("Ocorrência", ["EXTRAVIO", "AVARIA", "SINISTRO"])
         vol_total_nf = st.number_input("Volume Total", min_value=0)
         volume_ocorrencia = st.number_input("Volume Ocorrência", min_value=0)
@@ -159,117 +512,219 @@ elif menu == "📝 Cadastro de Ocorrências":
             st.success("Ocorrência cadastrada com sucesso!")
             st.rerun()
 
+    desempenho.marcar("nova ocorrência")
+
     # ---------- TABELA + FILTROS ----------
     st.divider()
     st.subheader("📊 Tabela Consolidada de Ocorrências")
 
-    df = carregar_ocorrencias()
-
-    if df.empty:
+    if contar_ocorrencias(incluir_arquivo=True) == 0:
         st.info("Nenhuma ocorrência cadastrada.")
         st.stop()
 
-    df["emissao_nf"] = pd.to_datetime(df["emissao_nf"], errors="coerce")
+    incluir_arquivo = st.toggle("📦 Incluir ocorrências arquivadas (só consulta)", key="arquivo_ocorrencias")
+
+    caixa_de_busca(
+        "ocorrencias",
+        "🔎 Buscar no Follow Up",
+        ["id", "nota_fiscal", "distribuidora", "status_rpg"]
+    )
+
+    desempenho.marcar("busca")
 
     st.markdown("### 🔎 Filtros")
-    col1, col2, col3 = st.columns(3)
-
-    with col1:
-        f_distribuidora = st.multiselect("Distribuidora", sorted(df["distribuidora"].dropna().unique()))
-        f_pedido = st.multiselect("Pedido", sorted(df["pedido"].dropna().unique()))
-        f_nf = st.multiselect("Nota Fiscal", sorted(df["nota_fiscal"].dropna().unique()))
-
-    with col2:
-        f_cidade = st.multiselect("Cidade da NF", sorted(df["cidade_nf"].dropna().unique()))
-        f_filial = st.multiselect("Filial", sorted(df["filial"].dropna().unique()))
-        f_ocorrencia = st.multiselect("Ocorrência", sorted(df["ocorrencia"].dropna().unique()))
-
-    with col3:
-        f_status = st.multiselect("Status Atual", sorted(df["status_atual"].dropna().unique()))
-        f_follow = st.multiselect("Follow Up", sorted(df["follow_up"].dropna().unique()))
-        f_rpg = st.multiselect("Status RPG", sorted(df["status_rpg"].dropna().unique()))
-
-    if f_distribuidora: df = df[df["distribuidora"].isin(f_distribuidora)]
-    if f_pedido: df = df[df["pedido"].isin(f_pedido)]
-    if f_nf: df = df[df["nota_fiscal"].isin(f_nf)]
-    if f_cidade: df = df[df["cidade_nf"].isin(f_cidade)]
-    if f_filial: df = df[df["filial"].isin(f_filial)]
-    if f_ocorrencia: df = df[df["ocorrencia"].isin(f_ocorrencia)]
-    if f_status: df = df[df["status_atual"].isin(f_status)]
-    if f_follow: df = df[df["follow_up"].isin(f_follow)]
-    if f_rpg: df = df[df["status_rpg"].isin(f_rpg)]
-
-    st.dataframe(df, use_container_width=True)
+    filtros = filtros_facetados(
+        "ocorrencias",
+        [
+            ["distribuidora", "pedido", "nota_fiscal"],
+            ["cidade_nf", "filial", "ocorrencia"],
+            ["status_atual", "status_rpg"],
+        ],
+        {
+            "distribuidora": "Distribuidora",
+            "pedido": "Pedido",
+            "nota_fiscal": "Nota Fiscal",
+            "cidade_nf": "Cidade da NF",
+            "filial": "Filial",
+            "ocorrencia": "Ocorrência",
+            "status_atual": "Status Atual",
+            "status_rpg": "Status RPG",
+        },
+        incluir_arquivo
+    )
+
+    desempenho.marcar("filtros")
+
+    col_ordem, col_direcao, col_tamanho, col_pagina = st.columns(4)
+
+    with col_ordem:
+        ordenar_por = st.selectbox("Ordenar por", COLUNAS_OCORRENCIAS)
+    with col_direcao:
+        decrescente = st.radio("Ordem", ["Decrescente", "Crescente"], horizontal=True) == "Decrescente"
+    with col_tamanho:
+        por_pagina = st.selectbox("Linhas por página", [25, 50, 100, 200], index=1)
+
+    total = contar_ocorrencias(filtros, incluir_arquivo=incluir_arquivo)
+    total_paginas = max(math.ceil(total / por_pagina), 1)
+
+    with col_pagina:
+        pagina = st.number_input("Página", min_value=1, max_value=total_paginas, value=1)
+
+    df = consultar_ocorrencias(
+        filtros,
+        limite=por_pagina,
+        offset=(pagina - 1) * por_pagina,
+        ordenar_por=ordenar_por,
+        decrescente=decrescente,
+        incluir_arquivo=incluir_arquivo
+    )
+
+    st.caption(f"{total} ocorrência(s) | página {pagina} de {total_paginas}")
+
+    if not incluir_arquivo and st.toggle("✏️ Editar a página direto na tabela", key="lote_ocorrencias"):
+        chave_editor, alteracoes = editor_em_lote(df, "editor_ocorrencias", bloqueadas=("id", "data_ultimo_status"))
+        if st.button(f"💾 Salvar {len(alteracoes)} linha(s) alterada(s)", disabled=not alteracoes):
+            for alteracao in alteracoes:
+                alteracao["data_ultimo_status"] = date.today().isoformat()
+            atualizar_ocorrencias_em_lote(alteracoes)
+            del st.session_state[chave_editor]
+            st.success("Ocorrências atualizadas!")
+            st.rerun()
+        selecionadas = []
+    else:
+        evento = st.dataframe(
+            df,
+            use_container_width=True,
+            on_select="rerun",
+            selection_mode="single-row",
+            key="tabela_ocorrencias"
+        )
+        selecionadas = evento.selection.rows
+
+    desempenho.marcar("tabela")
 
     # ---------- EXPORTAÇÃO ----------
-    output = BytesIO()
-    with pd.ExcelWriter(output, engine="openpyxl") as writer:
-        df.to_excel(writer, index=False)
-    output.seek(0)
-
-    st.download_button(
-        "📥 Exportar Ocorrências para Excel",
-        data=output,
-        file_name="ocorrencias_rpg.xlsx",
-        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+    botao_exportacao(
+        "Ocorrências",
+        "ocorrencias",
+        filtros,
+        "ocorrencias_rpg",
+        "Ocorrencias",
+        colunas_data=("emissao_nf",),
+        ordenar_por=ordenar_por,
+        decrescente=decrescente,
+        incluir_arquivo=incluir_arquivo
     )
 
+    desempenho.marcar("exportação")
+
+    if incluir_arquivo:
+        painel_arquivadas("ocorrencias", df, lambda r: f"📄 NF {r['nota_fiscal']} | {r['distribuidora']}")
+        st.stop()
+
+    # ---------- STATUS EM LOTE ----------
+    with st.expander(f"⚡ Alterar o status das {total} ocorrência(s) filtradas"):
+        with st.form("status_lote_ocorrencias"):
+            novo_status_atual = st.text_input("Novo Status Atual (vazio = manter)")
+            novo_status_rpg = st.text_input("Novo Status RPG (vazio = manter)")
+            confirmar = st.checkbox(f"Confirmo a alteração de {total} ocorrência(s)")
+
+            if st.form_submit_button("⚡ Aplicar às ocorrências filtradas"):
+                valores = {
+                    coluna: valor.strip()
+                    for coluna, valor in (("status_atual", novo_status_atual), ("status_rpg", novo_status_rpg))
+                    if valor.strip()
+                }
+                if not valores:
+                    st.warning("Informe pelo menos um status.")
+                elif not confirmar:
+                    st.warning("Marque a confirmação para aplicar.")
+                else:
+                    valores["data_ultimo_status"] = date.today().isoformat()
+                    alteradas = atualizar_ocorrencias_filtradas(filtros, valores)
+                    st.success(f"{alteradas} ocorrência(s) atualizada(s)!")
+                    st.rerun()
+
+    desempenho.marcar("status em lote")
+
     # ---------- EDIÇÃO ESPELHADA ----------
     st.divider()
     st.subheader("✏️ Editar / 🗑 Apagar Ocorrências")
 
-    for _, row in df.iterrows():
-        with st.expander(f"📄 NF {row['nota_fiscal']} | {row['distribuidora']}"):
-            with st.form(f"edit_{row['id']}"):
-
-                distribuidora = st.text_input("Distribuidora", row["distribuidora"])
-                pedido = st.text_input("Pedido", row["pedido"])
-                nota_fiscal = st.text_input("Nota Fiscal", row["nota_fiscal"])
-                emissao_nf = st.date_input("Emissão NF", row["emissao_nf"].date())
-
-                cidade_nf = st.text_input("Cidade NF", row["cidade_nf"])
-                filial = st.text_input("Filial", row["filial"])
-
-                ocorrencia = st.text_input("Ocorrência", row["ocorrencia"])
-                vol_total_nf = st.number_input("Volume Total", value=int(row["vol_total_nf"]))
-                volume_ocorrencia = st.number_input("Volume Ocorrência", value=int(row["volume_ocorrencia"]))
-
-                valor_nf = st.number_input("Valor NF", value=float(row["valor_nf"]))
-                valor_ocorrencia = st.number_input("Valor Ocorrência", value=float(row["valor_ocorrencia"]))
-
-                status_atual = st.text_input("Status Atual", row["status_atual"])
-                follow_up = st.text_area("Follow Up", row["follow_up"])
-                status_rpg = st.text_input("Status RPG", row["status_rpg"])
-
-                salvar = st.form_submit_button("💾 Salvar Alterações")
-
-                if salvar:
-                    atualizar_ocorrencia(
-                        row["id"],
-                        distribuidora,
-                        pedido,
-                        nota_fiscal,
-                        emissao_nf.strftime("%Y-%m-%d"),
-                        valor_nf,
-                        cidade_nf,
-                        filial,
-                        ocorrencia,
-                        vol_total_nf,
-                        volume_ocorrencia,
-                        status_atual,
-                        date.today().isoformat(),
-                        follow_up,
-                        status_rpg,
-                        valor_ocorrencia
-                    )
-                    st.success("Ocorrência atualizada!")
-                    st.rerun()
+    # Só a ocorrência escolhida ganha formulário, então a quantidade de widgets
+    # não cresce com o tamanho da tabela.
+    st.caption("Selecione uma linha na tabela acima ou escolha a NF abaixo.")
+
+    rotulos = {
+        r["id"]: f"📄 NF {r['nota_fiscal']} | {r['distribuidora']}"
+        for r in df[["id", "nota_fiscal", "distribuidora"]].to_dict("records")
+    }
+
+    id_escolhido = st.selectbox(
+        "Ocorrência",
+        list(rotulos),
+        index=selecionadas[0] if selecionadas else None,
+        format_func=rotulos.get,
+        placeholder="Escolha uma ocorrência para editar"
+    )
+
+    if id_escolhido is not None:
+        row = df.loc[df["id"] == id_escolhido].iloc[0]
+
+        with st.form(f"edit_{row['id']}"):
+
+            distribuidora = st.text_input("Distribuidora", row["distribuidora"])
+            pedido = st.text_input("Pedido", row["pedido"])
+            nota_fiscal = st.text_input("Nota Fiscal", row["nota_fiscal"])
+            emissao_nf = st.date_input("Emissão NF", como_data(row["emissao_nf"]))
+
+            cidade_nf = st.text_input("Cidade NF", row["cidade_nf"])
+            filial = st.text_input("Filial", row["filial"])
+
+            ocorrencia = st.text_input("Ocorrência", row["ocorrencia"])
+            vol_total_nf = st.number_input("Volume Total", value=como_numero(row["vol_total_nf"], inteiro=True), step=1)
+            volume_ocorrencia = st.number_input(
+                "Volume Ocorrência", value=como_numero(row["volume_ocorrencia"], inteiro=True), step=1
+            )
 
-            if st.button("🗑 Excluir", key=f"del_{row['id']}"):
-                deletar_ocorrencia(row["id"])
-                st.success("Ocorrência excluída!")
+            valor_nf = st.number_input("Valor NF", value=como_numero(row["valor_nf"]))
+            valor_ocorrencia = st.number_input("Valor Ocorrência", value=como_numero(row["valor_ocorrencia"]))
+
+            status_atual = st.text_input("Status Atual", row["status_atual"])
+            follow_up = st.text_area("Follow Up", row["follow_up"])
+            status_rpg = st.text_input("Status RPG", row["status_rpg"])
+
+            salvar = st.form_submit_button("💾 Salvar Alterações")
+
+            if salvar:
+                atualizar_ocorrencia(
+                    row["id"],
+                    distribuidora,
+                    pedido,
+                    nota_fiscal,
+                    data_para_banco(emissao_nf or row["emissao_nf"]),
+                    numero_para_banco(valor_nf, row["valor_nf"]),
+                    cidade_nf,
+                    filial,
+                    ocorrencia,
+                    numero_para_banco(vol_total_nf, row["vol_total_nf"]),
+                    numero_para_banco(volume_ocorrencia, row["volume_ocorrencia"]),
+                    status_atual,
+                    date.today().isoformat(),
+                    follow_up,
+                    status_rpg,
+                    numero_para_banco(valor_ocorrencia, row["valor_ocorrencia"])
+                )
+                st.success("Ocorrência atualizada!")
                 st.rerun()
 
+        if st.button("🗑 Excluir", key=f"del_{row['id']}"):
+            deletar_ocorrencia(row["id"])
+            st.success("Ocorrência excluída!")
+            st.rerun()
+
+    desempenho.marcar("edição")
+
 #---------- Pendências_de_comprovante --------
 
 elif menu == "📄 Pendências de Comprovante":
@@ -304,90 +759,188 @@ elif menu == "📄 Pendências de Comprovante":
             st.success("Pendência cadastrada com sucesso!")
             st.rerun()
 
+    desempenho.marcar("nova pendência")
+
     st.divider()
     st.subheader("📊 Pendências de Comprovante")
 
-    df = carregar_pendencias()
-
-    if df.empty:
+    if contar_pendencias(incluir_arquivo=True) == 0:
         st.info("Nenhuma pendência cadastrada.")
         st.stop()
 
-    df["emissao"] = pd.to_datetime(df["emissao"], errors="coerce")
-    df["saida"] = pd.to_datetime(df["saida"], errors="coerce")
+    incluir_arquivo = st.toggle("📦 Incluir pendências arquivadas (só consulta)", key="arquivo_pendencias")
+
+    caixa_de_busca(
+        "pendencias_comprovante",
+        "🔎 Buscar nas Observações",
+        ["id", "nota_fiscal", "motorista", "status"]
+    )
+
+    desempenho.marcar("busca")
 
     st.markdown("### 🔎 Filtros")
+    filtros = filtros_facetados(
+        "pendencias_comprovante",
+        [
+            ["motorista", "distribuidora"],
+            ["nota_fiscal", "manifesto"],
+            ["status"],
+        ],
+        {
+            "motorista": "Motorista",
+            "distribuidora": "Distribuidora",
+            "nota_fiscal": "Nota Fiscal",
+            "manifesto": "Manifesto",
+            "status": "Status",
+        },
+        incluir_arquivo
+    )
 
-    col1, col2, col3 = st.columns(3)
-
-    with col1:
-        f_motorista = st.multiselect("Motorista", sorted(df["motorista"].dropna().unique()))
-        f_dist = st.multiselect("Distribuidora", sorted(df["distribuidora"].dropna().unique()))
-
-    with col2:
-        f_nf = st.multiselect("Nota Fiscal", sorted(df["nota_fiscal"].dropna().unique()))
-        f_manifesto = st.multiselect("Manifesto", sorted(df["manifesto"].dropna().unique()))
-
-    with col3:
-        f_status = st.multiselect("Status", sorted(df["status"].dropna().unique()))
-
-    if f_motorista:
-        df = df[df["motorista"].isin(f_motorista)]
-    if f_dist:
-        df = df[df["distribuidora"].isin(f_dist)]
-    if f_nf:
-        df = df[df["nota_fiscal"].isin(f_nf)]
-    if f_manifesto:
-        df = df[df["manifesto"].isin(f_manifesto)]
-    if f_status:
-        df = df[df["status"].isin(f_status)]
-
-    st.dataframe(df, use_container_width=True)
-
-    output = BytesIO()
-    with pd.ExcelWriter(output, engine="openpyxl") as writer:
-        df.to_excel(writer, index=False, sheet_name="Pendencias")
-    output.seek(0)
-
-    st.download_button(
-        "📥 Exportar Pendências",
-        data=output,
-        file_name="pendencias_comprovante.xlsx",
-        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+    desempenho.marcar("filtros")
+
+    # A tabela ativa fica na sessão; a cada rerun só vem do banco o que mudou
+    # desde a última vez (ver sincronizar_tabela). O arquivo é lido sob demanda.
+    if incluir_arquivo:
+        df = consultar_pendencias(filtros, incluir_arquivo=True)
+    else:
+        st.session_state["sinc_pendencias"] = sincronizar_tabela(
+            "pendencias_comprovante",
+            st.session_state.get("sinc_pendencias")
+        )
+        df = filtrar_quadro("pendencias_comprovante", st.session_state["sinc_pendencias"]["df"], filtros)
+
+    if not incluir_arquivo and st.toggle("✏️ Editar direto na tabela", key="lote_pendencias"):
+        chave_editor, alteracoes = editor_em_lote(df, "editor_pendencias")
+        if st.button(f"💾 Salvar {len(alteracoes)} linha(s) alterada(s)", disabled=not alteracoes):
+            atualizar_pendencias_em_lote(alteracoes)
+            del st.session_state[chave_editor]
+            st.success("Pendências atualizadas!")
+            st.rerun()
+        selecionadas = []
+    else:
+        evento = st.dataframe(
+            df,
+            use_container_width=True,
+            on_select="rerun",
+            selection_mode="single-row",
+            key="tabela_pendencias"
+        )
+        selecionadas = evento.selection.rows
+
+    desempenho.marcar("tabela")
+
+    botao_exportacao(
+        "Pendências",
+        "pendencias_comprovante",
+        filtros,
+        "pendencias_comprovante",
+        "Pendencias",
+        colunas_data=("emissao", "saida"),
+        incluir_arquivo=incluir_arquivo
     )
 
+    desempenho.marcar("exportação")
+
+    if incluir_arquivo:
+        painel_arquivadas("pendencias_comprovante", df, lambda r: f"📄 NF {r['nota_fiscal']} | {r['motorista']}")
+        st.stop()
+
+    with st.expander(f"⚡ Alterar o status das {len(df)} pendência(s) filtradas"):
+        with st.form("status_lote_pendencias"):
+            novo_status = st.selectbox("Novo status", ["PENDENTE", "ENVIADO", "REGULARIZADO"])
+            confirmar = st.checkbox(f"Confirmo a alteração de {len(df)} pendência(s)")
+
+            if st.form_submit_button("⚡ Aplicar às pendências filtradas"):
+                if not confirmar:
+                    st.warning("Marque a confirmação para aplicar.")
+                else:
+                    alteradas = atualizar_pendencias_filtradas(filtros, {"status": novo_status})
+                    st.success(f"{alteradas} pendência(s) atualizada(s)!")
+                    st.rerun()
+
+    desempenho.marcar("status em lote")
+
     st.divider()
     st.subheader("✏️ Editar / 🗑 Excluir Pendências")
 
-    for _, row in df.iterrows():
-        with st.expander(f"📄 NF {row['nota_fiscal']} | {row['motorista']}"):
-            with st.form(f"edit_pend_{row['id']}"):
-                obs = st.text_area("Observações", row["obs"])
-                status = st.selectbox(
-                    "Status",
-                    ["PENDENTE", "ENVIADO", "REGULARIZADO"],
-                    index=["PENDENTE", "ENVIADO", "REGULARIZADO"].index(row["status"])
-                )
+    st.caption("Selecione uma linha na tabela acima ou escolha a NF abaixo.")
 
-                salvar = st.form_submit_button("💾 Atualizar")
-
-                if salvar:
-                    atualizar_pendencia(
-                        row["id"],
-                        row["motorista"],
-                        row["distribuidora"],
-                        row["nota_fiscal"],
-                        row["emissao"].strftime("%Y-%m-%d"),
-                        row["saida"].strftime("%Y-%m-%d"),
-                        row["manifesto"],
-                        obs,
-                        status
-                    )
-                    st.success("Pendência atualizada!")
-                    st.rerun()
+    rotulos = {
+        r["id"]: f"📄 NF {r['nota_fiscal']} | {r['motorista']}"
+        for r in df[["id", "nota_fiscal", "motorista"]].to_dict("records")
+    }
+
+    id_escolhido = st.selectbox(
+        "Pendência",
+        list(rotulos),
+        index=selecionadas[0] if selecionadas else None,
+        format_func=rotulos.get,
+        placeholder="Escolha uma pendência para editar"
+    )
+
+    if id_escolhido is not None:
+        row = df.loc[df["id"] == id_escolhido].iloc[0]
+
+        with st.form(f"edit_pend_{row['id']}"):
+            obs = st.text_area("Observações", row["obs"])
+            status = st.selectbox(
+                "Status",
+                ["PENDENTE", "ENVIADO", "REGULARIZADO"],
+                index=["PENDENTE", "ENVIADO", "REGULARIZADO"].index(row["status"])
+            )
 
-            if st.button("🗑 Excluir", key=f"del_pend_{row['id']}"):
-                deletar_pendencia(row["id"])
-                st.success("Pendência excluída!")
+            salvar = st.form_submit_button("💾 Atualizar")
+
+            if salvar:
+                atualizar_pendencia(
+                    row["id"],
+                    row["motorista"],
+                    row["distribuidora"],
+                    row["nota_fiscal"],
+                    data_para_banco(row["emissao"]),
+                    data_para_banco(row["saida"]),
+                    row["manifesto"],
+                    obs,
+                    status
+                )
+                st.success("Pendência atualizada!")
                 st.rerun()
 
+        if st.button("🗑 Excluir", key=f"del_pend_{row['id']}"):
+            deletar_pendencia(row["id"])
+            st.success("Pendência excluída!")
+            st.rerun()
+
+    desempenho.marcar("edição")
+
+# ---------------- DESEMPENHO (ADMIN) ----------------
+elif menu == "⚙️ Desempenho":
+    st.subheader("⚙️ Desempenho")
+
+    coletar = st.toggle("Coletar medições (vale para todas as sessões)", value=desempenho.ativo())
+    if coletar != desempenho.ativo():
+        desempenho.ativar(coletar)
+        st.rerun()
+
+    if desempenho.ARQUIVO_LOG:
+        st.caption(f"Medições também gravadas em {desempenho.ARQUIVO_LOG} (JSON lines).")
+
+    medicoes = desempenho.tabela_medicoes()
+    if st.button("🗑 Limpar medições"):
+        desempenho.limpar()
+        st.rerun()
+
+    if medicoes.empty:
+        st.info("Nenhuma medição ainda. Ligue a coleta e navegue pelas páginas.")
+    else:
+        st.markdown("### ⏱ Percentis por função e trecho (ms)")
+        st.dataframe(desempenho.percentis(medicoes), use_container_width=True, hide_index=True)
+
+        st.markdown("### 🐢 Chamadas mais lentas")
+        st.dataframe(desempenho.mais_lentas(medicoes), use_container_width=True, hide_index=True)
+
+        st.markdown("### 🔁 Últimos reruns por trecho (ms)")
+        st.dataframe(desempenho.por_rerun(medicoes), use_container_width=True, hide_index=True)
+
+# Reruns interrompidos por st.stop() (tabelas vazias) não chegam aqui.
+desempenho.finalizar_rerun()
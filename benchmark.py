@@ -0,0 +1,537 @@
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import subprocess
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+import pandas as pd
+
+import colunar
+import database
+import ingestao
+
+
+# =========================
+# UTILITÁRIOS
+# =========================
+def cronometrar(funcao, repeticoes):
+    inicio = time.perf_counter()
+    for _ in range(repeticoes):
+        funcao()
+    duracao = time.perf_counter() - inicio
+    return repeticoes / duracao if duracao else float("inf")
+
+
+def preparar_banco(pasta):
+    database.fechar_conexoes()
+    database.DB_PATH = os.path.join(pasta, "bench.db")
+    database.criar_tabela_ocorrencias()
+    database.criar_tabela_pendencias()
+
+
+# =========================
+# CONEXÃO: POR CHAMADA x POOL
+# =========================
+def _leitura_por_chamada():
+    # Comportamento antigo: abre, executa uma instrução e fecha.
+    conn = sqlite3.connect(database.DB_PATH)
+    conn.execute("SELECT COUNT(*) FROM ocorrencias").fetchone()
+    conn.close()
+
+
+def _escrita_por_chamada():
+    conn = sqlite3.connect(database.DB_PATH)
+    conn.execute(
+        "INSERT INTO pendencias_comprovante (motorista, status) VALUES (?, ?)",
+        ("BENCH", "PENDENTE")
+    )
+    conn.commit()
+    conn.close()
+
+
+def _leitura_pool():
+    with database.conexao() as conn:
+        conn.execute("SELECT COUNT(*) FROM ocorrencias").fetchone()
+
+
+def _escrita_pool():
+    with database.transacao() as conn:
+        conn.execute(
+            "INSERT INTO pendencias_comprovante (motorista, status) VALUES (?, ?)",
+            ("BENCH", "PENDENTE")
+        )
+
+
+def bench_conexao(repeticoes):
+    resultados = {}
+    with tempfile.TemporaryDirectory() as pasta:
+        preparar_banco(pasta)
+        # A medição "por chamada" roda antes do pool, com o arquivo ainda em
+        # modo rollback journal, como o dados.db original.
+        with database.conexao() as conn:
+            conn.execute("PRAGMA journal_mode = DELETE")
+        database.fechar_conexoes()
+
+        resultados["leitura_por_chamada"] = cronometrar(_leitura_por_chamada, repeticoes)
+        resultados["escrita_por_chamada"] = cronometrar(_escrita_por_chamada, repeticoes)
+        resultados["leitura_pool"] = cronometrar(_leitura_pool, repeticoes)
+        resultados["escrita_pool"] = cronometrar(_escrita_pool, repeticoes)
+        database.fechar_conexoes()
+    return resultados
+
+
+# =========================
+# EDIÇÃO: UM FORMULÁRIO POR LINHA x LINHA SELECIONADA
+# =========================
+# As duas páginas abaixo são executadas pelo AppTest do Streamlit; por isso
+# cada uma importa o que usa e recebe os dados como argumento.
+def _pagina_form_por_linha(df):
+    import streamlit as st
+
+    for _, row in df.iterrows():
+        with st.expander(f"NF {row['nota_fiscal']} | {row['distribuidora']}"):
+            with st.form(f"edit_{row['id']}"):
+                for coluna in df.columns[1:]:
+                    st.text_input(coluna, str(row[coluna]))
+                st.form_submit_button("Salvar")
+            st.button("Excluir", key=f"del_{row['id']}")
+
+
+def _pagina_linha_selecionada(df):
+    import streamlit as st
+
+    evento = st.dataframe(df, on_select="rerun", selection_mode="single-row")
+    selecionadas = evento.selection.rows
+    rotulos = dict(zip(df["id"], "NF " + df["nota_fiscal"]))
+    id_escolhido = st.selectbox(
+        "Ocorrência",
+        list(rotulos),
+        index=selecionadas[0] if selecionadas else 0,
+        format_func=rotulos.get
+    )
+    row = df.loc[df["id"] == id_escolhido].iloc[0]
+    with st.form("edit"):
+        for coluna in df.columns[1:]:
+            st.text_input(coluna, str(row[coluna]))
+        st.form_submit_button("Salvar")
+    st.button("Excluir")
+
+
+def _ocorrencias_sinteticas(linhas):
+    import pandas as pd
+
+    return pd.DataFrame({
+        "id": range(1, linhas + 1),
+        "distribuidora": [f"DIST {i % 20}" for i in range(linhas)],
+        "pedido": [f"P{i}" for i in range(linhas)],
+        "nota_fiscal": [f"{100000 + i}" for i in range(linhas)],
+        "cidade_nf": [f"CIDADE {i % 400}" for i in range(linhas)],
+        "filial": [f"FILIAL {i % 30}" for i in range(linhas)],
+        "ocorrencia": ["AVARIA", "EXTRAVIO", "SINISTRO"] * (linhas // 3) + ["AVARIA"] * (linhas % 3),
+        "status_rpg": ["ABERTO"] * linhas,
+    })
+
+
+def bench_edicao(tamanhos):
+    from streamlit.testing.v1 import AppTest
+
+    resultados = {}
+    for linhas in tamanhos:
+        df = _ocorrencias_sinteticas(linhas)
+        for nome, pagina in (("form_por_linha", _pagina_form_por_linha),
+                             ("linha_selecionada", _pagina_linha_selecionada)):
+            app = AppTest.from_function(pagina, args=(df,), default_timeout=3600)
+            inicio = time.perf_counter()
+            app.run()
+            resultados[f"{nome}_{linhas}"] = time.perf_counter() - inicio
+    return resultados
+
+
+# =========================
+# DADOS SINTÉTICOS
+# =========================
+DISTRIBUIDORAS = [f"DISTRIBUIDORA {i:02d}" for i in range(25)]
+CIDADES = [f"CIDADE {i:03d}" for i in range(400)]
+BASES = [f"BASE {i:02d}" for i in range(40)]
+
+
+def _data(aleatorio, inicio=date(2023, 1, 1), dias=900):
+    return (inicio + timedelta(days=aleatorio.randrange(dias))).isoformat()
+
+
+def gerar_descontos(linhas, semente=42):
+    aleatorio = random.Random(semente)
+    for i in range(linhas):
+        fechamento = _data(aleatorio)[:8] + "01 00:00:00"
+        yield (
+            aleatorio.choice(DISTRIBUIDORAS),
+            fechamento,
+            str(100000 + i),
+            _data(aleatorio) + " 00:00:00",
+            aleatorio.choice(CIDADES),
+            aleatorio.choice(BASES),
+            round(aleatorio.uniform(5, 5000), 2),
+            aleatorio.choice(["AVARIA", "EXTRAVIO", "SINISTRO"]),
+            aleatorio.choice(["AVARIA CONFIRMADA NO SISTEMA", "EXTRAVIO CONFIRMADO NO SISTEMA"]),
+        )
+
+
+def gerar_ocorrencias(linhas, semente=42):
+    aleatorio = random.Random(semente)
+    for i in range(linhas):
+        valor_nf = round(aleatorio.uniform(100, 20000), 2)
+        yield (
+            aleatorio.choice(DISTRIBUIDORAS),
+            f"PED{aleatorio.randrange(10 ** 6):06d}",
+            str(500000 + i),
+            _data(aleatorio),
+            valor_nf,
+            aleatorio.choice(CIDADES),
+            aleatorio.choice(BASES),
+            aleatorio.choice(["EXTRAVIO", "AVARIA", "SINISTRO"]),
+            aleatorio.randrange(1, 50),
+            aleatorio.randrange(1, 5),
+            aleatorio.choice(["AGENDADO", "EM ROTA", "FINALIZADO", "AGUARDANDO"]),
+            _data(aleatorio),
+            f"Contato {i} com a distribuidora",
+            aleatorio.choice(["ABERTO", "FINALIZADO"]),
+            round(valor_nf * aleatorio.uniform(0.01, 0.5), 2),
+        )
+
+
+def popular_ocorrencias(linhas):
+    with database.transacao() as conn:
+        conn.executemany("""
+            INSERT INTO ocorrencias (
+                distribuidora, pedido, nota_fiscal, emissao_nf, valor_nf, cidade_nf,
+                filial, ocorrencia, vol_total_nf, volume_ocorrencia, status_atual,
+                data_ultimo_status, follow_up, status_rpg, valor_ocorrencia
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, gerar_ocorrencias(linhas))
+
+
+MOTORISTAS = [f"MOTORISTA {i:03d}" for i in range(150)]
+
+
+def gerar_pendencias(linhas, semente=42):
+    aleatorio = random.Random(semente)
+    for i in range(linhas):
+        emissao = _data(aleatorio)
+        yield (
+            aleatorio.choice(MOTORISTAS),
+            aleatorio.choice(DISTRIBUIDORAS),
+            str(700000 + i),
+            emissao,
+            (date.fromisoformat(emissao) + timedelta(days=aleatorio.randrange(5))).isoformat(),
+            f"MAN{aleatorio.randrange(10 ** 5):05d}",
+            aleatorio.choice(["", "Canhoto sem assinatura", "Aguardando digitalização", "Cliente ausente"]),
+            aleatorio.choice(["PENDENTE", "ENVIADO", "REGULARIZADO"]),
+        )
+
+
+def popular_pendencias(linhas):
+    with database.transacao() as conn:
+        conn.executemany("""
+            INSERT INTO pendencias_comprovante (
+                motorista, distribuidora, nota_fiscal, emissao, saida, manifesto, obs, status
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """, gerar_pendencias(linhas))
+
+
+def gerar_cidades():
+    # Na ordem de COLUNAS_CIDADES; o nome já está normalizado.
+    for i, cidade in enumerate(CIDADES):
+        yield (cidade, cidade, BASES[i % len(BASES)], f"S{i % 40:02d}", f"LIDER {i % 40}", f"GERENTE {i % 10}", "")
+
+
+def gerar_planilha(linhas, semente=42):
+    # Como blocos_da_aba entrega uma planilha "de fora": cabeçalhos
+    # alternativos, datas e valores em vários formatos, grafias variadas de
+    # cidade e ~1% de linhas inválidas.
+    aleatorio = random.Random(semente)
+    formatos_data = (
+        lambda d: datetime.combine(d, datetime.min.time()),
+        lambda d: d.strftime("%d/%m/%Y"),
+        lambda d: d.isoformat(),
+    )
+    registros = []
+    for i in range(linhas):
+        emissao = date(2023, 1, 1) + timedelta(days=aleatorio.randrange(900))
+        valor = round(aleatorio.uniform(5, 5000), 2)
+        registros.append((
+            aleatorio.choice(DISTRIBUIDORAS),
+            aleatorio.choice(formatos_data)(emissao.replace(day=1)),
+            100000 + i,
+            aleatorio.choice(formatos_data)(emissao),
+            aleatorio.choice(CIDADES).lower() if i % 3 else aleatorio.choice(CIDADES),
+            aleatorio.choice(BASES),
+            "abc" if i % 100 == 0 else (f"R$ {valor:.2f}".replace(".", ",") if i % 4 == 0 else valor),
+            aleatorio.choice(["AVARIA", "EXTRAVIO ", "Sinistro"]),
+            "MOTIVO %d" % (i % 50),
+        ))
+    cabecalho = ["DISTRIBUIDOR", "DATA_FECHAMENTO", "NOTA_FISCAL", "EMISSAO", "MUNICIPIO", "FILIAL", "VALOR", "OBS", "MOTIVO"]
+    return pd.DataFrame(registros, columns=cabecalho, index=range(2, linhas + 2))
+
+
+def _validar_em_blocos(planilha):
+    for inicio in range(0, len(planilha), ingestao.TAMANHO_BLOCO):
+        ingestao.validar_bloco(planilha.iloc[inicio:inicio + ingestao.TAMANHO_BLOCO])
+
+
+# =========================
+# MEMÓRIA DOS CARREGAMENTOS
+# =========================
+def _bytes_por_linha(df):
+    return df.memory_usage(index=True, deep=True).sum() / max(len(df), 1)
+
+
+def bench_memoria(linhas):
+    resultados = {}
+    with tempfile.TemporaryDirectory() as pasta:
+        preparar_banco(pasta)
+        database.migrar()
+        database.inserir_descontos(gerar_descontos(linhas))
+        popular_ocorrencias(linhas)
+
+        for tabela, carregar in (("descontos", database.carregar_dados),
+                                 ("ocorrencias", database.carregar_ocorrencias)):
+            # Antes: SELECT * direto para o pandas, tudo como object/float64.
+            with database.conexao() as conn:
+                bruto = pd.read_sql(f"SELECT * FROM {tabela}", conn)
+            resultados[f"{tabela}_antes"] = _bytes_por_linha(bruto)
+            del bruto
+
+            database.limpar_cache()
+            resultados[f"{tabela}_depois"] = _bytes_por_linha(carregar())
+
+        database.limpar_cache()
+        database.fechar_conexoes()
+    return resultados
+
+
+# =========================
+# SUÍTE COMPLETA
+# =========================
+# Gera um banco sintético por escala e mede as operações quentes da camada de
+# banco e a renderização das páginas. O relatório é um JSON para comparar
+# versões (ex.: guardar um arquivo por release e comparar "mediana").
+ESCALAS_PADRAO = (10000, 100000)
+
+PAGINAS = [
+    "🏠 Início",
+    "📤 Upload de Planilhas",
+    "📝 Cadastro de Ocorrências",
+    "📊 Relatórios",
+    "🤖 IA - Perguntas",
+    "📄 Pendências de Comprovante",
+]
+
+
+def _commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _medir(funcao, repeticoes, frio):
+    # frio: limpa o cache de leituras antes de cada repetição.
+    tempos = []
+    resultado = None
+    for _ in range(repeticoes):
+        if frio:
+            database.limpar_cache()
+        inicio = time.perf_counter()
+        resultado = funcao()
+        tempos.append(time.perf_counter() - inicio)
+
+    medicao = {"min": min(tempos), "mediana": statistics.median(tempos), "repeticoes": repeticoes}
+    if isinstance(resultado, bytes):
+        medicao["bytes"] = len(resultado)
+    elif isinstance(resultado, (pd.DataFrame, list)):
+        medicao["linhas"] = len(resultado)
+    return medicao
+
+
+def _operacoes():
+    # (nome, função, usa o cache de leituras)
+    from ai_assistant import responder_pergunta
+    from cidades import buscar_filial
+    from exportacao import exportar
+    from relatorios import descontos_por, envelhecimento_pendencias, indicadores_descontos, ocorrencias_por
+
+    filtro = {"distribuidora": DISTRIBUIDORAS[:2], "status_rpg": ["ABERTO"]}
+    sem_planilha = os.path.join(os.path.dirname(database.DB_PATH), "sem_planilha.xlsx")
+    cidades = random.Random(7).choices(CIDADES + ["Cidade 001 ", "CIDADE INEXISTENTE"], k=1000)
+
+    def exportar_filtrado(formato):
+        linhas = database.iterar_linhas("ocorrencias", {"distribuidora": DISTRIBUIDORAS[:1]})
+        colunas = next(linhas)
+        return exportar(formato, colunas, linhas, "Ocorrencias", ("emissao_nf",))
+
+    sincronizadas = {}
+
+    def sincronizar_apos_alteracao():
+        # Uma linha alterada entre dois reruns: só ela vem do banco.
+        if "pendencias" not in sincronizadas:
+            sincronizadas["pendencias"] = database.sincronizar_tabela("pendencias_comprovante")
+        with database.transacao() as conn:
+            conn.execute("UPDATE pendencias_comprovante SET obs = obs WHERE id = (SELECT MIN(id) FROM pendencias_comprovante)")
+        sincronizadas["pendencias"] = database.sincronizar_tabela("pendencias_comprovante", sincronizadas["pendencias"])
+        return sincronizadas["pendencias"]["df"]
+
+    operacoes = [
+        ("carregar_dados", database.carregar_dados, True),
+        ("carregar_ocorrencias", database.carregar_ocorrencias, True),
+        ("carregar_pendencias", database.carregar_pendencias, True),
+        ("sincronizar_pendencias_1_alteracao", sincronizar_apos_alteracao, False),
+        ("consultar_ocorrencias_filtro", lambda: database.consultar_ocorrencias(filtro, limite=50), True),
+        ("contar_ocorrencias_filtro", lambda: database.contar_ocorrencias(filtro), True),
+        ("facetas_ocorrencias", lambda: database.facetas("ocorrencias", filtro), True),
+        ("buscar_texto_follow_up", lambda: database.buscar_texto("ocorrencias", "contato distribuidora"), True),
+        ("exportar_excel_filtro", lambda: exportar_filtrado("Excel"), False),
+        ("exportar_csv_filtro", lambda: exportar_filtrado("CSV"), False),
+        ("relatorio_indicadores", indicadores_descontos, True),
+        ("relatorio_descontos_base_filtro", lambda: descontos_por("BASE", {"DISTRIBUIDORA": DISTRIBUIDORAS[:3]}), True),
+        ("relatorio_ocorrencias_filial", lambda: ocorrencias_por("filial"), True),
+        ("relatorio_aging_pendencias", lambda: envelhecimento_pendencias(date.today().isoformat()), True),
+        ("buscar_filial_1000", lambda: [buscar_filial(cidade, sem_planilha) for cidade in cidades], False),
+    ]
+    for pergunta in ("base", "cidade", "distribuidora", "avaria", "fechamento"):
+        operacoes.append((f"responder_pergunta_{pergunta}", lambda p=pergunta: responder_pergunta(p)[0], False))
+    return operacoes
+
+
+def _medir_paginas(repeticoes):
+    from streamlit.testing.v1 import AppTest
+
+    resultados = {}
+    app = AppTest.from_file(os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py"), default_timeout=3600)
+    app.run()
+    for pagina in PAGINAS:
+        tempos = []
+        for _ in range(repeticoes):
+            database.limpar_cache()
+            inicio = time.perf_counter()
+            app.sidebar.selectbox[0].select(pagina).run()
+            tempos.append(time.perf_counter() - inicio)
+        if app.exception:
+            raise RuntimeError(f"Página {pagina} falhou: {app.exception[0].message}")
+        resultados[pagina] = {"min": min(tempos), "mediana": statistics.median(tempos), "repeticoes": repeticoes}
+    return resultados
+
+
+def bench_suite(escalas, repeticoes=3, paginas=True):
+    relatorio = {
+        "gerado_em": datetime.now().isoformat(timespec="seconds"),
+        "commit": _commit(),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "pandas": pd.__version__,
+        "plataforma": platform.platform(),
+        "escalas": {},
+    }
+
+    for linhas in escalas:
+        with tempfile.TemporaryDirectory() as pasta:
+            preparar_banco(pasta)
+            database.migrar()
+            database.limpar_cache()
+            resultados = {}
+
+            descontos = pd.DataFrame(list(gerar_descontos(linhas)), columns=database.COLUNAS_DESCONTOS)
+            resultados["inserir_dados"] = _medir(lambda: database.inserir_dados(descontos), 1, False)
+            del descontos
+            resultados["popular_ocorrencias"] = _medir(lambda: popular_ocorrencias(linhas), 1, False)
+            resultados["popular_pendencias"] = _medir(lambda: popular_pendencias(linhas), 1, False)
+            database.substituir_cidades_filiais(gerar_cidades(), "cidades_filiais_mtime", "benchmark")
+
+            # Validação das planilhas enviadas, nos mesmos blocos da importação.
+            planilha = gerar_planilha(linhas)
+            resultados["validar_planilha"] = _medir(lambda: _validar_em_blocos(planilha), 1, False)
+            del planilha
+
+            for nome, funcao, usa_cache in _operacoes():
+                resultados[f"{nome}_frio"] = _medir(funcao, repeticoes, True)
+                if usa_cache:
+                    resultados[f"{nome}_cache"] = _medir(funcao, repeticoes, False)
+
+            # Os mesmos relatórios de descontos lidos do snapshot colunar (pyarrow).
+            if colunar.DISPONIVEL:
+                colunar.ativar()
+                resultados["colunar_atualizar_snapshot"] = _medir(colunar.atualizar_snapshot, 1, False)
+                for nome, funcao, _ in _operacoes():
+                    if nome.startswith(("relatorio_indicadores", "relatorio_descontos")):
+                        resultados[f"{nome}_colunar_frio"] = _medir(funcao, repeticoes, True)
+                colunar.ativar(False)
+
+            relatorio["escalas"][str(linhas)] = {
+                "operacoes": resultados,
+                "paginas": _medir_paginas(repeticoes) if paginas else {},
+                "tamanho_banco_bytes": os.path.getsize(database.DB_PATH),
+            }
+            database.limpar_cache()
+            database.fechar_conexoes()
+
+    return relatorio
+
+
+def imprimir_suite(relatorio):
+    for linhas, escala in relatorio["escalas"].items():
+        print(f"\n== {int(linhas):,} linhas ({escala['tamanho_banco_bytes'] / 1e6:.1f} MB) ==")
+        for grupo in ("operacoes", "paginas"):
+            for nome, medicao in escala[grupo].items():
+                extra = "".join(f" ({medicao[chave]} {chave})" for chave in ("linhas", "bytes") if chave in medicao)
+                print(f"{nome:<44} {medicao['mediana'] * 1000:>12.1f} ms{extra}")
+
+
+# =========================
+# EXECUÇÃO
+# =========================
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmarks da camada de banco")
+    parser.add_argument("--repeticoes", type=int, default=2000)
+    parser.add_argument("--edicao", type=int, nargs="*", metavar="LINHAS",
+                        help="tempo de renderização da edição (ex.: --edicao 1000 10000)")
+    parser.add_argument("--memoria", type=int, metavar="LINHAS",
+                        help="bytes por linha dos carregamentos (ex.: --memoria 1000000)")
+    parser.add_argument("--suite", type=int, nargs="*", metavar="LINHAS",
+                        help="suíte completa por escala (ex.: --suite 10000 100000 1000000)")
+    parser.add_argument("--sem-paginas", action="store_true", help="na suíte, não mede as páginas")
+    parser.add_argument("--saida", help="arquivo JSON do relatório da suíte (padrão: imprime na tela)")
+    args = parser.parse_args()
+
+    if args.suite is not None:
+        relatorio = bench_suite(args.suite or ESCALAS_PADRAO, min(args.repeticoes, 3), not args.sem_paginas)
+        if args.saida:
+            with open(args.saida, "w", encoding="utf-8") as arquivo:
+                json.dump(relatorio, arquivo, ensure_ascii=False, indent=2)
+        imprimir_suite(relatorio)
+        return
+
+    if args.edicao is not None:
+        for nome, segundos in bench_edicao(args.edicao or [1000, 10000]).items():
+            print(f"{nome:<28} {segundos:>10.2f} s")
+        return
+
+    if args.memoria:
+        for nome, valor in bench_memoria(args.memoria).items():
+            print(f"{nome:<24} {valor:>10,.0f} bytes/linha")
+        return
+
+    resultados = bench_conexao(args.repeticoes)
+    for nome, ops in resultados.items():
+        print(f"{nome:<24} {ops:>12,.0f} ops/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+import bisect
+import difflib
+import os
+import time
+import unicodedata
+from functools import lru_cache
+
+import pandas as pd
+
+import database
+from database import (
+    COLUNAS_CIDADES,
+    carregar_cidades_filiais,
+    ler_metadado,
+    substituir_cidades_filiais
+)
+
+# =========================
+# CIDADES X FILIAIS
+# =========================
+# A planilha é importada para a tabela cidades_filiais e só é lida de novo
+# quando o arquivo muda (mtime). Em memória fica um dicionário
+# (cidade normalizada -> filial) montado a partir da tabela, uma vez por versão.
+# A versão (metadado + mtime) é conferida no máximo a cada
+# INTERVALO_VERIFICACAO segundos, não a cada busca.
+ARQUIVO_CIDADES = "CIDADES X FILIAIS.xlsx"
+CHAVE_VERSAO = "cidades_filiais_mtime"
+INTERVALO_VERIFICACAO = 5
+
+# (banco, planilha) -> (quando conferiu, versão)
+_versoes_conferidas = {}
+
+# Cabeçalho da planilha -> coluna da tabela.
+COLUNAS_PLANILHA = {
+    "CIDADE": "cidade",
+    "FILIAL": "filial",
+    "SIGLA": "sigla",
+    "LIDER/ BASE": "lider_base",
+    "GERENTE RESPONSAVEL": "gerente_responsavel",
+    "TELEFONE BASE": "telefone_base",
+}
+
+
+def normalizar_nome(texto):
+    # Sem acento, maiúsculo e com espaços simples: "São  Félix " -> "SAO FELIX".
+    if texto is None:
+        return ""
+    texto = unicodedata.normalize("NFKD", str(texto))
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    return " ".join(texto.upper().split())
+
+
+def importar_cidades(caminho=ARQUIVO_CIDADES):
+    versao = str(os.path.getmtime(caminho))
+
+    df = pd.read_excel(caminho, dtype=str)
+    df = df.rename(columns=lambda c: COLUNAS_PLANILHA.get(str(c).strip(), c))
+    df = df.reindex(columns=COLUNAS_CIDADES[1:])
+    df = df.apply(lambda coluna: coluna.str.strip())
+    df.insert(0, "cidade_normalizada", df["cidade"].map(normalizar_nome))
+    df = df[df["cidade_normalizada"] != ""]
+    df = df.astype(object).where(df.notna(), None)
+
+    substituir_cidades_filiais(df.itertuples(index=False, name=None), CHAVE_VERSAO, versao)
+    _versoes_conferidas.clear()
+    return versao
+
+
+def sincronizar_cidades(caminho=ARQUIVO_CIDADES):
+    # Sem a planilha (ex.: só o banco foi copiado), usa o que já está na tabela.
+    versao = ler_metadado(CHAVE_VERSAO)
+    if not os.path.exists(caminho):
+        return versao
+    if versao != str(os.path.getmtime(caminho)):
+        versao = importar_cidades(caminho)
+    return versao
+
+
+@lru_cache(maxsize=4)
+def _montar_indice(caminho_banco, versao):
+    df = carregar_cidades_filiais()
+    filiais = dict(zip(df["cidade_normalizada"], df["filial"].fillna("")))
+    return filiais, sorted(filiais)
+
+
+def _versao_atual(caminho):
+    chave = (database.DB_PATH, caminho)
+    agora = time.monotonic()
+    conferida = _versoes_conferidas.get(chave)
+    if conferida is None or agora - conferida[0] > INTERVALO_VERIFICACAO:
+        conferida = (agora, sincronizar_cidades(caminho))
+        _versoes_conferidas[chave] = conferida
+    return conferida[1]
+
+
+def indice_cidades(caminho=ARQUIVO_CIDADES):
+    return _montar_indice(database.DB_PATH, _versao_atual(caminho))
+
+
+def buscar_filial(cidade, caminho=ARQUIVO_CIDADES):
+    if not cidade:
+        return ""
+    filiais, _ = indice_cidades(caminho)
+    return filiais.get(normalizar_nome(cidade), "")
+
+
+def sugerir_cidades(texto, limite=5, caminho=ARQUIVO_CIDADES):
+    # Primeiro as cidades que começam com o texto digitado, depois as parecidas
+    # (erros de digitação).
+    chave = normalizar_nome(texto)
+    if not chave:
+        return []
+
+    _, nomes = indice_cidades(caminho)
+
+    sugestoes = []
+    inicio = bisect.bisect_left(nomes, chave)
+    for nome in nomes[inicio:]:
+        if not nome.startswith(chave) or len(sugestoes) >= limite:
+            break
+        sugestoes.append(nome)
+
+    for nome in difflib.get_close_matches(chave, nomes, n=limite, cutoff=0.75):
+        if nome not in sugestoes and len(sugestoes) < limite:
+            sugestoes.append(nome)
+
+    return sugestoes
@@ -0,0 +1,224 @@
+import importlib.util
+import os
+import shutil
+import sys
+import threading
+from urllib.parse import quote
+
+import database
+import desempenho
+from database import (
+    COLUNAS_FILTRO_DESCONTOS,
+    conexao,
+    concluir_particoes,
+    marcar_todas_particoes,
+    particoes_pendentes
+)
+
+# =========================
+# SNAPSHOT COLUNAR DE DESCONTOS
+# =========================
+# Cópia de descontos em Parquet, um arquivo por FECHAMENTO (pastas no estilo
+# Hive: FECHAMENTO=.../dados.parquet), com as linhas ordenadas por
+# DISTRIBUIDORA. O SQLite continua sendo o banco de verdade; o snapshot só
+# atende os agregados dos relatórios: lê apenas as colunas pedidas, pula os
+# fechamentos que o filtro exclui (e, em fechamentos grandes, os grupos de
+# linhas de outras distribuidoras) e agrega com o Arrow, sem passar linha a
+# linha. Uma pasta por DISTRIBUIDORA também daria para podar, mas gera
+# centenas de arquivos pequenos, e abrir arquivo custa mais que ler linhas.
+#
+# Opcional: precisa do pyarrow (fora do requirements) e de RPG_COLUNAR=1.
+# Enquanto houver partição pendente (upload ainda não refletido), as
+# consultas devolvem None e os relatórios usam o SQLite.
+DISPONIVEL = importlib.util.find_spec("pyarrow") is not None
+PASTA_COLUNAR = os.environ.get("RPG_PASTA_COLUNAR")
+# Linhas por grupo dentro do arquivo; cada grupo guarda mínimo e máximo de
+# DISTRIBUIDORA, o que permite pular grupos inteiros em um filtro.
+LINHAS_POR_GRUPO = 64 * 1024
+# Nome que o pyarrow usa para a partição de valor nulo.
+PARTICAO_NULA = "__HIVE_DEFAULT_PARTITION__"
+
+if DISPONIVEL:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+
+    ESQUEMA = pa.schema([
+        ("id", pa.int64()),
+        ("DISTRIBUIDORA", pa.string()),
+        ("NF", pa.string()),
+        ("DATA_EMISSAO", pa.string()),
+        ("CIDADE", pa.string()),
+        ("BASE", pa.string()),
+        ("VALOR_DESCONTO", pa.float64()),
+        ("OBSERVACAO", pa.string()),
+        ("MOTIVO", pa.string()),
+    ])
+    ESQUEMA_PARTICOES = pa.schema([("FECHAMENTO", pa.string())])
+
+_ativo = DISPONIVEL and os.environ.get("RPG_COLUNAR") == "1"
+_lock = threading.Lock()
+
+
+def ativo():
+    return _ativo
+
+
+def ativar(ligado=True):
+    global _ativo
+    _ativo = DISPONIVEL and ligado
+
+
+def pasta_snapshot():
+    # Padrão: ao lado do banco (dados.db -> dados_colunar/).
+    return PASTA_COLUNAR or os.path.splitext(database.DB_PATH)[0] + "_colunar"
+
+
+def atual():
+    return _ativo and os.path.isdir(pasta_snapshot()) and not particoes_pendentes()
+
+
+# =========================
+# ATUALIZAÇÃO INCREMENTAL
+# =========================
+def _pasta_particao(pasta, fechamento):
+    return os.path.join(pasta, f"FECHAMENTO={quote(fechamento, safe='') if fechamento else PARTICAO_NULA}")
+
+
+def _texto(valor):
+    return None if valor is None else str(valor)
+
+
+def _numero(valor):
+    try:
+        return None if valor is None else float(valor)
+    except (TypeError, ValueError):
+        return None
+
+
+def _reescrever_particao(pasta, fechamento):
+    # '' na tabela de pendentes é NULL em descontos.
+    with conexao() as conn:
+        linhas = conn.execute(
+            f"SELECT {', '.join(ESQUEMA.names)} FROM descontos "
+            f"WHERE FECHAMENTO IS ? ORDER BY DISTRIBUIDORA, id",
+            (fechamento or None,)
+        ).fetchall()
+
+    destino = _pasta_particao(pasta, fechamento)
+    if not linhas:
+        shutil.rmtree(destino, ignore_errors=True)
+        return
+
+    colunas = list(zip(*linhas))
+    conversores = {"id": int, "VALOR_DESCONTO": _numero}
+    tabela = pa.table(
+        [
+            pa.array([conversores.get(campo.name, _texto)(valor) for valor in valores], campo.type)
+            for campo, valores in zip(ESQUEMA, colunas)
+        ],
+        schema=ESQUEMA
+    )
+
+    # Grava em um arquivo temporário e troca: quem está lendo vê a versão
+    # anterior inteira ou a nova inteira.
+    os.makedirs(destino, exist_ok=True)
+    arquivo = os.path.join(destino, "dados.parquet")
+    pq.write_table(tabela, arquivo + ".tmp", row_group_size=LINHAS_POR_GRUPO)
+    os.replace(arquivo + ".tmp", arquivo)
+
+
+def atualizar_snapshot():
+    # Reescreve só os fechamentos que mudaram desde a última atualização.
+    # Devolve quantas foram reescritas.
+    if not _ativo:
+        return 0
+
+    with _lock:
+        pasta = pasta_snapshot()
+        if not os.path.isdir(pasta):
+            os.makedirs(pasta)
+            marcar_todas_particoes()
+
+        pendentes = particoes_pendentes()
+        for fechamento, _ in pendentes:
+            _reescrever_particao(pasta, fechamento)
+        concluir_particoes(pendentes)
+        return len(pendentes)
+
+
+def atualizar_em_segundo_plano():
+    if _ativo and particoes_pendentes():
+        threading.Thread(target=atualizar_snapshot, daemon=True).start()
+
+
+# =========================
+# CONSULTAS
+# =========================
+def _filtro(filtros, *extras):
+    # Mesmo formato de filtros do montar_where: {coluna: valores}.
+    expressoes = list(extras)
+    for coluna, valores in (filtros or {}).items():
+        if not valores:
+            continue
+        if coluna not in COLUNAS_FILTRO_DESCONTOS:
+            raise ValueError(f"Coluna de filtro inválida: {coluna}")
+        expressoes.append(pc.field(coluna).isin([str(valor) for valor in valores]))
+
+    filtro = None
+    for expressao in expressoes:
+        filtro = expressao if filtro is None else filtro & expressao
+    return filtro
+
+
+def _ler(colunas, filtro):
+    # None se o snapshot não estiver em dia ou sumir no meio da leitura
+    # (partição apagada por uma atualização concorrente).
+    if not atual():
+        return None
+    try:
+        dataset = ds.dataset(
+            pasta_snapshot(),
+            format="parquet",
+            partitioning=ds.partitioning(ESQUEMA_PARTICOES, flavor="hive")
+        )
+        return dataset.to_table(columns=colunas, filter=filtro)
+    except (OSError, pa.ArrowInvalid):
+        return None
+
+
+def indicadores_descontos(filtros=None):
+    tabela = _ler(["NF", "DISTRIBUIDORA", "VALOR_DESCONTO"], _filtro(filtros))
+    if tabela is None:
+        return None
+
+    quantidade = tabela.num_rows
+    total = pc.sum(tabela["VALOR_DESCONTO"]).as_py() or 0
+    return {
+        "quantidade": quantidade,
+        "total": round(total, 2),
+        "medio": round(total / quantidade, 2) if quantidade else 0.0,
+        "notas": pc.count_distinct(tabela["NF"]).as_py(),
+        "distribuidoras": pc.count_distinct(tabela["DISTRIBUIDORA"]).as_py(),
+    }
+
+
+def descontos_por(dimensao, filtros=None, cronologico=False):
+    tabela = _ler([dimensao, "VALOR_DESCONTO"], _filtro(filtros, pc.field(dimensao).is_valid()))
+    if tabela is None:
+        return None
+
+    df = (
+        tabela.group_by(dimensao)
+        .aggregate([("VALOR_DESCONTO", "sum"), ([], "count_all")])
+        .to_pandas()
+        .rename(columns={"VALOR_DESCONTO_sum": "VALOR_DESCONTO", "count_all": "QUANTIDADE"})
+    )[[dimensao, "VALOR_DESCONTO", "QUANTIDADE"]]
+    df["VALOR_DESCONTO"] = df["VALOR_DESCONTO"].round(2)
+    if cronologico:
+        return df.sort_values(dimensao, ignore_index=True)
+    return df.sort_values("VALOR_DESCONTO", ascending=False, ignore_index=True)
+
+
+desempenho.instrumentar_modulo(sys.modules[__name__], "colunar")
@@ -1,133 +1,944 @@
+import functools
+import hashlib
+import os
+import queue
+import re
 import sqlite3
+import sys
+import threading
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from datetime import date, datetime
+
 import pandas as pd
-from datetime import datetime
+
+import desempenho
 
 # =========================
 # CONEXÃO
 # =========================
-def conectar():
-    return sqlite3.connect("dados.db")
+# Conexões ficam em um pool por processo, compartilhado por todas as sessões do
+# Streamlit, em vez de abrir e fechar o arquivo a cada chamada. Dentro de uma
+# mesma thread a conexão emprestada é reaproveitada, então funções aninhadas
+# enxergam a mesma transação. O modo WAL deixa leitores e o escritor
+# trabalharem em paralelo.
+DB_PATH = os.environ.get("RPG_DB_PATH", "dados.db")
+BUSY_TIMEOUT_MS = 30000
+TAMANHO_POOL = 8
+
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -20000",
+    "PRAGMA mmap_size = 268435456",
+)
+
+_local = threading.local()
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def conectar(caminho=None):
+    conn = sqlite3.connect(
+        caminho or DB_PATH,
+        timeout=BUSY_TIMEOUT_MS / 1000,
+        check_same_thread=False
+    )
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+def _pool(caminho):
+    with _pools_lock:
+        if caminho not in _pools:
+            _pools[caminho] = queue.LifoQueue(maxsize=TAMANHO_POOL)
+        return _pools[caminho]
+
+
+@contextmanager
+def conexao():
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        yield conn
+        return
+
+    caminho = DB_PATH
+    pool = _pool(caminho)
+    try:
+        conn = pool.get_nowait()
+    except queue.Empty:
+        conn = conectar(caminho)
+
+    _local.conn = conn
+    _local.profundidade = 0
+    try:
+        yield conn
+    finally:
+        _local.conn = None
+        if conn.in_transaction:
+            conn.rollback()
+        try:
+            pool.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+
+@contextmanager
+def transacao():
+    # Só a transação mais externa faz commit/rollback, para que funções que
+    # escrevem possam ser combinadas em uma única transação.
+    with conexao() as conn:
+        _local.profundidade += 1
+        try:
+            yield conn
+        except BaseException:
+            _local.profundidade -= 1
+            if _local.profundidade == 0:
+                conn.rollback()
+            raise
+        _local.profundidade -= 1
+        if _local.profundidade == 0:
+            conn.commit()
+
+
+def fechar_conexoes():
+    with _pools_lock:
+        for pool in _pools.values():
+            while not pool.empty():
+                pool.get_nowait().close()
+        _pools.clear()
+
+
+# =========================
+# FILTROS E ORDENAÇÃO
+# =========================
+COLUNAS_OCORRENCIAS = (
+    "id",
+    "distribuidora",
+    "pedido",
+    "nota_fiscal",
+    "emissao_nf",
+    "valor_nf",
+    "valor_ocorrencia",
+    "cidade_nf",
+    "filial",
+    "ocorrencia",
+    "vol_total_nf",
+    "volume_ocorrencia",
+    "status_atual",
+    "data_ultimo_status",
+    "follow_up",
+    "status_rpg",
+)
+
+COLUNAS_FILTRO_OCORRENCIAS = (
+    "distribuidora",
+    "pedido",
+    "nota_fiscal",
+    "cidade_nf",
+    "filial",
+    "ocorrencia",
+    "status_atual",
+    "status_rpg",
+)
+
+
+COLUNAS_PENDENCIAS = (
+    "id",
+    "motorista",
+    "distribuidora",
+    "nota_fiscal",
+    "emissao",
+    "saida",
+    "manifesto",
+    "obs",
+    "status",
+)
+
+COLUNAS_FILTRO_PENDENCIAS = (
+    "motorista",
+    "distribuidora",
+    "nota_fiscal",
+    "manifesto",
+    "status",
+)
+
+COLUNAS_CONSULTA_DESCONTOS = (
+    "id",
+    "DISTRIBUIDORA",
+    "FECHAMENTO",
+    "NF",
+    "DATA_EMISSAO",
+    "CIDADE",
+    "BASE",
+    "VALOR_DESCONTO",
+    "OBSERVACAO",
+    "MOTIVO",
+)
+
+COLUNAS_FILTRO_DESCONTOS = (
+    "DISTRIBUIDORA",
+    "FECHAMENTO",
+    "CIDADE",
+    "BASE",
+    "OBSERVACAO",
+)
+
+# tabela -> (colunas que podem ordenar, colunas que podem filtrar)
+TABELAS_CONSULTA = {
+    "ocorrencias": (COLUNAS_OCORRENCIAS, COLUNAS_FILTRO_OCORRENCIAS),
+    "pendencias_comprovante": (COLUNAS_PENDENCIAS, COLUNAS_FILTRO_PENDENCIAS),
+    "descontos": (COLUNAS_CONSULTA_DESCONTOS, COLUNAS_FILTRO_DESCONTOS),
+}
+
+
+def montar_where(filtros, colunas_permitidas):
+    # Nomes de coluna não podem ser parâmetros no SQLite, então só entram os
+    # que estão na lista permitida; os valores sempre vão como parâmetros.
+    clausulas = []
+    params = []
+
+    for coluna, valores in (filtros or {}).items():
+        if not valores:
+            continue
+        if coluna not in colunas_permitidas:
+            raise ValueError(f"Coluna de filtro inválida: {coluna}")
+
+        valores = list(valores)
+        marcadores = ", ".join("?" for _ in valores)
+        clausulas.append(f"{coluna} IN ({marcadores})")
+        params.extend(valores)
+
+    if not clausulas:
+        return "", params
+    return " WHERE " + " AND ".join(clausulas), params
+
+
+def montar_order_by(ordenar_por, decrescente, colunas_permitidas):
+    if ordenar_por not in colunas_permitidas:
+        raise ValueError(f"Coluna de ordenação inválida: {ordenar_por}")
+
+    direcao = "DESC" if decrescente else "ASC"
+    # O id desempata a ordenação para a paginação ficar estável.
+    if ordenar_por == "id":
+        return f" ORDER BY id {direcao}"
+    return f" ORDER BY {ordenar_por} {direcao}, id {direcao}"
+
+
+def iterar_linhas(tabela, filtros=None, ordenar_por="id", decrescente=True, tamanho_lote=5000, incluir_arquivo=False):
+    # Gerador: primeiro devolve a lista de colunas, depois as linhas, lidas do
+    # cursor em lotes. A conexão fica emprestada até o gerador terminar.
+    colunas, colunas_filtro = TABELAS_CONSULTA[tabela]
+    where, params = montar_where(filtros, colunas_filtro)
+    ordem = montar_order_by(ordenar_por, decrescente, colunas)
+
+    with conexao() as conn:
+        cursor = conn.execute(f"SELECT * FROM {origem_consulta(tabela, incluir_arquivo)}{where}{ordem}", params)
+        yield [coluna[0] for coluna in cursor.description]
+
+        while True:
+            lote = cursor.fetchmany(tamanho_lote)
+            if not lote:
+                break
+            yield from lote
+
+
+# =========================
+# CACHE DE LEITURAS
+# =========================
+# Resultados de leitura ficam em memória junto com a versão das tabelas de
+# onde vieram (ver versao_dados). Enquanto nenhuma escrita acontecer - em
+# qualquer sessão ou processo - a leitura é servida do cache. O cache é
+# compartilhado pelo processo e limitado em itens e em bytes (LRU).
+CACHE_MAX_ITENS = 64
+CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+_cache = OrderedDict()
+_cache_bytes = 0
+_cache_lock = threading.Lock()
+
+
+def _tamanho(resultado):
+    if isinstance(resultado, pd.DataFrame):
+        return int(resultado.memory_usage(index=True, deep=True).sum())
+    return sys.getsizeof(resultado)
+
+
+def _copia(resultado):
+    # Quem recebe o DataFrame pode alterá-lo (ex.: converter datas) sem
+    # estragar o que está guardado.
+    return resultado.copy() if hasattr(resultado, "copy") else resultado
+
+
+def _guardar_no_cache(chave, versao, resultado):
+    global _cache_bytes
+
+    tamanho = _tamanho(resultado)
+    if tamanho > CACHE_MAX_BYTES:
+        return
+
+    with _cache_lock:
+        antigo = _cache.pop(chave, None)
+        if antigo:
+            _cache_bytes -= antigo[2]
+
+        _cache[chave] = (versao, resultado, tamanho)
+        _cache_bytes += tamanho
+
+        while len(_cache) > CACHE_MAX_ITENS or _cache_bytes > CACHE_MAX_BYTES:
+            _, (_, _, tamanho_removido) = _cache.popitem(last=False)
+            _cache_bytes -= tamanho_removido
+
+
+def limpar_cache():
+    global _cache_bytes
+
+    with _cache_lock:
+        _cache.clear()
+        _cache_bytes = 0
+
+
+def cache_por_versao(*tabelas):
+    # Sem tabelas fixas, a tabela é o primeiro argumento da função.
+    def decorador(funcao):
+        @functools.wraps(funcao)
+        def envolvida(*args, **kwargs):
+            with conexao() as conn:
+                # Dentro de uma transação aberta a versão ainda pode voltar
+                # atrás (rollback), então não usa nem alimenta o cache.
+                if conn.in_transaction:
+                    return funcao(*args, **kwargs)
+
+                chave = (DB_PATH, funcao.__name__, repr(args), repr(sorted(kwargs.items())))
+                versao = tuple(versao_dados(tabela) for tabela in (tabelas or args[:1]))
+
+                with _cache_lock:
+                    item = _cache.get(chave)
+                    if item and item[0] == versao:
+                        _cache.move_to_end(chave)
+                        return _copia(item[1])
+
+                resultado = funcao(*args, **kwargs)
+
+            _guardar_no_cache(chave, versao, resultado)
+            return _copia(resultado)
+
+        return envolvida
+    return decorador
+
+
+# =========================
+# TIPOS DAS COLUNAS
+# =========================
+# Como cada coluna deve chegar no DataFrame: texto repetitivo vira category,
+# datas viram datetime64 (uma vez, no carregamento) e números usam o menor
+# tipo seguro. "texto" fica como está (valores quase todos distintos).
+TIPOS_COLUNAS = {
+    "descontos": {
+        "id": "int32",
+        "DISTRIBUIDORA": "category",
+        "FECHAMENTO": "data",
+        "NF": "texto",
+        "DATA_EMISSAO": "data",
+        "CIDADE": "category",
+        "BASE": "category",
+        "VALOR_DESCONTO": "float64",
+        "OBSERVACAO": "category",
+        "MOTIVO": "category",
+    },
+    "ocorrencias": {
+        "id": "int32",
+        "distribuidora": "category",
+        "pedido": "texto",
+        "nota_fiscal": "texto",
+        "emissao_nf": "data",
+        "valor_nf": "float64",
+        "valor_ocorrencia": "float64",
+        "cidade_nf": "category",
+        "filial": "category",
+        "ocorrencia": "category",
+        "vol_total_nf": "Int32",
+        "volume_ocorrencia": "Int32",
+        "status_atual": "category",
+        "data_ultimo_status": "data",
+        "follow_up": "texto",
+        "status_rpg": "category",
+    },
+    "pendencias_comprovante": {
+        "id": "int32",
+        "motorista": "category",
+        "distribuidora": "category",
+        "nota_fiscal": "texto",
+        "emissao": "data",
+        "saida": "data",
+        "manifesto": "texto",
+        "obs": "texto",
+        "status": "category",
+    },
+}
+
+
+def projetar_colunas(tabela, colunas=None):
+    if not colunas:
+        return "*"
+    invalidas = [coluna for coluna in colunas if coluna not in TIPOS_COLUNAS[tabela]]
+    if invalidas:
+        raise ValueError(f"Colunas inválidas para {tabela}: {', '.join(invalidas)}")
+    return ", ".join(colunas)
+
+
+def otimizar_tipos(df, tabela):
+    for coluna, tipo in TIPOS_COLUNAS[tabela].items():
+        if coluna not in df.columns or tipo == "texto":
+            continue
+
+        if tipo == "data":
+            datas = pd.to_datetime(df[coluna], errors="coerce", format="ISO8601")
+            # Se algum valor não for data (ex.: "AGO/2025" em FECHAMENTO), a
+            # coluna fica como category para não perder o texto original.
+            if (datas.isna() & df[coluna].notna()).any():
+                df[coluna] = df[coluna].astype("category")
+            else:
+                df[coluna] = datas
+        elif tipo in ("int32", "Int32", "float64"):
+            # Bases antigas podem ter texto em colunas numéricas (ex.: "R$ 10,50"
+            # ou ""); nesse caso a coluna inteira vira texto, como nas datas, em
+            # vez de derrubar a consulta ou apagar o valor.
+            numeros = pd.to_numeric(df[coluna], errors="coerce")
+            if (numeros.isna() & df[coluna].notna()).any():
+                df[coluna] = df[coluna].astype("string")
+                continue
+            if tipo != "float64" and numeros.isna().any():
+                tipo = "Int32"
+            try:
+                df[coluna] = numeros.astype(tipo)
+            except (TypeError, ValueError):
+                # Números com casas decimais numa coluna inteira.
+                df[coluna] = numeros
+        else:
+            df[coluna] = df[coluna].astype(tipo)
+    return df
+
+
+def ler_tabela(tabela, sql, params=()):
+    with conexao() as conn:
+        return otimizar_tipos(pd.read_sql(sql, conn, params=params), tabela)
+
+
+# =========================
+# CONSULTAS FILTRADAS
+# =========================
+@cache_por_versao()
+def consultar_tabela(
+    tabela, filtros=None, limite=None, offset=0, ordenar_por="id", decrescente=True, colunas=None, incluir_arquivo=False
+):
+    colunas_ordem, colunas_filtro = TABELAS_CONSULTA[tabela]
+    where, params = montar_where(filtros, colunas_filtro)
+    ordem = montar_order_by(ordenar_por, decrescente, colunas_ordem)
+
+    sql = f"SELECT {projetar_colunas(tabela, colunas)} FROM {origem_consulta(tabela, incluir_arquivo)}{where}{ordem}"
+    if limite is not None:
+        sql += " LIMIT ? OFFSET ?"
+        params = params + [int(limite), int(offset)]
+
+    return ler_tabela(tabela, sql, params)
+
+
+@cache_por_versao()
+def contar_tabela(tabela, filtros=None, incluir_arquivo=False):
+    _, colunas_filtro = TABELAS_CONSULTA[tabela]
+    where, params = montar_where(filtros, colunas_filtro)
+
+    with conexao() as conn:
+        return conn.execute(
+            f"SELECT COUNT(*) FROM {origem_consulta(tabela, incluir_arquivo)}{where}", params
+        ).fetchone()[0]
+
+
+@cache_por_versao()
+def contar_valores(tabela, coluna, filtros=None, incluir_arquivo=False):
+    # Valores distintos de uma coluna e quantas linhas têm cada um, já
+    # respeitando os filtros informados.
+    _, colunas_filtro = TABELAS_CONSULTA[tabela]
+    if coluna not in colunas_filtro:
+        raise ValueError(f"Coluna de filtro inválida: {coluna}")
+
+    where, params = montar_where(filtros, colunas_filtro)
+    where += (" AND " if where else " WHERE ") + f"{coluna} IS NOT NULL"
+
+    with conexao() as conn:
+        return pd.read_sql(
+            f"SELECT {coluna} AS valor, COUNT(*) AS quantidade FROM {origem_consulta(tabela, incluir_arquivo)}{where} "
+            f"GROUP BY {coluna} ORDER BY {coluna}",
+            conn,
+            params=params
+        )
+
+
+def facetas(tabela, filtros=None, cascata=True, incluir_arquivo=False):
+    # Em cascata, as opções de cada coluna consideram os filtros das outras
+    # colunas (mas não o da própria, para não esconder as alternativas).
+    _, colunas_filtro = TABELAS_CONSULTA[tabela]
+    filtros = filtros or {}
+
+    resultado = {}
+    with conexao():
+        for coluna in colunas_filtro:
+            outros = {c: v for c, v in filtros.items() if c != coluna and v} if cascata else None
+            resultado[coluna] = contar_valores(tabela, coluna, outros or None, incluir_arquivo=incluir_arquivo)
+    return resultado
+
+
+# =========================
+# ATUALIZAÇÃO EM LOTE
+# =========================
+# Várias linhas alteradas de uma vez, em uma única transação: um UPDATE por
+# conjunto de colunas (executemany) ou um UPDATE só para todas as linhas que
+# atendem aos filtros da tela.
+def _valor_para_banco(tabela, coluna, valor):
+    if valor is None or (pd.api.types.is_scalar(valor) and pd.isna(valor)):
+        return None
+
+    tipo = TIPOS_COLUNAS[tabela][coluna]
+    if tipo == "data":
+        data = pd.to_datetime(valor, errors="coerce")
+        return str(valor) if pd.isna(data) else data.strftime("%Y-%m-%d")
+    if tipo in ("int32", "Int32"):
+        return int(valor)
+    if tipo == "float64":
+        return float(valor)
+    return str(valor)
+
+
+def _validar_colunas_edicao(tabela, colunas):
+    colunas_tabela, _ = TABELAS_CONSULTA[tabela]
+    invalidas = [coluna for coluna in colunas if coluna == "id" or coluna not in colunas_tabela]
+    if invalidas:
+        raise ValueError(f"Colunas inválidas para {tabela}: {', '.join(invalidas)}")
+
+
+def atualizar_em_lote(tabela, alteracoes):
+    # alteracoes: lista de dicionários com o "id" e só as colunas alteradas.
+    # Linhas com as mesmas colunas alteradas vão no mesmo executemany.
+    grupos = {}
+    for alteracao in alteracoes:
+        colunas = tuple(sorted(coluna for coluna in alteracao if coluna != "id"))
+        if not colunas:
+            continue
+        _validar_colunas_edicao(tabela, colunas)
+        grupos.setdefault(colunas, []).append(
+            tuple(_valor_para_banco(tabela, coluna, alteracao[coluna]) for coluna in colunas)
+            + (int(alteracao["id"]),)
+        )
+
+    total = 0
+    with transacao() as conn:
+        for colunas, linhas in grupos.items():
+            atribuicoes = ", ".join(f"{coluna} = ?" for coluna in colunas)
+            cursor = conn.executemany(f"UPDATE {tabela} SET {atribuicoes} WHERE id = ?", linhas)
+            total += cursor.rowcount
+    return total
+
+
+def atualizar_filtradas(tabela, filtros, valores):
+    # Sem filtros, altera a tabela inteira - quem chama deve confirmar antes.
+    _, colunas_filtro = TABELAS_CONSULTA[tabela]
+    _validar_colunas_edicao(tabela, valores)
+    if not valores:
+        return 0
+
+    where, params = montar_where(filtros, colunas_filtro)
+    atribuicoes = ", ".join(f"{coluna} = ?" for coluna in valores)
+    valores_banco = [_valor_para_banco(tabela, coluna, valor) for coluna, valor in valores.items()]
+
+    with transacao() as conn:
+        cursor = conn.execute(f"UPDATE {tabela} SET {atribuicoes}{where}", valores_banco + params)
+        return cursor.rowcount
 
 
 # =========================
 # TABELA PRINCIPAL (DESCONTOS)
 # =========================
 def criar_tabela():
-    conn = conectar()
-    cursor = conn.cursor()
+    with transacao() as conn:
+        cursor = conn.cursor()
+
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS descontos (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                DISTRIBUIDORA TEXT,
+                FECHAMENTO TEXT,
+                NF TEXT,
+                DATA_EMISSAO TEXT,
+                CIDADE TEXT,
+                BASE TEXT,
+                VALOR_DESCONTO REAL,
+                OBSERVACAO TEXT,
+                MOTIVO TEXT
+            )
+        """)
+
+
+# Mesmo formato que o pandas.to_sql gravava nas planilhas já importadas.
+FORMATO_DATA_HORA = "%Y-%m-%d %H:%M:%S"
+
+COLUNAS_DESCONTOS = (
+    "DISTRIBUIDORA",
+    "FECHAMENTO",
+    "NF",
+    "DATA_EMISSAO",
+    "CIDADE",
+    "BASE",
+    "VALOR_DESCONTO",
+    "OBSERVACAO",
+    "MOTIVO",
+)
+
+
+# NF + DISTRIBUIDORA + FECHAMENTO não é única: a mesma NF pode ter vários
+# descontos na mesma planilha. A chave de cada linha é o seu conteúdo mais
+# quantas vezes ele já apareceu no mesmo envio; chaves_descontos guarda as
+# que já entraram. Uma linha reenviada (a mesma planilha com outro nome, ou
+# uma planilha acumulada) é reconhecida e não entra de novo; duas linhas
+# iguais no mesmo arquivo continuam sendo duas.
+def _chaves_linhas(linhas):
+    vistas = Counter()
+    for linha in linhas:
+        conteudo = "\x1f".join("" if valor is None else str(valor) for valor in linha)
+        resumo = hashlib.sha1(conteudo.encode()).digest()
+        vistas[resumo] += 1
+        yield (f"{resumo.hex()}:{vistas[resumo]}", *linha)
+
+
+def _preencher_chaves_descontos(conn):
+    # Linhas que já estão no banco, como se tivessem vindo em um único envio.
+    linhas = conn.execute(f"SELECT {', '.join(COLUNAS_DESCONTOS)} FROM descontos ORDER BY id")
+    conn.executemany(
+        "INSERT OR IGNORE INTO chaves_descontos (chave) VALUES (?)",
+        ((chave,) for chave, *_ in _chaves_linhas(linhas))
+    )
+
+
+def contar_descontos():
+    with conexao() as conn:
+        return conn.execute("SELECT COUNT(*) FROM descontos").fetchone()[0]
 
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS descontos (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            DISTRIBUIDORA TEXT,
-            FECHAMENTO TEXT,
-            NF TEXT,
-            DATA_EMISSAO TEXT,
-            CIDADE TEXT,
-            BASE TEXT,
-            VALOR_DESCONTO REAL,
-            OBSERVACAO TEXT,
-            MOTIVO TEXT
-        )
-    """)
 
-    conn.commit()
-    conn.close()
+def inserir_descontos(linhas):
+    # linhas: iterável de tuplas na ordem de COLUNAS_DESCONTOS, de um mesmo
+    # envio. Devolve (inseridas, repetidas): repetidas já estavam no banco.
+    colunas = ", ".join(COLUNAS_DESCONTOS)
+    marcadores = ", ".join("?" for _ in COLUNAS_DESCONTOS)
+
+    fechamentos = getattr(_local, "fechamentos_em_massa", None)
+    if fechamentos is not None:
+        linhas = _anotar_fechamentos(linhas, fechamentos)
+
+    # As linhas passam por uma tabela temporária para as novas entrarem em
+    # descontos com um único INSERT ... SELECT.
+    with transacao() as conn:
+        conn.execute(f"CREATE TEMP TABLE IF NOT EXISTS descontos_recebidos (chave TEXT, {colunas})")
+        conn.execute("DELETE FROM temp.descontos_recebidos")
+        conn.executemany(
+            f"INSERT INTO temp.descontos_recebidos VALUES (?, {marcadores})",
+            _chaves_linhas(linhas)
+        )
+        recebidas = conn.execute("SELECT COUNT(*) FROM temp.descontos_recebidos").fetchone()[0]
+        inseridas = conn.execute(f"""
+            INSERT INTO descontos ({colunas})
+            SELECT {colunas} FROM temp.descontos_recebidos
+            WHERE chave NOT IN (SELECT chave FROM chaves_descontos)
+            ORDER BY rowid
+        """).rowcount
+        conn.execute("INSERT OR IGNORE INTO chaves_descontos (chave) SELECT chave FROM temp.descontos_recebidos")
+        conn.execute("DELETE FROM temp.descontos_recebidos")
+        return inseridas, recebidas - inseridas
 
 
 def inserir_dados(df):
-    conn = conectar()
-    df.to_sql("descontos", conn, if_exists="append", index=False)
-    conn.close()
+    df = df.reindex(columns=COLUNAS_DESCONTOS)
+    for coluna in df.select_dtypes("datetime").columns:
+        df[coluna] = df[coluna].dt.strftime(FORMATO_DATA_HORA)
+    df = df.astype(object).where(df.notna(), None)
+    return inserir_descontos(df.itertuples(index=False, name=None))
 
 
-def carregar_dados():
-    conn = conectar()
-    df = pd.read_sql("SELECT * FROM descontos", conn)
-    conn.close()
-    return df
+@cache_por_versao("descontos")
+def carregar_dados(colunas=None):
+    return ler_tabela("descontos", f"SELECT {projetar_colunas('descontos', colunas)} FROM descontos")
 
 
 def limpar_dados():
-    conn = conectar()
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM descontos")
-    conn.commit()
-    conn.close()
+    with transacao() as conn:
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM descontos")
+        cursor.execute("DELETE FROM chaves_descontos")
+        # Sem os dados, as mesmas planilhas precisam poder ser importadas de novo.
+        cursor.execute("UPDATE uploads SET hash_arquivo = NULL")
+
+
+# =========================
+# CARGA EM MASSA
+# =========================
+# Em um lote grande, os triggers por linha de descontos (resumo, busca,
+# partições do snapshot e versão) custam mais que o próprio upsert e seguram
+# o lock de escrita do banco por tempo demais. Dentro da transação eles são
+# removidos, o upsert roda sozinho e o que eles manteriam é refeito uma vez
+# no final; depois voltam. No SQLite, DDL também é transacional: se algo
+# falhar, os triggers voltam junto com o rollback.
+LINHAS_CARGA_EM_MASSA = 20000
+
+
+def _anotar_fechamentos(linhas, fechamentos):
+    indice = COLUNAS_DESCONTOS.index("FECHAMENTO")
+    for linha in linhas:
+        fechamentos.add(linha[indice])
+        yield linha
+
+
+@contextmanager
+def carga_em_massa(ligada=True):
+    if not ligada or getattr(_local, "fechamentos_em_massa", None) is not None:
+        with transacao() as conn:
+            yield conn
+        return
+
+    with transacao() as conn:
+        # O sqlite3 do Python não abre transação para DDL: sem este BEGIN, cada
+        # DROP TRIGGER seria gravado na hora e uma carga que falhasse deixaria
+        # descontos sem triggers.
+        if not conn.in_transaction:
+            conn.execute("BEGIN IMMEDIATE")
+        triggers = conn.execute(
+            "SELECT name, sql FROM sqlite_master WHERE type = 'trigger' AND tbl_name = 'descontos'"
+        ).fetchall()
+        for nome, _ in triggers:
+            conn.execute(f"DROP TRIGGER {nome}")
+
+        _local.fechamentos_em_massa = fechamentos = set()
+        try:
+            yield conn
+        finally:
+            _local.fechamentos_em_massa = None
+
+        fts, _ = BUSCAS["descontos"]
+        conn.execute(f"INSERT INTO {fts} ({fts}) VALUES ('rebuild')")
+        recalcular_resumo_descontos()
+        conn.executemany(
+            "INSERT INTO particoes_colunares_pendentes (FECHAMENTO) VALUES (COALESCE(?, '')) "
+            "ON CONFLICT (FECHAMENTO) DO UPDATE SET marca = marca + 1",
+            [(fechamento,) for fechamento in fechamentos]
+        )
+        conn.execute("UPDATE versoes_dados SET versao = versao + 1 WHERE tabela = 'descontos'")
+        for _, sql in triggers:
+            conn.execute(sql)
 
 
 # =========================
 # HISTÓRICO DE UPLOADS
 # =========================
 def criar_tabela_uploads():
-    conn = conectar()
-    cursor = conn.cursor()
+    with transacao() as conn:
+        cursor = conn.cursor()
 
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS uploads (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            nome_arquivo TEXT,
-            data_upload TEXT
-        )
-    """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS uploads (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                nome_arquivo TEXT,
+                data_upload TEXT
+            )
+        """)
 
-    conn.commit()
-    conn.close()
 
+def registrar_upload(nome_arquivo, hash_arquivo=None, linhas_lidas=None, linhas_inseridas=None, linhas_repetidas=None):
+    with transacao() as conn:
+        cursor = conn.cursor()
 
-def registrar_upload(nome_arquivo):
-    conn = conectar()
-    cursor = conn.cursor()
+        cursor.execute("""
+            INSERT INTO uploads (
+                nome_arquivo, data_upload, hash_arquivo,
+                linhas_lidas, linhas_inseridas, linhas_repetidas
+            )
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, (
+            nome_arquivo,
+            datetime.now().strftime("%d/%m/%Y %H:%M"),
+            hash_arquivo,
+            linhas_lidas,
+            linhas_inseridas,
+            linhas_repetidas
+        ))
 
-    cursor.execute("""
-        INSERT INTO uploads (nome_arquivo, data_upload)
-        VALUES (?, ?)
-    """, (nome_arquivo, datetime.now().strftime("%d/%m/%Y %H:%M")))
 
-    conn.commit()
-    conn.close()
+def buscar_upload_por_hash(hash_arquivo):
+    with conexao() as conn:
+        cursor = conn.execute(
+            "SELECT * FROM uploads WHERE hash_arquivo = ? ORDER BY id DESC LIMIT 1",
+            (hash_arquivo,)
+        )
+        linha = cursor.fetchone()
+    if linha is None:
+        return None
+    return dict(zip([coluna[0] for coluna in cursor.description], linha))
 
 
+@cache_por_versao("uploads")
 def carregar_uploads():
-    conn = conectar()
-    df = pd.read_sql(
-        "SELECT nome_arquivo, data_upload FROM uploads ORDER BY id DESC",
-        conn
-    )
-    conn.close()
-    return df
+    with conexao() as conn:
+        return pd.read_sql(
+            """
+            SELECT nome_arquivo, data_upload, linhas_lidas, linhas_inseridas, linhas_repetidas
+            FROM uploads ORDER BY id DESC
+            """,
+            conn
+        )
 
 
 # =========================
-# OCORRÊNCIAS
+# FILA DE IMPORTAÇÕES
 # =========================
-def criar_tabela_ocorrencias():
-    conn = conectar()
-    cursor = conn.cursor()
+# Cada planilha enviada vira uma linha em importacoes, processada em segundo
+# plano (ver ingestao.enfileirar_importacao). A tela só lê esta tabela para
+# mostrar o andamento.
+STATUS_IMPORTACAO_ATIVOS = ("NA FILA", "PROCESSANDO")
 
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS ocorrencias (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            distribuidora TEXT,
-            pedido TEXT,
-            nota_fiscal TEXT,
-            emissao_nf TEXT,
-            valor_nf REAL,
-            valor_ocorrencia REAL,
-            cidade_nf TEXT,
-            filial TEXT,
-            ocorrencia TEXT,
-            vol_total_nf INTEGER,
-            volume_ocorrencia INTEGER,
-            status_atual TEXT,
-            data_ultimo_status TEXT,
-            follow_up TEXT,
-            status_rpg TEXT
+COLUNAS_IMPORTACAO_ATUALIZAVEIS = (
+    "status",
+    "total_estimado",
+    "linhas_lidas",
+    "linhas_inseridas",
+    "linhas_repetidas",
+    "linhas_rejeitadas",
+    "abas",
+    "erro",
+    "iniciada_em",
+    "concluida_em",
+    "duracao_segundos",
+)
+
+
+def criar_importacao(nome_arquivo, caminho, hash_arquivo, lote=None, todas_abas=False):
+    with transacao() as conn:
+        cursor = conn.execute("""
+            INSERT INTO importacoes (nome_arquivo, caminho, hash_arquivo, lote, todas_abas, status, criada_em)
+            VALUES (?, ?, ?, ?, ?, 'NA FILA', ?)
+        """, (
+            nome_arquivo,
+            caminho,
+            hash_arquivo,
+            lote,
+            int(todas_abas),
+            datetime.now().strftime("%d/%m/%Y %H:%M:%S")
+        ))
+        return cursor.lastrowid
+
+
+def atualizar_importacao(id_importacao, **campos):
+    invalidas = [coluna for coluna in campos if coluna not in COLUNAS_IMPORTACAO_ATUALIZAVEIS]
+    if invalidas:
+        raise ValueError(f"Colunas inválidas para importacoes: {', '.join(invalidas)}")
+    if not campos:
+        return
+
+    atribuicoes = ", ".join(f"{coluna} = ?" for coluna in campos)
+    with transacao() as conn:
+        conn.execute(
+            f"UPDATE importacoes SET {atribuicoes} WHERE id = ?",
+            list(campos.values()) + [id_importacao]
         )
-    """)
 
-    conn.commit()
-    conn.close()
+
+def _importacoes(where="", params=()):
+    with conexao() as conn:
+        cursor = conn.execute(f"SELECT * FROM importacoes{where} ORDER BY id", params)
+        colunas = [coluna[0] for coluna in cursor.description]
+        return [dict(zip(colunas, linha)) for linha in cursor.fetchall()]
+
+
+def buscar_importacao(id_importacao):
+    encontradas = _importacoes(" WHERE id = ?", (id_importacao,))
+    return encontradas[0] if encontradas else None
+
+
+def importacoes_ativas(hash_arquivo=None):
+    marcadores = ", ".join("?" for _ in STATUS_IMPORTACAO_ATIVOS)
+    where = f" WHERE status IN ({marcadores})"
+    params = list(STATUS_IMPORTACAO_ATIVOS)
+    if hash_arquivo is not None:
+        where += " AND hash_arquivo = ?"
+        params.append(hash_arquivo)
+    return _importacoes(where, params)
+
+
+def carregar_importacoes(limite=20):
+    with conexao() as conn:
+        return pd.read_sql(
+            """
+            SELECT id, nome_arquivo, status, COALESCE(total_estimado, 0) AS total_estimado,
+                   COALESCE(linhas_lidas, 0) AS linhas_lidas, linhas_inseridas,
+                   linhas_repetidas, linhas_rejeitadas, abas, erro, criada_em, iniciada_em, concluida_em, duracao_segundos
+            FROM importacoes ORDER BY id DESC LIMIT ?
+            """,
+            conn,
+            params=(limite,)
+        )
+
+
+# Linhas que a validação recusou (ingestao.validar_bloco): onde estavam na
+# planilha, o motivo e os valores como vieram, para o usuário corrigir.
+COLUNAS_REJEITADAS = ("aba", "linha", "erros") + COLUNAS_DESCONTOS
+
+
+def registrar_rejeitadas(id_importacao, linhas):
+    # linhas: iterável de tuplas na ordem de COLUNAS_REJEITADAS.
+    marcadores = ", ".join("?" for _ in range(len(COLUNAS_REJEITADAS) + 1))
+    with transacao() as conn:
+        conn.executemany(
+            f"INSERT INTO linhas_rejeitadas (importacao, {', '.join(COLUNAS_REJEITADAS)}) VALUES ({marcadores})",
+            ((id_importacao, *linha) for linha in linhas)
+        )
+
+
+def carregar_rejeitadas(id_importacao, limite=None):
+    with conexao() as conn:
+        return pd.read_sql(
+            f"SELECT {', '.join(COLUNAS_REJEITADAS)} FROM linhas_rejeitadas "
+            f"WHERE importacao = ? ORDER BY id LIMIT ?",
+            conn,
+            params=(id_importacao, -1 if limite is None else limite)
+        )
+
+
+# =========================
+# OCORRÊNCIAS
+# =========================
+def criar_tabela_ocorrencias():
+    with transacao() as conn:
+        cursor = conn.cursor()
+
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS ocorrencias (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                distribuidora TEXT,
+                pedido TEXT,
+                nota_fiscal TEXT,
+                emissao_nf TEXT,
+                valor_nf REAL,
+                valor_ocorrencia REAL,
+                cidade_nf TEXT,
+                filial TEXT,
+                ocorrencia TEXT,
+                vol_total_nf INTEGER,
+                volume_ocorrencia INTEGER,
+                status_atual TEXT,
+                data_ultimo_status TEXT,
+                follow_up TEXT,
+                status_rpg TEXT
+            )
+        """)
 
 
 def inserir_ocorrencia(
@@ -147,11 +958,29 @@ def inserir_ocorrencia(
     status_rpg,
     valor_ocorrencia
 ):
-    conn = conectar()
-    cursor = conn.cursor()
+    with transacao() as conn:
+        cursor = conn.cursor()
 
-    cursor.execute("""
-        INSERT INTO ocorrencias (
+        cursor.execute("""
+            INSERT INTO ocorrencias (
+                distribuidora,
+                pedido,
+                nota_fiscal,
+                emissao_nf,
+                valor_nf,
+                valor_ocorrencia,
+                cidade_nf,
+                filial,
+                ocorrencia,
+                vol_total_nf,
+                volume_ocorrencia,
+                status_atual,
+                data_ultimo_status,
+                follow_up,
+                status_rpg
+            )
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (
             distribuidora,
             pedido,
             nota_fiscal,
@@ -167,48 +996,37 @@ def inserir_ocorrencia(
             data_ultimo_status,
             follow_up,
             status_rpg
-        )
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    """, (
-        distribuidora,
-        pedido,
-        nota_fiscal,
-        emissao_nf,
-        valor_nf,
-        valor_ocorrencia,
-        cidade_nf,
-        filial,
-        ocorrencia,
-        vol_total_nf,
-        volume_ocorrencia,
-        status_atual,
-        data_ultimo_status,
-        follow_up,
-        status_rpg
-    ))
-
-    conn.commit()
-    conn.close()
-
-
-def carregar_ocorrencias():
-    conn = conectar()
-    df = pd.read_sql("SELECT * FROM ocorrencias ORDER BY id DESC", conn)
-    conn.close()
-    return df
+        ))
 
 
-def deletar_ocorrencia(id_ocorrencia):
-    conn = conectar()
-    cursor = conn.cursor()
+@cache_por_versao("ocorrencias")
+def carregar_ocorrencias(colunas=None):
+    return ler_tabela(
+        "ocorrencias",
+        f"SELECT {projetar_colunas('ocorrencias', colunas)} FROM ocorrencias ORDER BY id DESC"
+    )
+
 
-    cursor.execute(
-        "DELETE FROM ocorrencias WHERE id = ?",
-        (id_ocorrencia,)
+def consultar_ocorrencias(
+    filtros=None, limite=None, offset=0, ordenar_por="id", decrescente=True, colunas=None, incluir_arquivo=False
+):
+    return consultar_tabela(
+        "ocorrencias", filtros, limite, offset, ordenar_por, decrescente, colunas, incluir_arquivo=incluir_arquivo
     )
 
-    conn.commit()
-    conn.close()
+
+def contar_ocorrencias(filtros=None, incluir_arquivo=False):
+    return contar_tabela("ocorrencias", filtros, incluir_arquivo=incluir_arquivo)
+
+
+def deletar_ocorrencia(id_ocorrencia):
+    with transacao() as conn:
+        cursor = conn.cursor()
+
+        cursor.execute(
+            "DELETE FROM ocorrencias WHERE id = ?",
+            (id_ocorrencia,)
+        )
 
 
 def atualizar_ocorrencia(
@@ -229,117 +1047,951 @@ def atualizar_ocorrencia(
     status_rpg,
     valor_ocorrencia
 ):
-    conn = conectar()
-    cursor = conn.cursor()
-
-    cursor.execute("""
-        UPDATE ocorrencias SET
-            distribuidora = ?,
-            pedido = ?,
-            nota_fiscal = ?,
-            emissao_nf = ?,
-            valor_nf = ?,
-            valor_ocorrencia = ?,
-            cidade_nf = ?,
-            filial = ?,
-            ocorrencia = ?,
-            vol_total_nf = ?,
-            volume_ocorrencia = ?,
-            status_atual = ?,
-            data_ultimo_status = ?,
-            follow_up = ?,
-            status_rpg = ?
-        WHERE id = ?
-    """, (
-        distribuidora,
-        pedido,
-        nota_fiscal,
-        emissao_nf,
-        valor_nf,
-        valor_ocorrencia,
-        cidade_nf,
-        filial,
-        ocorrencia,
-        vol_total_nf,
-        volume_ocorrencia,
-        status_atual,
-        data_ultimo_status,
-        follow_up,
-        status_rpg,
-        id_ocorrencia
-    ))
-
-    conn.commit()
-    conn.close()
+    with transacao() as conn:
+        cursor = conn.cursor()
+
+        cursor.execute("""
+            UPDATE ocorrencias SET
+                distribuidora = ?,
+                pedido = ?,
+                nota_fiscal = ?,
+                emissao_nf = ?,
+                valor_nf = ?,
+                valor_ocorrencia = ?,
+                cidade_nf = ?,
+                filial = ?,
+                ocorrencia = ?,
+                vol_total_nf = ?,
+                volume_ocorrencia = ?,
+                status_atual = ?,
+                data_ultimo_status = ?,
+                follow_up = ?,
+                status_rpg = ?
+            WHERE id = ?
+        """, (
+            distribuidora,
+            pedido,
+            nota_fiscal,
+            emissao_nf,
+            valor_nf,
+            valor_ocorrencia,
+            cidade_nf,
+            filial,
+            ocorrencia,
+            vol_total_nf,
+            volume_ocorrencia,
+            status_atual,
+            data_ultimo_status,
+            follow_up,
+            status_rpg,
+            id_ocorrencia
+        ))
 
 
-def criar_tabela_pendencias():
-    conn = conectar()
-    cursor = conn.cursor()
+def atualizar_ocorrencias_em_lote(alteracoes):
+    return atualizar_em_lote("ocorrencias", alteracoes)
+
+
+def atualizar_ocorrencias_filtradas(filtros, valores):
+    return atualizar_filtradas("ocorrencias", filtros, valores)
 
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS pendencias_comprovante (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            motorista TEXT,
-            distribuidora TEXT,
-            nota_fiscal TEXT,
-            emissao TEXT,
-            saida TEXT,
-            manifesto TEXT,
-            obs TEXT,
-            status TEXT
-        )
-    """)
 
-    conn.commit()
-    conn.close()
+def criar_tabela_pendencias():
+    with transacao() as conn:
+        cursor = conn.cursor()
+
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS pendencias_comprovante (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                motorista TEXT,
+                distribuidora TEXT,
+                nota_fiscal TEXT,
+                emissao TEXT,
+                saida TEXT,
+                manifesto TEXT,
+                obs TEXT,
+                status TEXT
+            )
+        """)
 
 
 def inserir_pendencia(motorista, distribuidora, nota_fiscal, emissao, saida, manifesto, obs, status):
-    conn = conectar()
-    cursor = conn.cursor()
+    with transacao() as conn:
+        cursor = conn.cursor()
+
+        cursor.execute("""
+            INSERT INTO pendencias_comprovante (
+                motorista, distribuidora, nota_fiscal, emissao, saida, manifesto, obs, status
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """, (motorista, distribuidora, nota_fiscal, emissao, saida, manifesto, obs, status))
 
-    cursor.execute("""
-        INSERT INTO pendencias_comprovante (
-            motorista, distribuidora, nota_fiscal, emissao, saida, manifesto, obs, status
-        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-    """, (motorista, distribuidora, nota_fiscal, emissao, saida, manifesto, obs, status))
 
-    conn.commit()
-    conn.close()
+@cache_por_versao("pendencias_comprovante")
+def carregar_pendencias(colunas=None):
+    return ler_tabela(
+        "pendencias_comprovante",
+        f"SELECT {projetar_colunas('pendencias_comprovante', colunas)} FROM pendencias_comprovante"
+    )
 
 
-def carregar_pendencias():
-    conn = conectar()
-    df = pd.read_sql("SELECT * FROM pendencias_comprovante", conn)
-    conn.close()
-    return df
+def consultar_pendencias(
+    filtros=None, limite=None, offset=0, ordenar_por="id", decrescente=False, colunas=None, incluir_arquivo=False
+):
+    return consultar_tabela(
+        "pendencias_comprovante", filtros, limite, offset, ordenar_por, decrescente, colunas,
+        incluir_arquivo=incluir_arquivo
+    )
+
+
+def contar_pendencias(filtros=None, incluir_arquivo=False):
+    return contar_tabela("pendencias_comprovante", filtros, incluir_arquivo=incluir_arquivo)
 
 
 def atualizar_pendencia(id_pendencia, motorista, distribuidora, nota_fiscal, emissao, saida, manifesto, obs, status):
-    conn = conectar()
-    cursor = conn.cursor()
+    with transacao() as conn:
+        cursor = conn.cursor()
 
-    cursor.execute("""
-        UPDATE pendencias_comprovante
-        SET motorista=?, distribuidora=?, nota_fiscal=?, emissao=?, saida=?, manifesto=?, obs=?, status=?
-        WHERE id=?
-    """, (motorista, distribuidora, nota_fiscal, emissao, saida, manifesto, obs, status, id_pendencia))
+        cursor.execute("""
+            UPDATE pendencias_comprovante
+            SET motorista=?, distribuidora=?, nota_fiscal=?, emissao=?, saida=?, manifesto=?, obs=?, status=?
+            WHERE id=?
+        """, (motorista, distribuidora, nota_fiscal, emissao, saida, manifesto, obs, status, id_pendencia))
 
-    conn.commit()
-    conn.close()
+
+def atualizar_pendencias_em_lote(alteracoes):
+    return atualizar_em_lote("pendencias_comprovante", alteracoes)
+
+
+def atualizar_pendencias_filtradas(filtros, valores):
+    return atualizar_filtradas("pendencias_comprovante", filtros, valores)
 
 
 def deletar_pendencia(id_pendencia):
-    conn = conectar()
-    cursor = conn.cursor()
+    with transacao() as conn:
+        cursor = conn.cursor()
+
+        cursor.execute("DELETE FROM pendencias_comprovante WHERE id=?", (id_pendencia,))
+
+# =========================
+# CIDADES X FILIAIS
+# =========================
+COLUNAS_CIDADES = (
+    "cidade_normalizada",
+    "cidade",
+    "filial",
+    "sigla",
+    "lider_base",
+    "gerente_responsavel",
+    "telefone_base",
+)
+
+
+def ler_metadado(chave):
+    with conexao() as conn:
+        linha = conn.execute("SELECT valor FROM metadados WHERE chave = ?", (chave,)).fetchone()
+    return linha[0] if linha else None
+
+
+def gravar_metadado(chave, valor):
+    with transacao() as conn:
+        conn.execute(
+            "INSERT INTO metadados (chave, valor) VALUES (?, ?) "
+            "ON CONFLICT (chave) DO UPDATE SET valor = excluded.valor",
+            (chave, valor)
+        )
+
+
+def substituir_cidades_filiais(linhas, chave_versao, versao):
+    # linhas: tuplas na ordem de COLUNAS_CIDADES.
+    colunas = ", ".join(COLUNAS_CIDADES)
+    marcadores = ", ".join("?" for _ in COLUNAS_CIDADES)
+
+    with transacao() as conn:
+        conn.execute("DELETE FROM cidades_filiais")
+        conn.executemany(
+            f"INSERT OR IGNORE INTO cidades_filiais ({colunas}) VALUES ({marcadores})",
+            linhas
+        )
+        gravar_metadado(chave_versao, versao)
+
+
+def carregar_cidades_filiais():
+    with conexao() as conn:
+        return pd.read_sql("SELECT * FROM cidades_filiais ORDER BY cidade_normalizada", conn)
+
+
+# =========================
+# RESUMOS DE DESCONTOS
+# =========================
+# Totais de VALOR_DESCONTO por dimensão, mantidos por triggers a cada
+# inserção, atualização ou remoção em descontos. As perguntas da IA leem daqui
+# em vez de agrupar a tabela inteira.
+DIMENSOES_RESUMO = ("BASE", "CIDADE", "DISTRIBUIDORA", "OBSERVACAO", "FECHAMENTO")
+
+
+def _somar_no_resumo(linha, sinal):
+    # linha: NEW ou OLD dentro do trigger; sinal: +1 ao entrar, -1 ao sair.
+    comandos = []
+    for dimensao in DIMENSOES_RESUMO:
+        if sinal > 0:
+            comandos.append(f"""
+                INSERT INTO resumo_descontos (dimensao, valor, total, quantidade)
+                SELECT '{dimensao}', {linha}.{dimensao}, COALESCE({linha}.VALOR_DESCONTO, 0), 1
+                WHERE {linha}.{dimensao} IS NOT NULL
+                ON CONFLICT (dimensao, valor) DO UPDATE SET
+                    total = total + excluded.total,
+                    quantidade = quantidade + 1;
+            """)
+        else:
+            # Só a chave que a linha tocou: apagar "WHERE quantidade <= 0"
+            # varreria o resumo inteiro a cada linha removida.
+            comandos.append(f"""
+                UPDATE resumo_descontos SET
+                    total = total - COALESCE({linha}.VALOR_DESCONTO, 0),
+                    quantidade = quantidade - 1
+                WHERE dimensao = '{dimensao}' AND valor = {linha}.{dimensao};
+                DELETE FROM resumo_descontos
+                WHERE dimensao = '{dimensao}' AND valor = {linha}.{dimensao} AND quantidade <= 0;
+            """)
+    return "".join(comandos)
+
+
+def _criar_resumo_descontos(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS resumo_descontos (
+            dimensao TEXT NOT NULL,
+            valor TEXT NOT NULL,
+            total REAL NOT NULL,
+            quantidade INTEGER NOT NULL,
+            PRIMARY KEY (dimensao, valor)
+        )
+    """)
+    _criar_triggers_resumo(conn)
+    recalcular_resumo_descontos()
+
+
+def _criar_triggers_resumo(conn):
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_descontos_resumo_insert
+        AFTER INSERT ON descontos
+        BEGIN {_somar_no_resumo("NEW", 1)} END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_descontos_resumo_delete
+        AFTER DELETE ON descontos
+        BEGIN {_somar_no_resumo("OLD", -1)} END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_descontos_resumo_update
+        AFTER UPDATE ON descontos
+        BEGIN {_somar_no_resumo("OLD", -1)} {_somar_no_resumo("NEW", 1)} END
+    """)
+
+
+def recalcular_resumo_descontos():
+    with transacao() as conn:
+        conn.execute("DELETE FROM resumo_descontos")
+        for dimensao in DIMENSOES_RESUMO:
+            conn.execute(f"""
+                INSERT INTO resumo_descontos (dimensao, valor, total, quantidade)
+                SELECT '{dimensao}', {dimensao}, COALESCE(SUM(VALOR_DESCONTO), 0), COUNT(*)
+                FROM descontos
+                WHERE {dimensao} IS NOT NULL
+                GROUP BY {dimensao}
+            """)
+
+
+# =========================
+# BUSCA TEXTUAL (FTS5)
+# =========================
+# Um índice FTS5 por tabela, no modo "external content": o texto não é
+# duplicado, só o índice invertido, mantido por triggers. A busca devolve as
+# linhas ordenadas por relevância (bm25) com um trecho destacado.
+# tabela -> (tabela FTS, coluna de texto)
+BUSCAS = {
+    "ocorrencias": ("busca_ocorrencias", "follow_up"),
+    "pendencias_comprovante": ("busca_pendencias", "obs"),
+    "descontos": ("busca_descontos", "OBSERVACAO"),
+}
+
+
+def _criar_busca(conn):
+    for tabela, (fts, coluna) in BUSCAS.items():
+        conn.execute(f"""
+            CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5(
+                {coluna},
+                content='{tabela}',
+                content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2'
+            )
+        """)
+
+        remover = f"INSERT INTO {fts} ({fts}, rowid, {coluna}) VALUES ('delete', OLD.id, OLD.{coluna});"
+        inserir = f"INSERT INTO {fts} (rowid, {coluna}) VALUES (NEW.id, NEW.{coluna});"
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_{fts}_insert AFTER INSERT ON {tabela}
+            BEGIN {inserir} END
+        """)
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_{fts}_delete AFTER DELETE ON {tabela}
+            BEGIN {remover} END
+        """)
+        # Só quando o texto muda: alterações de status em lote não mexem no índice.
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_{fts}_update AFTER UPDATE OF {coluna} ON {tabela}
+            BEGIN {remover} {inserir} END
+        """)
+
+        conn.execute(f"INSERT INTO {fts} ({fts}) VALUES ('rebuild')")
+
+
+def expressao_busca(texto):
+    # Cada palavra digitada vira um termo entre aspas com busca por prefixo;
+    # aspas e operadores do FTS5 digitados pelo usuário não são interpretados.
+    palavras = re.findall(r"\w+", texto or "")
+    return " ".join(f'"{palavra}"*' for palavra in palavras)
+
+
+@cache_por_versao()
+def buscar_texto(tabela, texto, limite=100):
+    fts, coluna = BUSCAS[tabela]
+    expressao = expressao_busca(texto)
+    if not expressao:
+        return ler_tabela(tabela, f"SELECT *, '' AS trecho FROM {tabela} WHERE 0")
+
+    return ler_tabela(
+        tabela,
+        f"""
+        SELECT {tabela}.*, snippet({fts}, 0, '**', '**', '…', 12) AS trecho
+        FROM {fts}
+        JOIN {tabela} ON {tabela}.id = {fts}.rowid
+        WHERE {fts} MATCH ?
+        ORDER BY {fts}.rank
+        LIMIT ?
+        """,
+        (expressao, int(limite))
+    )
+
+
+# =========================
+# SNAPSHOT COLUNAR (PARTIÇÕES PENDENTES)
+# =========================
+# Cópia opcional de descontos em Parquet, uma partição por FECHAMENTO (ver
+# colunar.py). Os triggers anotam aqui cada fechamento que mudou; a
+# atualização reescreve só esses. "marca" muda a cada alteração, para um
+# fechamento alterado durante a reescrita continuar pendente.
+# NULL vira '' porque NULL não conflita na chave primária.
+def _marcar_particao(linha):
+    return f"""
+        INSERT INTO particoes_colunares_pendentes (FECHAMENTO)
+        VALUES (COALESCE({linha}.FECHAMENTO, ''))
+        ON CONFLICT (FECHAMENTO) DO UPDATE SET marca = marca + 1;
+    """
+
+
+def _criar_particoes_pendentes(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS particoes_colunares_pendentes (
+            FECHAMENTO TEXT PRIMARY KEY,
+            marca INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_descontos_colunar_insert
+        AFTER INSERT ON descontos
+        BEGIN {_marcar_particao("NEW")} END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_descontos_colunar_delete
+        AFTER DELETE ON descontos
+        BEGIN {_marcar_particao("OLD")} END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_descontos_colunar_update
+        AFTER UPDATE ON descontos
+        BEGIN {_marcar_particao("OLD")} {_marcar_particao("NEW")} END
+    """)
+
+    marcar_todas_particoes()
+
+
+def marcar_todas_particoes():
+    # Na criação, ou quando a pasta do snapshot some, tudo precisa ser reescrito.
+    with transacao() as conn:
+        conn.execute("""
+            INSERT OR IGNORE INTO particoes_colunares_pendentes (FECHAMENTO)
+            SELECT DISTINCT COALESCE(FECHAMENTO, '') FROM descontos
+        """)
+
+
+def particoes_pendentes():
+    with conexao() as conn:
+        return conn.execute("SELECT FECHAMENTO, marca FROM particoes_colunares_pendentes").fetchall()
+
+
+def concluir_particoes(particoes):
+    # particoes: (FECHAMENTO, marca) lidas antes da reescrita.
+    with transacao() as conn:
+        conn.executemany(
+            "DELETE FROM particoes_colunares_pendentes WHERE FECHAMENTO = ? AND marca = ?",
+            particoes
+        )
+
+
+# =========================
+# VERSÕES DE DADOS
+# =========================
+# Um contador por tabela, incrementado por triggers a cada linha inserida,
+# alterada ou removida. Serve de chave para caches: se a versão não mudou,
+# o que foi lido antes ainda vale, mesmo entre processos diferentes.
+TABELAS_VERSIONADAS = ("descontos", "ocorrencias", "pendencias_comprovante", "uploads")
+
+
+def _criar_versoes_dados(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS versoes_dados (
+            tabela TEXT PRIMARY KEY,
+            versao INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+
+    for tabela in TABELAS_VERSIONADAS:
+        conn.execute("INSERT OR IGNORE INTO versoes_dados (tabela, versao) VALUES (?, 0)", (tabela,))
+        for evento in ("INSERT", "UPDATE", "DELETE"):
+            conn.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS trg_{tabela}_versao_{evento.lower()}
+                AFTER {evento} ON {tabela}
+                BEGIN
+                    UPDATE versoes_dados SET versao = versao + 1 WHERE tabela = '{tabela}';
+                END
+            """)
+
+
+def versao_dados(tabela):
+    with conexao() as conn:
+        linha = conn.execute("SELECT versao FROM versoes_dados WHERE tabela = ?", (tabela,)).fetchone()
+    return linha[0] if linha else 0
+
+
+# =========================
+# SINCRONIZAÇÃO INCREMENTAL
+# =========================
+# Para ocorrências e pendências, cada linha tem em versoes_linhas a versão da
+# tabela em que foi inserida, alterada ou removida pela última vez. Uma sessão
+# que já tem a tabela em memória pede só o que mudou depois da versão que ela
+# conhece e mescla no DataFrame, em vez de ler a tabela inteira de novo.
+# O mesmo trigger incrementa versoes_dados e carimba a linha, para o carimbo
+# nunca ficar para trás da versão lida.
+TABELAS_SINCRONIZADAS = ("ocorrencias", "pendencias_comprovante")
+
+# Acima dessa fração de linhas alteradas, reler a tabela sai mais barato.
+FRACAO_RELEITURA = 0.5
+
+
+def _carimbar_linha(tabela, linha, removida):
+    return f"""
+        UPDATE versoes_dados SET versao = versao + 1 WHERE tabela = '{tabela}';
+        INSERT INTO versoes_linhas (tabela, id, versao, removida, alterada_em)
+        VALUES (
+            '{tabela}', {linha}.id,
+            (SELECT versao FROM versoes_dados WHERE tabela = '{tabela}'),
+            {removida}, datetime('now', 'localtime')
+        )
+        ON CONFLICT (tabela, id) DO UPDATE SET
+            versao = excluded.versao,
+            removida = excluded.removida,
+            alterada_em = excluded.alterada_em;
+    """
+
+
+def _criar_versoes_linhas(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS versoes_linhas (
+            tabela TEXT NOT NULL,
+            id INTEGER NOT NULL,
+            versao INTEGER NOT NULL,
+            removida INTEGER NOT NULL DEFAULT 0,
+            alterada_em TEXT,
+            PRIMARY KEY (tabela, id)
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_versoes_linhas_versao ON versoes_linhas (tabela, versao)")
+
+    for tabela in TABELAS_SINCRONIZADAS:
+        for evento, linha, removida in (("INSERT", "NEW", 0), ("UPDATE", "NEW", 0), ("DELETE", "OLD", 1)):
+            # Substitui o trigger que só incrementava a versão da tabela.
+            conn.execute(f"DROP TRIGGER IF EXISTS trg_{tabela}_versao_{evento.lower()}")
+            conn.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS trg_{tabela}_versao_linha_{evento.lower()}
+                AFTER {evento} ON {tabela}
+                BEGIN {_carimbar_linha(tabela, linha, removida)} END
+            """)
+
+        conn.execute(f"""
+            INSERT OR IGNORE INTO versoes_linhas (tabela, id, versao, removida)
+            SELECT '{tabela}', id, (SELECT versao FROM versoes_dados WHERE tabela = '{tabela}'), 0
+            FROM {tabela}
+        """)
+
+
+@contextmanager
+def _leitura_consistente():
+    # Várias leituras vendo o mesmo momento do banco (no WAL, uma transação
+    # de leitura não enxerga o que for gravado depois que ela começou).
+    with conexao() as conn:
+        if conn.in_transaction:
+            yield conn
+            return
+        conn.execute("BEGIN")
+        try:
+            yield conn
+        finally:
+            conn.rollback()
+
+
+def _validar_sincronizada(tabela):
+    if tabela not in TABELAS_SINCRONIZADAS:
+        raise ValueError(f"Tabela sem sincronização incremental: {tabela}")
+
+
+def linhas_alteradas(tabela, desde):
+    # Devolve (versão atual, linhas inseridas/alteradas, ids removidos) depois de "desde".
+    _validar_sincronizada(tabela)
+    with _leitura_consistente() as conn:
+        versao = versao_dados(tabela)
+        alteradas = ler_tabela(
+            tabela,
+            f"SELECT t.* FROM versoes_linhas v JOIN {tabela} t ON t.id = v.id "
+            f"WHERE v.tabela = ? AND v.versao > ? AND v.removida = 0 ORDER BY t.id",
+            (tabela, desde)
+        )
+        removidos = [
+            linha[0] for linha in conn.execute(
+                "SELECT id FROM versoes_linhas WHERE tabela = ? AND versao > ? AND removida = 1",
+                (tabela, desde)
+            )
+        ]
+    return versao, alteradas, removidos
+
+
+def _ler_sincronizada(tabela):
+    with _leitura_consistente():
+        versao = versao_dados(tabela)
+        df = ler_tabela(tabela, f"SELECT * FROM {tabela} ORDER BY id")
+    return {"versao": versao, "df": df, "linhas_lidas": len(df)}
+
+
+def _alinhar_categorias(base, alteradas):
+    # Categorias diferentes nos dois lados viram object no concat; une antes.
+    for coluna in base.columns:
+        tipos = (base[coluna].dtype, alteradas[coluna].dtype)
+        if not any(isinstance(tipo, pd.CategoricalDtype) for tipo in tipos):
+            continue
+        a = base[coluna].astype("category")
+        b = alteradas[coluna].astype("category")
+        tipo = pd.CategoricalDtype(a.cat.categories.union(b.cat.categories))
+        base[coluna] = a.astype(tipo)
+        alteradas[coluna] = b.astype(tipo)
+
+
+def _mesclar(df, alteradas, removidos):
+    fora = df["id"].isin(removidos) | df["id"].isin(alteradas["id"])
+    base = df[~fora]
+    if alteradas.empty:
+        return base.reset_index(drop=True)
+
+    base = base.copy()
+    _alinhar_categorias(base, alteradas)
+    return pd.concat([base, alteradas], ignore_index=True).sort_values("id", ignore_index=True)
+
+
+def sincronizar_tabela(tabela, estado=None):
+    # estado: o que a sessão guardou da última chamada ({"versao", "df", ...})
+    # ou None. Devolve o estado novo; "linhas_lidas" diz quanto veio do banco.
+    _validar_sincronizada(tabela)
+    if estado is None:
+        return _ler_sincronizada(tabela)
+    if estado["versao"] == versao_dados(tabela):
+        return {**estado, "linhas_lidas": 0}
+
+    versao, alteradas, removidos = linhas_alteradas(tabela, estado["versao"])
+    if len(alteradas) + len(removidos) > FRACAO_RELEITURA * max(len(estado["df"]), 1):
+        return _ler_sincronizada(tabela)
+
+    return {
+        "versao": versao,
+        "df": _mesclar(estado["df"], alteradas, removidos),
+        "linhas_lidas": len(alteradas) + len(removidos),
+    }
 
-    cursor.execute("DELETE FROM pendencias_comprovante WHERE id=?", (id_pendencia,))
 
-    conn.commit()
-    conn.close()
+def filtrar_quadro(tabela, df, filtros):
+    # Os mesmos filtros de montar_where ({coluna: valores}), aplicados a um
+    # DataFrame já em memória.
+    _, colunas_filtro = TABELAS_CONSULTA[tabela]
+    manter = pd.Series(True, index=df.index)
+    for coluna, valores in (filtros or {}).items():
+        if not valores:
+            continue
+        if coluna not in colunas_filtro:
+            raise ValueError(f"Coluna de filtro inválida: {coluna}")
+        manter &= df[coluna].isin(list(valores))
+    return df[manter].reset_index(drop=True)
+
+
+# =========================
+# ARQUIVAMENTO
+# =========================
+# Ocorrências encerradas e pendências regularizadas há mais de
+# DIAS_ARQUIVAMENTO dias saem das tabelas do dia a dia para tabelas
+# *_arquivo no mesmo banco (mesmas colunas e ids, mais arquivada_em). As
+# consultas leem só as tabelas ativas; com incluir_arquivo=True leem as duas,
+# com a coluna "arquivada" dizendo de onde veio cada linha.
+# A idade conta da última alteração da linha (versoes_linhas) ou, para linhas
+# antigas sem esse registro, da data de status/saída. 0 desliga.
+DIAS_ARQUIVAMENTO = int(os.environ.get("RPG_DIAS_ARQUIVAMENTO", "180"))
+
+# status_rpg é texto livre: comparado sem espaços nas pontas e em maiúsculas.
+STATUS_RPG_ENCERRADOS = tuple(
+    status.strip().upper()
+    for status in os.environ.get("RPG_STATUS_ENCERRADOS", "FINALIZADO,ENCERRADO,FECHADO,CONCLUIDO").split(",")
+    if status.strip()
+)
+
+TABELAS_ARQUIVO = {
+    "ocorrencias": "ocorrencias_arquivo",
+    "pendencias_comprovante": "pendencias_comprovante_arquivo",
+}
+
+
+def origem_consulta(tabela, incluir_arquivo=False):
+    # O que vai no FROM: a tabela ativa ou a união dela com o arquivo.
+    if not incluir_arquivo:
+        return tabela
+    if tabela not in TABELAS_ARQUIVO:
+        raise ValueError(f"Tabela sem arquivo: {tabela}")
+
+    colunas = ", ".join(TABELAS_CONSULTA[tabela][0])
+    return (
+        f"(SELECT {colunas}, 0 AS arquivada FROM {tabela} "
+        f"UNION ALL SELECT {colunas}, 1 AS arquivada FROM {TABELAS_ARQUIVO[tabela]})"
+    )
+
+
+def _criar_tabela_arquivo(conn, tabela):
+    # Mesmo schema da tabela ativa, com o id vindo dela (sem AUTOINCREMENT).
+    colunas = [
+        f"{nome} {tipo}" for _, nome, tipo, _, _, _ in conn.execute(f"PRAGMA table_info({tabela})")
+        if nome != "id"
+    ]
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {TABELAS_ARQUIVO[tabela]} (
+            id INTEGER PRIMARY KEY,
+            {", ".join(colunas)},
+            arquivada_em TEXT
+        )
+    """)
+
+
+def _criar_arquivos(conn):
+    for tabela in TABELAS_ARQUIVO:
+        _criar_tabela_arquivo(conn, tabela)
+
+
+def _condicao_arquivamento(tabela, dias):
+    limite = f"date('now', 'localtime', '-{int(dias)} days')"
+    if tabela == "ocorrencias":
+        marcadores = ", ".join("?" for _ in STATUS_RPG_ENCERRADOS)
+        return (
+            f"UPPER(TRIM(t.status_rpg)) IN ({marcadores}) "
+            f"AND COALESCE(v.alterada_em, t.data_ultimo_status) < {limite}",
+            list(STATUS_RPG_ENCERRADOS)
+        )
+    return (
+        f"t.status = 'REGULARIZADO' AND COALESCE(v.alterada_em, t.saida, t.emissao) < {limite}",
+        []
+    )
+
+
+def _mover(conn, origem, destino, colunas, carimbar=False):
+    # Copia as linhas de temp.ids_movidos de origem para destino e apaga da
+    # origem; carimbar preenche arquivada_em.
+    lista = ", ".join(colunas)
+    destino_colunas = lista + (", arquivada_em" if carimbar else "")
+    valores = lista + (", datetime('now', 'localtime')" if carimbar else "")
+    conn.execute(
+        f"INSERT OR REPLACE INTO {destino} ({destino_colunas}) "
+        f"SELECT {valores} FROM {origem} WHERE id IN (SELECT id FROM temp.ids_movidos)"
+    )
+    return conn.execute(f"DELETE FROM {origem} WHERE id IN (SELECT id FROM temp.ids_movidos)").rowcount
+
+
+def arquivar_encerradas(dias=DIAS_ARQUIVAMENTO):
+    # Devolve {tabela: linhas arquivadas}. Tudo em uma transação.
+    movidas = {}
+    with transacao() as conn:
+        for tabela, arquivo in TABELAS_ARQUIVO.items():
+            condicao, params = _condicao_arquivamento(tabela, dias)
+            conn.execute("DROP TABLE IF EXISTS temp.ids_movidos")
+            conn.execute(f"""
+                CREATE TEMP TABLE ids_movidos AS
+                SELECT t.id FROM {tabela} t
+                LEFT JOIN versoes_linhas v ON v.tabela = '{tabela}' AND v.id = t.id
+                WHERE {condicao}
+            """, params)
+            movidas[tabela] = _mover(conn, tabela, arquivo, TABELAS_CONSULTA[tabela][0], carimbar=True)
+            conn.execute("DROP TABLE temp.ids_movidos")
+    return movidas
+
+
+def desarquivar(tabela, ids):
+    # Devolve linhas arquivadas para a tabela ativa (ex.: ocorrência reaberta).
+    if tabela not in TABELAS_ARQUIVO:
+        raise ValueError(f"Tabela sem arquivo: {tabela}")
+
+    with transacao() as conn:
+        conn.execute("DROP TABLE IF EXISTS temp.ids_movidos")
+        conn.execute("CREATE TEMP TABLE ids_movidos (id INTEGER PRIMARY KEY)")
+        conn.executemany("INSERT OR IGNORE INTO temp.ids_movidos (id) VALUES (?)", [(int(i),) for i in ids])
+        movidas = _mover(conn, TABELAS_ARQUIVO[tabela], tabela, TABELAS_CONSULTA[tabela][0])
+        conn.execute("DROP TABLE temp.ids_movidos")
+    return movidas
+
+
+def contar_arquivadas():
+    with conexao() as conn:
+        return {
+            tabela: conn.execute(f"SELECT COUNT(*) FROM {arquivo}").fetchone()[0]
+            for tabela, arquivo in TABELAS_ARQUIVO.items()
+        }
+
+
+def arquivar_se_preciso():
+    # No máximo uma vez por dia; a data é gravada antes, para outra sessão
+    # que abrir ao mesmo tempo não repetir o trabalho.
+    hoje = date.today().isoformat()
+    if DIAS_ARQUIVAMENTO <= 0 or ler_metadado("arquivamento_em") == hoje:
+        return None
+    gravar_metadado("arquivamento_em", hoje)
+    return arquivar_encerradas()
+
+
+def arquivar_em_segundo_plano():
+    if DIAS_ARQUIVAMENTO > 0 and ler_metadado("arquivamento_em") != date.today().isoformat():
+        threading.Thread(target=arquivar_se_preciso, daemon=True).start()
+
+
+# =========================
+# MIGRAÇÕES DE SCHEMA
+# =========================
+# Cada migração é aplicada uma única vez, em ordem, e registrada em
+# schema_version. Para evoluir o banco basta acrescentar uma nova entrada no
+# fim da lista; um passo pode ser um comando SQL ou uma função que recebe a
+# conexão (para migrações de dados).
+MIGRACOES = [
+    (1, "Índices de consulta para ocorrências, descontos e pendências", [
+        "CREATE INDEX IF NOT EXISTS idx_ocorrencias_nota_fiscal ON ocorrencias (nota_fiscal)",
+        "CREATE INDEX IF NOT EXISTS idx_ocorrencias_pedido ON ocorrencias (pedido)",
+        "CREATE INDEX IF NOT EXISTS idx_ocorrencias_distribuidora_status ON ocorrencias (distribuidora, status_rpg)",
+        "CREATE INDEX IF NOT EXISTS idx_ocorrencias_status_rpg_emissao ON ocorrencias (status_rpg, emissao_nf)",
+        "CREATE INDEX IF NOT EXISTS idx_ocorrencias_status_atual ON ocorrencias (status_atual)",
+        "CREATE INDEX IF NOT EXISTS idx_ocorrencias_emissao_nf ON ocorrencias (emissao_nf)",
+        "CREATE INDEX IF NOT EXISTS idx_ocorrencias_cidade_nf ON ocorrencias (cidade_nf)",
+        "CREATE INDEX IF NOT EXISTS idx_ocorrencias_filial ON ocorrencias (filial)",
+        "CREATE INDEX IF NOT EXISTS idx_ocorrencias_ocorrencia ON ocorrencias (ocorrencia)",
+        "CREATE INDEX IF NOT EXISTS idx_descontos_nf ON descontos (NF)",
+        "CREATE INDEX IF NOT EXISTS idx_descontos_distribuidora_fechamento ON descontos (DISTRIBUIDORA, FECHAMENTO)",
+        "CREATE INDEX IF NOT EXISTS idx_descontos_fechamento ON descontos (FECHAMENTO)",
+        "CREATE INDEX IF NOT EXISTS idx_descontos_cidade ON descontos (CIDADE)",
+        "CREATE INDEX IF NOT EXISTS idx_descontos_base ON descontos (BASE)",
+        "CREATE INDEX IF NOT EXISTS idx_pendencias_nota_fiscal ON pendencias_comprovante (nota_fiscal)",
+        "CREATE INDEX IF NOT EXISTS idx_pendencias_distribuidora ON pendencias_comprovante (distribuidora)",
+        "CREATE INDEX IF NOT EXISTS idx_pendencias_status_emissao ON pendencias_comprovante (status, emissao)",
+        "CREATE INDEX IF NOT EXISTS idx_pendencias_motorista ON pendencias_comprovante (motorista)",
+        "CREATE INDEX IF NOT EXISTS idx_pendencias_manifesto ON pendencias_comprovante (manifesto)",
+    ]),
+    (2, "Chave natural em descontos e hash/contagens em uploads", [
+        # A chave não é única (ver _chaves_linhas): só um índice de busca.
+        "CREATE INDEX IF NOT EXISTS idx_descontos_chave ON descontos (NF, DISTRIBUIDORA, FECHAMENTO)",
+        "DROP INDEX IF EXISTS idx_descontos_nf",
+        "ALTER TABLE uploads ADD COLUMN hash_arquivo TEXT",
+        "ALTER TABLE uploads ADD COLUMN linhas_lidas INTEGER",
+        "ALTER TABLE uploads ADD COLUMN linhas_inseridas INTEGER",
+        "ALTER TABLE uploads ADD COLUMN linhas_atualizadas INTEGER",
+        "CREATE INDEX IF NOT EXISTS idx_uploads_hash ON uploads (hash_arquivo)",
+    ]),
+    (3, "Tabela resumo_descontos mantida por triggers", [
+        _criar_resumo_descontos,
+    ]),
+    (4, "Cidades x filiais no banco", [
+        """
+        CREATE TABLE IF NOT EXISTS metadados (
+            chave TEXT PRIMARY KEY,
+            valor TEXT
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS cidades_filiais (
+            cidade_normalizada TEXT PRIMARY KEY,
+            cidade TEXT,
+            filial TEXT,
+            sigla TEXT,
+            lider_base TEXT,
+            gerente_responsavel TEXT,
+            telefone_base TEXT
+        )
+        """,
+        # A planilha já usa nomes sem acento e em maiúsculas, então UPPER/TRIM
+        # basta para casar com a cidade digitada na ocorrência.
+        """
+        CREATE VIEW IF NOT EXISTS ocorrencias_com_filial AS
+        SELECT o.*, cf.filial AS filial_cadastro, cf.sigla, cf.lider_base
+        FROM ocorrencias o
+        LEFT JOIN cidades_filiais cf
+            ON cf.cidade_normalizada = UPPER(TRIM(o.cidade_nf))
+        """,
+    ]),
+    (5, "Contadores de versão por tabela", [
+        _criar_versoes_dados,
+    ]),
+    (6, "Índices para os relatórios agregados", [
+        "CREATE INDEX IF NOT EXISTS idx_descontos_observacao ON descontos (OBSERVACAO)",
+        "CREATE INDEX IF NOT EXISTS idx_pendencias_emissao ON pendencias_comprovante (emissao)",
+    ]),
+    (7, "Busca textual (FTS5) em follow_up, obs e OBSERVACAO", [
+        _criar_busca,
+    ]),
+    (8, "Fila de importações em segundo plano", [
+        """
+        CREATE TABLE IF NOT EXISTS importacoes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            nome_arquivo TEXT,
+            caminho TEXT,
+            hash_arquivo TEXT,
+            status TEXT NOT NULL,
+            total_estimado INTEGER,
+            linhas_lidas INTEGER DEFAULT 0,
+            linhas_inseridas INTEGER,
+            linhas_atualizadas INTEGER,
+            erro TEXT,
+            criada_em TEXT,
+            iniciada_em TEXT,
+            concluida_em TEXT,
+            duracao_segundos REAL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_importacoes_status ON importacoes (status)",
+    ]),
+    (9, "Importação de várias planilhas e abas em lote", [
+        "ALTER TABLE importacoes ADD COLUMN lote TEXT",
+        "ALTER TABLE importacoes ADD COLUMN todas_abas INTEGER DEFAULT 0",
+        "ALTER TABLE importacoes ADD COLUMN abas TEXT",
+    ]),
+    (10, "Partições pendentes do snapshot colunar de descontos", [
+        _criar_particoes_pendentes,
+    ]),
+    (11, "Versão por linha de ocorrências e pendências (sincronização incremental)", [
+        _criar_versoes_linhas,
+    ]),
+    (12, "Tabelas de arquivo de ocorrências encerradas e pendências regularizadas", [
+        _criar_arquivos,
+        "CREATE INDEX IF NOT EXISTS idx_ocorrencias_arquivo_nf ON ocorrencias_arquivo (nota_fiscal)",
+        "CREATE INDEX IF NOT EXISTS idx_pendencias_arquivo_nf ON pendencias_comprovante_arquivo (nota_fiscal)",
+    ]),
+    (13, "Relatório de linhas rejeitadas na validação das planilhas", [
+        f"""
+        CREATE TABLE IF NOT EXISTS linhas_rejeitadas (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            importacao INTEGER,
+            aba TEXT,
+            linha INTEGER,
+            erros TEXT,
+            {", ".join(f"{coluna} TEXT" for coluna in COLUNAS_DESCONTOS)}
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_linhas_rejeitadas_importacao ON linhas_rejeitadas (importacao)",
+        "ALTER TABLE importacoes ADD COLUMN linhas_rejeitadas INTEGER",
+    ]),
+    (14, "Triggers de resumo_descontos limpam só as chaves da linha", [
+        "DROP TRIGGER IF EXISTS trg_descontos_resumo_insert",
+        "DROP TRIGGER IF EXISTS trg_descontos_resumo_delete",
+        "DROP TRIGGER IF EXISTS trg_descontos_resumo_update",
+        _criar_triggers_resumo,
+    ]),
+    (15, "Chave por linha em descontos (a mesma NF pode ter vários descontos)", [
+        "DROP INDEX IF EXISTS ux_descontos_chave",
+        "CREATE INDEX IF NOT EXISTS idx_descontos_chave ON descontos (NF, DISTRIBUIDORA, FECHAMENTO)",
+        "CREATE TABLE IF NOT EXISTS chaves_descontos (chave TEXT PRIMARY KEY) WITHOUT ROWID",
+        _preencher_chaves_descontos,
+        "ALTER TABLE uploads ADD COLUMN linhas_repetidas INTEGER",
+        "ALTER TABLE importacoes ADD COLUMN linhas_repetidas INTEGER",
+    ]),
+]
+
+
+def criar_tabela_versao():
+    with transacao() as conn:
+        cursor = conn.cursor()
+
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS schema_version (
+                versao INTEGER PRIMARY KEY,
+                descricao TEXT,
+                aplicada_em TEXT
+            )
+        """)
+
+
+def versao_schema():
+    with conexao() as conn:
+        return conn.execute("SELECT COALESCE(MAX(versao), 0) FROM schema_version").fetchone()[0]
+
+
+def migrar():
+    # Tabelas base (versão 0) continuam sendo criadas pelas funções criar_*.
+    criar_tabela()
+    criar_tabela_uploads()
+    criar_tabela_ocorrencias()
+    criar_tabela_pendencias()
+    criar_tabela_versao()
+
+    if versao_schema() >= MIGRACOES[-1][0]:
+        return
+
+    with transacao() as conn:
+        # BEGIN IMMEDIATE segura o lock de escrita para que dois processos
+        # subindo ao mesmo tempo não apliquem a mesma migração duas vezes.
+        if not conn.in_transaction:
+            conn.execute("BEGIN IMMEDIATE")
+        atual = versao_schema()
+
+        for versao, descricao, passos in MIGRACOES:
+            if versao <= atual:
+                continue
+            for passo in passos:
+                if callable(passo):
+                    passo(conn)
+                else:
+                    conn.execute(passo)
+            conn.execute(
+                "INSERT INTO schema_version (versao, descricao, aplicada_em) VALUES (?, ?, ?)",
+                (versao, descricao, datetime.now().strftime("%d/%m/%Y %H:%M"))
+            )
+
+    with conexao() as conn:
+        conn.execute("PRAGMA optimize")
+
+
+def plano_consulta(sql, params=()):
+    with conexao() as conn:
+        linhas = conn.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()
+    return [linha[-1] for linha in linhas]
+
 
 # Alias para manter compatibilidade com o app.py
 listar_ocorrencias = carregar_ocorrencias
 
-
+# Medição opcional de tempo/linhas de cada função pública (ver desempenho.py).
+# Precisa ser a última coisa do módulo.
+desempenho.instrumentar_modulo(sys.modules[__name__], "banco")
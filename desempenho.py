@@ -0,0 +1,196 @@
+import functools
+import inspect
+import itertools
+import json
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+import pandas as pd
+
+# =========================
+# MEDIÇÕES
+# =========================
+# Tempo e quantidade de linhas de cada chamada ao banco e de cada trecho das
+# páginas. Desligado, o custo é só um teste de booleano por chamada. Ligado
+# (RPG_DESEMPENHO=1 ou pelo menu de desempenho), as medições ficam em memória
+# (as últimas MAX_MEDICOES) e, se RPG_DESEMPENHO_LOG apontar para um arquivo,
+# também em JSON lines.
+MAX_MEDICOES = 5000
+ARQUIVO_LOG = os.environ.get("RPG_DESEMPENHO_LOG")
+MENU_ADMIN = os.environ.get("RPG_ADMIN") == "1" or os.environ.get("RPG_DESEMPENHO") == "1"
+
+_ativo = os.environ.get("RPG_DESEMPENHO") == "1"
+_medicoes = deque(maxlen=MAX_MEDICOES)
+_lock = threading.Lock()
+_local = threading.local()
+_reruns = itertools.count(1)
+
+
+def ativo():
+    return _ativo
+
+
+def ativar(ligado=True):
+    global _ativo
+    _ativo = ligado
+
+
+def limpar():
+    with _lock:
+        _medicoes.clear()
+
+
+def medicoes():
+    with _lock:
+        return list(_medicoes)
+
+
+def _contar_linhas(resultado):
+    if isinstance(resultado, bool) or resultado is None:
+        return None
+    if isinstance(resultado, int):
+        return resultado
+    if hasattr(resultado, "shape"):
+        return resultado.shape[0]
+    if isinstance(resultado, (list, tuple, dict)):
+        return len(resultado)
+    return None
+
+
+def _detalhe(args, kwargs):
+    partes = [repr(arg) for arg in args] + [f"{chave}={valor!r}" for chave, valor in kwargs.items()]
+    texto = ", ".join(partes)
+    return texto if len(texto) <= 200 else texto[:197] + "..."
+
+
+def registrar(categoria, nome, segundos, linhas=None, detalhe=None):
+    medicao = {
+        "momento": datetime.now().isoformat(timespec="milliseconds"),
+        "rerun": getattr(_local, "rerun", None),
+        "pagina": getattr(_local, "pagina", None),
+        "categoria": categoria,
+        "nome": nome,
+        "detalhe": detalhe,
+        "segundos": round(segundos, 6),
+        "linhas": linhas,
+    }
+    with _lock:
+        _medicoes.append(medicao)
+        if ARQUIVO_LOG:
+            with open(ARQUIVO_LOG, "a", encoding="utf-8") as log:
+                log.write(json.dumps(medicao, ensure_ascii=False) + "\n")
+
+
+# =========================
+# BANCO
+# =========================
+def instrumentar(funcao, categoria):
+    @functools.wraps(funcao)
+    def envolvida(*args, **kwargs):
+        if not _ativo:
+            return funcao(*args, **kwargs)
+
+        inicio = time.perf_counter()
+        resultado = funcao(*args, **kwargs)
+        registrar(
+            categoria,
+            funcao.__name__,
+            time.perf_counter() - inicio,
+            _contar_linhas(resultado),
+            _detalhe(args, kwargs)
+        )
+        return resultado
+
+    envolvida.instrumentada = True
+    return envolvida
+
+
+def instrumentar_modulo(modulo, categoria):
+    # Troca as funções públicas do módulo pela versão medida. Tem que rodar no
+    # fim do módulo, antes de outros módulos fazerem "from modulo import ...".
+    # Context managers e geradores ficam de fora (o tempo seria só o da criação).
+    for nome, funcao in list(vars(modulo).items()):
+        if (
+            nome.startswith("_")
+            or not inspect.isfunction(funcao)
+            or funcao.__module__ != modulo.__name__
+            or getattr(funcao, "instrumentada", False)
+            or inspect.isgeneratorfunction(inspect.unwrap(funcao))
+        ):
+            continue
+        setattr(modulo, nome, instrumentar(funcao, categoria))
+
+
+# =========================
+# PÁGINAS
+# =========================
+# Cada rerun do Streamlit roda em uma thread; a página marca pontos de
+# controle e cada trecho entre dois pontos vira uma medição "secao".
+def iniciar_rerun(pagina):
+    _local.rerun = next(_reruns)
+    _local.pagina = pagina
+    _local.inicio = _local.ultimo = time.perf_counter()
+
+
+def marcar(trecho):
+    if not _ativo or getattr(_local, "ultimo", None) is None:
+        return
+    agora = time.perf_counter()
+    registrar("secao", trecho, agora - _local.ultimo)
+    _local.ultimo = agora
+
+
+def finalizar_rerun():
+    if not _ativo or getattr(_local, "inicio", None) is None:
+        return
+    registrar("rerun", _local.pagina, time.perf_counter() - _local.inicio)
+    _local.inicio = _local.ultimo = None
+
+
+# =========================
+# RESUMOS (MENU DE DESEMPENHO)
+# =========================
+def tabela_medicoes():
+    return pd.DataFrame(
+        medicoes(),
+        columns=["momento", "rerun", "pagina", "categoria", "nome", "detalhe", "segundos", "linhas"]
+    )
+
+
+def percentis(df):
+    # Por função/trecho: quantas vezes, tempo total e distribuição em ms.
+    if df.empty:
+        return pd.DataFrame()
+    ms = df.assign(ms=df["segundos"] * 1000).groupby(["categoria", "nome"])
+    resumo = ms["ms"].agg(
+        chamadas="count",
+        total="sum",
+        p50="median",
+        p95=lambda s: s.quantile(0.95),
+        p99=lambda s: s.quantile(0.99),
+        maximo="max",
+    )
+    resumo["linhas_media"] = ms["linhas"].mean()
+    return resumo.sort_values("total", ascending=False).round(2).reset_index()
+
+
+def mais_lentas(df, quantidade=20):
+    lentas = df[df["categoria"] != "rerun"].nlargest(quantidade, "segundos")
+    return lentas.assign(ms=(lentas["segundos"] * 1000).round(2)).drop(columns="segundos")
+
+
+def por_rerun(df, quantidade=10):
+    # Últimos reruns, um por linha, com o tempo (ms) de cada trecho da página.
+    secoes = df[df["categoria"] == "secao"]
+    if secoes.empty:
+        return pd.DataFrame()
+    ultimos = sorted(secoes["rerun"].dropna().unique())[-quantidade:]
+    secoes = secoes[secoes["rerun"].isin(ultimos)]
+    tabela = secoes.pivot_table(
+        index=["rerun", "pagina"], columns="nome", values="segundos", aggfunc="sum", sort=False
+    ) * 1000
+    tabela["total"] = tabela.sum(axis=1)
+    return tabela.round(1).sort_index(ascending=False).reset_index()
@@ -0,0 +1,97 @@
+import csv
+import importlib.util
+import io
+from datetime import date
+
+import pandas as pd
+import xlsxwriter
+
+# =========================
+# FORMATOS
+# =========================
+# Os arquivos são montados a partir de um iterador de linhas (cursor do
+# banco), sem passar por um DataFrame com a tabela inteira.
+MIME_XLSX = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+FORMATOS = {
+    "Excel": ("xlsx", MIME_XLSX),
+    "CSV": ("csv", "text/csv"),
+}
+
+# Parquet só aparece se o pyarrow estiver instalado (não está no requirements).
+if importlib.util.find_spec("pyarrow") is not None:
+    FORMATOS["Parquet"] = ("parquet", "application/vnd.apache.parquet")
+
+
+# Limite do Excel por aba (1.048.576 linhas, contando o cabeçalho). Acima
+# disso o xlsxwriter descarta as linhas sem avisar, então o arquivo continua
+# em abas novas, cada uma com o cabeçalho.
+LINHAS_POR_ABA = 1_048_575
+
+
+def _como_data(valor):
+    # Datas gravadas como texto ISO ("2024-01-31") viram data no Excel.
+    try:
+        return date.fromisoformat(str(valor)[:10])
+    except ValueError:
+        return None
+
+
+def exportar_excel(colunas, linhas, nome_aba="Dados", colunas_data=()):
+    output = io.BytesIO()
+    # constant_memory grava cada linha em arquivo temporário assim que ela é
+    # escrita, em vez de manter a planilha inteira em memória.
+    wb = xlsxwriter.Workbook(output, {"constant_memory": True})
+    formato_data = wb.add_format({"num_format": "dd/mm/yyyy"})
+    indices_data = {i for i, coluna in enumerate(colunas) if coluna in colunas_data}
+
+    abas = 0
+    numero = LINHAS_POR_ABA
+    for linha in linhas:
+        if numero == LINHAS_POR_ABA:
+            abas += 1
+            # Nome de aba tem no máximo 31 caracteres.
+            sufixo = f" ({abas})" if abas > 1 else ""
+            ws = wb.add_worksheet(nome_aba[:31 - len(sufixo)] + sufixo)
+            ws.write_row(0, 0, colunas)
+            numero = 0
+        numero += 1
+        for i, valor in enumerate(linha):
+            if valor is None:
+                continue
+            if i in indices_data:
+                data = _como_data(valor)
+                if data is not None:
+                    ws.write_datetime(numero, i, data, formato_data)
+                    continue
+            ws.write(numero, i, valor)
+
+    if not abas:
+        wb.add_worksheet(nome_aba[:31]).write_row(0, 0, colunas)
+    wb.close()
+    return output.getvalue()
+
+
+def exportar_csv(colunas, linhas):
+    # ";" e utf-8-sig para o Excel em português abrir o arquivo direto.
+    output = io.StringIO()
+    writer = csv.writer(output, delimiter=";")
+    writer.writerow(colunas)
+    writer.writerows(linhas)
+    return output.getvalue().encode("utf-8-sig")
+
+
+def exportar_parquet(colunas, linhas):
+    output = io.BytesIO()
+    pd.DataFrame.from_records(linhas, columns=colunas).to_parquet(output, index=False)
+    return output.getvalue()
+
+
+def exportar(formato, colunas, linhas, nome_aba="Dados", colunas_data=()):
+    if formato == "Excel":
+        return exportar_excel(colunas, linhas, nome_aba, colunas_data)
+    if formato == "CSV":
+        return exportar_csv(colunas, linhas)
+    if formato == "Parquet" and "Parquet" in FORMATOS:
+        return exportar_parquet(colunas, linhas)
+    raise ValueError(f"Formato de exportação inválido: {formato}")
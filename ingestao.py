@@ -0,0 +1,614 @@
+import difflib
+import hashlib
+import multiprocessing
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import closing
+from functools import lru_cache
+
+import pandas as pd
+from openpyxl import load_workbook
+
+import colunar
+import database
+from cidades import indice_cidades, normalizar_nome
+from database import (
+    COLUNAS_DESCONTOS,
+    COLUNAS_REJEITADAS,
+    FORMATO_DATA_HORA,
+    LINHAS_CARGA_EM_MASSA,
+    atualizar_importacao,
+    buscar_importacao,
+    buscar_upload_por_hash,
+    carga_em_massa,
+    conexao,
+    criar_importacao,
+    importacoes_ativas,
+    inserir_descontos,
+    registrar_rejeitadas,
+    registrar_upload
+)
+
+# =========================
+# LEITURA EM BLOCOS
+# =========================
+# A planilha é lida em modo read-only do openpyxl, que percorre o XML linha a
+# linha; só um bloco de linhas fica em memória por vez. A validação tem um
+# custo fixo por bloco (algumas dezenas de operações do pandas), então blocos
+# grandes saem mais baratos: 50 mil linhas ainda são poucos MB.
+TAMANHO_BLOCO = 50000
+
+COLUNAS_DATA = ("FECHAMENTO", "DATA_EMISSAO")
+COLUNAS_TEXTO = ("DISTRIBUIDORA", "CIDADE", "BASE", "OBSERVACAO", "MOTIVO")
+
+
+def _normalizar_cabecalho(valor):
+    # "Valor do Desconto (R$)" -> "VALOR_DO_DESCONTO_R"; "Observação" -> "OBSERVACAO".
+    if valor is None:
+        return ""
+    return "_".join(re.sub(r"[^\w]+", " ", normalizar_nome(valor)).split())
+
+
+def blocos_da_aba(ws, tamanho_bloco=TAMANHO_BLOCO):
+    linhas = ws.iter_rows(values_only=True)
+    cabecalho = [_normalizar_cabecalho(valor) for valor in next(linhas, ())]
+    largura = len(cabecalho)
+
+    # O índice de cada bloco é o número da linha na planilha (cabeçalho = 1),
+    # usado no relatório de rejeitadas.
+    bloco = []
+    numeros = []
+    for numero, linha in enumerate(linhas, start=2):
+        if all(valor is None for valor in linha):
+            continue
+        linha = tuple(linha[:largura]) + (None,) * (largura - len(linha))
+        bloco.append(linha)
+        numeros.append(numero)
+
+        if len(bloco) >= tamanho_bloco:
+            yield pd.DataFrame(bloco, columns=cabecalho, index=numeros)
+            bloco = []
+            numeros = []
+
+    if bloco:
+        yield pd.DataFrame(bloco, columns=cabecalho, index=numeros)
+
+
+# =========================
+# VALIDAÇÃO / CONVERSÃO
+# =========================
+# Cada bloco é validado inteiro, coluna a coluna (operações do pandas, sem
+# laço por linha): cabeçalhos alternativos viram as colunas de descontos,
+# datas e valores são convertidos, CIDADE e BASE são padronizadas pela tabela
+# CIDADES X FILIAIS e as linhas que não podem entrar saem em um relatório de
+# rejeitadas (linha da planilha, motivo e os valores como vieram).
+
+# Cabeçalho normalizado -> coluna de descontos.
+ALIASES_CABECALHO = {
+    "DISTRIBUIDOR": "DISTRIBUIDORA",
+    "FORNECEDOR": "DISTRIBUIDORA",
+    "DATA_FECHAMENTO": "FECHAMENTO",
+    "MES_FECHAMENTO": "FECHAMENTO",
+    "COMPETENCIA": "FECHAMENTO",
+    "NOTA_FISCAL": "NF",
+    "NOTA": "NF",
+    "NFE": "NF",
+    "NF_E": "NF",
+    "NO_NF": "NF",
+    "N_NF": "NF",
+    "NUM_NF": "NF",
+    "NUMERO_NF": "NF",
+    "EMISSAO": "DATA_EMISSAO",
+    "EMISSAO_NF": "DATA_EMISSAO",
+    "DATA_DE_EMISSAO": "DATA_EMISSAO",
+    "DT_EMISSAO": "DATA_EMISSAO",
+    "MUNICIPIO": "CIDADE",
+    "CIDADE_NF": "CIDADE",
+    "CIDADE_DESTINO": "CIDADE",
+    "FILIAL": "BASE",
+    "BASE_OPERACIONAL": "BASE",
+    "VALOR": "VALOR_DESCONTO",
+    "DESCONTO": "VALOR_DESCONTO",
+    "VALOR_DO_DESCONTO": "VALOR_DESCONTO",
+    "VLR_DESCONTO": "VALOR_DESCONTO",
+    "VL_DESCONTO": "VALOR_DESCONTO",
+    "VALOR_R": "VALOR_DESCONTO",
+    "VALOR_DESCONTO_R": "VALOR_DESCONTO",
+    "VALOR_DO_DESCONTO_R": "VALOR_DESCONTO",
+    "OBS": "OBSERVACAO",
+    "OBSERVACOES": "OBSERVACAO",
+    "TIPO": "OBSERVACAO",
+    "JUSTIFICATIVA": "MOTIVO",
+    "DESCRICAO": "MOTIVO",
+}
+
+# Sem estas a linha não tem chave (NF, DISTRIBUIDORA, FECHAMENTO) ou valor.
+COLUNAS_OBRIGATORIAS = ("DISTRIBUIDORA", "FECHAMENTO", "NF", "VALOR_DESCONTO")
+
+# "AGO/2025", "agosto/2025", "08/2025" -> primeiro dia do mês.
+MESES_ABREVIADOS = {
+    "JAN": 1, "FEV": 2, "MAR": 3, "ABR": 4, "MAI": 5, "JUN": 6,
+    "JUL": 7, "AGO": 8, "SET": 9, "OUT": 10, "NOV": 11, "DEZ": 12,
+}
+# Números digitados como texto (já sem "R$" e espaços).
+NUMERO_MILHAR = r"-?\d{1,3}(?:\.\d{3})+(?:,\d+)?"
+NUMERO_VIRGULA = r"-?\d+(?:,\d+)?"
+NUMERO_PONTO = r"-?\d+\.\d+"
+# Datas que o Excel guardou como número (dias desde 30/12/1899).
+ORIGEM_EXCEL = "1899-12-30"
+SERIAL_EXCEL = (20000, 80000)
+
+
+class PlanilhaSemColunas(ValueError):
+    # Aba sem nenhuma coluna de descontos (ex.: uma aba de resumo).
+    pass
+
+
+def _nos_distintos(funcao, valores):
+    # Aplica a função uma vez por valor distinto e espalha o resultado pelos
+    # códigos do factorize: planilhas repetem muito (datas, cidades, tipos),
+    # então mesmo com 1M de linhas são poucos valores a interpretar.
+    codigos, distintos = pd.factorize(valores)
+    convertidos = funcao(pd.Series(distintos, dtype=object))
+    return convertidos.reindex(codigos).set_axis(valores.index)
+
+
+def _tirar_espacos(valores):
+    # Tira espaços das pontas; texto vazio vira nulo. Números e datas ficam.
+    texto = valores.str.strip()
+    valores = texto.where(texto.notna(), valores)
+    return valores.mask(texto == "")
+
+
+def _limpar_textos(valores):
+    if not (pd.api.types.is_object_dtype(valores) or pd.api.types.is_string_dtype(valores)):
+        return valores
+    return _nos_distintos(_tirar_espacos, valores)
+
+
+def _interpretar_numeros(valores):
+    # Células numéricas passam direto. Texto só nos formatos sem ambiguidade:
+    # "1234", "12,5", milhar com ponto ("1.500", "R$ 1.234,56") e ponto
+    # decimal sem milhar ("12.50"). O resto ("1,234.56", "1.2.3") fica nulo e
+    # a linha vai para as rejeitadas, em vez de virar um valor 1000x errado.
+    eh_texto = valores.map(lambda valor: isinstance(valor, str))
+    numeros = pd.to_numeric(valores.mask(eh_texto), errors="coerce").astype("float64")
+    texto = valores[eh_texto].astype(str).str.replace(r"R\$|\s", "", regex=True)
+    if texto.empty:
+        return numeros
+
+    milhar = texto.str.fullmatch(NUMERO_MILHAR)
+    virgula = texto.str.fullmatch(NUMERO_VIRGULA)
+    ponto = texto.str.fullmatch(NUMERO_PONTO) & ~milhar
+    texto = texto.where(~milhar, texto.str.replace(".", "", regex=False))
+    texto = texto.str.replace(",", ".", regex=False).where(milhar | virgula | ponto)
+    numeros.loc[texto.index] = pd.to_numeric(texto, errors="coerce")
+    return numeros
+
+
+def _converter_numeros(valores):
+    if pd.api.types.is_numeric_dtype(valores):
+        return valores.astype("float64")
+    return _nos_distintos(_interpretar_numeros, valores)
+
+
+def _interpretar_datas(valores):
+    # datetime do Excel e textos ISO em uma passada; só o que sobrar tenta
+    # dd/mm/aaaa, mês/ano, número serial e, por último, o parser genérico.
+    datas = pd.to_datetime(valores, errors="coerce", format="ISO8601")
+    resto = valores[datas.isna() & valores.notna()]
+    if resto.empty:
+        return datas
+
+    texto = resto.astype(str).str.normalize("NFKD").str.encode("ascii", "ignore").str.decode("ascii").str.upper()
+    tentativas = pd.to_datetime(texto, errors="coerce", format="%d/%m/%Y")
+
+    mes_ano = texto.str.extract(r"^([A-Z]{3})[A-Z]*\W*(\d{4})$|^(\d{1,2})/(\d{4})$")
+    mes = mes_ano[0].map(MESES_ABREVIADOS).fillna(pd.to_numeric(mes_ano[2], errors="coerce"))
+    ano = mes_ano[1].fillna(mes_ano[3])
+    mensais = pd.to_datetime(
+        ano.str.cat(mes.astype("Int64").astype(str).str.zfill(2), sep="-") + "-01",
+        errors="coerce",
+        format="%Y-%m-%d"
+    )
+    tentativas = tentativas.fillna(mensais)
+
+    serial = pd.to_numeric(resto, errors="coerce")
+    serial = serial.where(serial.between(*SERIAL_EXCEL))
+    tentativas = tentativas.fillna(pd.to_datetime(serial, errors="coerce", unit="D", origin=ORIGEM_EXCEL))
+
+    falta = tentativas.isna() & serial.isna()
+    if falta.any():
+        tentativas = tentativas.fillna(
+            pd.to_datetime(texto[falta], errors="coerce", format="mixed", dayfirst=True)
+        )
+    return datas.fillna(tentativas)
+
+
+def _converter_datas(valores):
+    if pd.api.types.is_datetime64_any_dtype(valores):
+        return valores
+    return _nos_distintos(_interpretar_datas, valores)
+
+
+def _texto_nf(valor):
+    # NF faz parte da chave: célula numérica perde só o ".0" que o Excel põe;
+    # texto fica como foi digitado ("00123" continua "00123").
+    if pd.api.types.is_float(valor) and float(valor).is_integer():
+        return str(int(valor))
+    return str(valor).strip()
+
+
+def _formatar_datas(datas):
+    return _nos_distintos(lambda distintas: pd.to_datetime(distintas).dt.strftime(FORMATO_DATA_HORA), datas)
+
+
+@lru_cache(maxsize=8192)
+def _mais_parecido(nome, conhecidos):
+    # conhecidos é um frozenset (hash calculado uma vez): a mesma grafia
+    # desconhecida em todos os blocos da planilha só passa pelo difflib uma vez.
+    parecidos = difflib.get_close_matches(nome, conhecidos, n=1, cutoff=0.9)
+    return parecidos[0] if parecidos else nome
+
+
+def _padronizar_nomes(valores, conhecidos=None):
+    # Sem acento, maiúsculo e com espaços simples; se houver uma lista de
+    # nomes conhecidos (normalizado -> grafia oficial), erros de digitação
+    # pequenos são corrigidos por ela.
+    conhecidos = conhecidos or {}
+    chaves = frozenset(conhecidos)
+
+    def padronizar(grafia):
+        nome = normalizar_nome(grafia)
+        if conhecidos and nome not in conhecidos:
+            nome = _mais_parecido(nome, chaves)
+        return conhecidos.get(nome, nome)
+
+    return _nos_distintos(lambda grafias: grafias.map(padronizar), valores)
+
+
+def validar_bloco(df):
+    # Devolve (linhas válidas prontas para gravar, linhas rejeitadas).
+    df = df.rename(columns=lambda coluna: ALIASES_CABECALHO.get(coluna, coluna) if coluna not in COLUNAS_DESCONTOS else coluna)
+    df = df.loc[:, ~df.columns.duplicated()]
+    if not any(coluna in df.columns for coluna in COLUNAS_DESCONTOS):
+        raise PlanilhaSemColunas(
+            "A planilha não tem nenhuma das colunas esperadas: "
+            + ", ".join(COLUNAS_DESCONTOS)
+        )
+
+    original = df.reindex(columns=COLUNAS_DESCONTOS)
+    df = original.apply(_limpar_textos)
+    erros = pd.Series("", index=df.index, dtype=object)
+
+    def rejeitar(mascara, motivo):
+        erros.loc[mascara] += motivo + "; "
+
+    for coluna in COLUNAS_OBRIGATORIAS:
+        rejeitar(df[coluna].isna(), f"{coluna} vazio")
+
+    for coluna in COLUNAS_DATA:
+        datas = _converter_datas(df[coluna])
+        rejeitar(df[coluna].notna() & datas.isna(), f"{coluna} não é data")
+        df[coluna] = _formatar_datas(datas)
+
+    valores = _converter_numeros(df["VALOR_DESCONTO"])
+    rejeitar(df["VALOR_DESCONTO"].notna() & valores.isna(), "VALOR_DESCONTO não é número")
+    df["VALOR_DESCONTO"] = valores
+
+    df["NF"] = _nos_distintos(lambda notas: notas.map(_texto_nf), df["NF"])
+
+    for coluna in COLUNAS_TEXTO:
+        df[coluna] = df[coluna].where(df[coluna].isna(), df[coluna].astype(str))
+
+    # DISTRIBUIDORA faz parte da chave: só perde os espaços, para as linhas
+    # já gravadas continuarem batendo. Sem BASE, vale a filial da cidade.
+    filiais, nomes = indice_cidades()
+    df["CIDADE"] = _padronizar_nomes(df["CIDADE"], dict(zip(nomes, nomes)))
+    bases = {normalizar_nome(filial): filial for filial in set(filiais.values()) if filial}
+    df["BASE"] = _padronizar_nomes(df["BASE"], bases).fillna(df["CIDADE"].map(filiais).mask(lambda s: s == ""))
+    df["OBSERVACAO"] = _padronizar_nomes(df["OBSERVACAO"])
+
+    rejeitadas = erros != ""
+    relatorio = original[rejeitadas].astype(str).astype(object).where(original[rejeitadas].notna(), None)
+    relatorio.insert(0, "erros", erros[rejeitadas].str.rstrip("; "))
+    relatorio.insert(0, "linha", relatorio.index)
+
+    validas = df[~rejeitadas].astype(object)
+    return validas.where(validas.notna(), None), relatorio.reset_index(drop=True)
+
+
+# =========================
+# IMPORTAÇÃO
+# =========================
+def _abrir_area_temporaria(caminho):
+    # Banco descartável só para as linhas já convertidas: sem journal e sem
+    # fsync, porque se algo der errado o arquivo é simplesmente apagado.
+    area = sqlite3.connect(caminho)
+    area.execute("PRAGMA journal_mode = OFF")
+    area.execute("PRAGMA synchronous = OFF")
+    area.execute(f"CREATE TABLE linhas ({', '.join(COLUNAS_DESCONTOS)})")
+    area.execute(f"CREATE TABLE rejeitadas ({', '.join(COLUNAS_REJEITADAS)})")
+    return area
+
+
+def preparar_linhas(area, blocos, progresso=None, linhas_anteriores=0, aba=None):
+    # Valida os blocos e grava na área temporária as linhas válidas e as
+    # rejeitadas. Devolve (linhas lidas, linhas rejeitadas).
+    marcadores = ", ".join("?" for _ in COLUNAS_DESCONTOS)
+    marcadores_rejeitadas = ", ".join("?" for _ in COLUNAS_REJEITADAS)
+    linhas = 0
+    rejeitadas = 0
+
+    for bloco in blocos:
+        lidas = len(bloco)
+        bloco, relatorio = validar_bloco(bloco)
+        area.executemany(f"INSERT INTO linhas VALUES ({marcadores})", bloco.itertuples(index=False, name=None))
+        if not relatorio.empty:
+            relatorio.insert(0, "aba", aba)
+            area.executemany(
+                f"INSERT INTO rejeitadas VALUES ({marcadores_rejeitadas})",
+                relatorio.itertuples(index=False, name=None)
+            )
+
+        linhas += lidas
+        rejeitadas += len(relatorio)
+        if progresso:
+            progresso(linhas_anteriores + linhas)
+
+    area.commit()
+    return linhas, rejeitadas
+
+
+def _linhas_da_area(area):
+    return area.execute("SELECT * FROM linhas ORDER BY rowid")
+
+
+def _rejeitadas_da_area(area):
+    return area.execute("SELECT * FROM rejeitadas ORDER BY rowid")
+
+
+# =========================
+# IMPORTAÇÃO EM SEGUNDO PLANO
+# =========================
+# O Streamlit só grava os arquivos em disco e cria uma linha por arquivo em
+# importacoes, todas com o mesmo lote. Cada arquivo (todas as abas, se pedido)
+# é lido em um processo do pool, em paralelo, para uma área temporária; depois
+# o lote inteiro entra em descontos em uma única transação. O andamento fica
+# na tabela, consultada pela tela.
+PROCESSOS_IMPORTACAO = max(1, min(4, os.cpu_count() or 1))
+PASTA_IMPORTACOES = os.environ.get(
+    "RPG_PASTA_IMPORTACOES",
+    os.path.join(tempfile.gettempdir(), "rpg_importacoes")
+)
+
+# Quanto a gravação do andamento espera pelo lock antes de desistir.
+ESPERA_ANDAMENTO_MS = 200
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _iniciar_processo(caminho_banco):
+    database.DB_PATH = caminho_banco
+
+
+def _agora():
+    return time.strftime("%d/%m/%Y %H:%M:%S")
+
+
+def _caminho_area(caminho):
+    return caminho + ".linhas.db"
+
+
+def _registrar_andamento(id_importacao, **campos):
+    # Andamento é só informativo: se outro lote estiver gravando, espera pouco
+    # e segue sem ele, em vez de esperar BUSY_TIMEOUT_MS e derrubar o arquivo
+    # (e o lote inteiro) com "database is locked".
+    try:
+        with conexao() as conn:
+            conn.execute(f"PRAGMA busy_timeout = {ESPERA_ANDAMENTO_MS}")
+            try:
+                atualizar_importacao(id_importacao, **campos)
+            finally:
+                conn.execute(f"PRAGMA busy_timeout = {database.BUSY_TIMEOUT_MS}")
+    except sqlite3.OperationalError:
+        pass
+
+
+def preparar_arquivo(id_importacao):
+    # Roda em um processo do pool. Devolve (área temporária, linhas,
+    # rejeitadas, linhas por aba).
+    importacao = buscar_importacao(id_importacao)
+    caminho_area = _caminho_area(importacao["caminho"])
+    abas = {}
+
+    wb = load_workbook(importacao["caminho"], read_only=True, data_only=True)
+    try:
+        planilhas = wb.worksheets if importacao["todas_abas"] else wb.worksheets[:1]
+        _registrar_andamento(
+            id_importacao,
+            status="PROCESSANDO",
+            iniciada_em=_agora(),
+            total_estimado=sum(max((ws.max_row or 1) - 1, 0) for ws in planilhas)
+        )
+
+        def progresso(linhas):
+            _registrar_andamento(id_importacao, linhas_lidas=linhas)
+
+        lidas = 0
+        rejeitadas = 0
+        with closing(_abrir_area_temporaria(caminho_area)) as area:
+            for ws in planilhas:
+                try:
+                    linhas, rejeitadas_aba = preparar_linhas(area, blocos_da_aba(ws), progresso, lidas, ws.title)
+                except PlanilhaSemColunas:
+                    # Com todas as abas, abas de resumo/gráfico são só ignoradas.
+                    if not importacao["todas_abas"]:
+                        raise
+                    abas[ws.title] = None
+                    continue
+                abas[ws.title] = linhas
+                lidas += linhas
+                rejeitadas += rejeitadas_aba
+    finally:
+        wb.close()
+
+    return caminho_area, lidas, rejeitadas, abas
+
+
+def _descrever_abas(abas):
+    return "; ".join(
+        f"{aba}: {'ignorada' if linhas is None else f'{linhas} linhas'}"
+        for aba, linhas in abas.items()
+    )
+
+
+def _apagar(*caminhos):
+    for caminho in caminhos:
+        if caminho and os.path.exists(caminho):
+            os.remove(caminho)
+
+
+def processar_lote(ids):
+    # Roda em uma thread do processo do Streamlit: distribui a leitura entre
+    # os processos e faz a gravação única no final.
+    pool = _pool_importacao()
+    inicio = time.perf_counter()
+    importacoes = {id_importacao: buscar_importacao(id_importacao) for id_importacao in ids}
+
+    def duracao():
+        return round(time.perf_counter() - inicio, 2)
+
+    futuros = {}
+    for id_importacao, importacao in importacoes.items():
+        anterior = buscar_upload_por_hash(importacao["hash_arquivo"])
+        if anterior:
+            atualizar_importacao(
+                id_importacao,
+                status="DUPLICADA",
+                erro=f"Já importada em {anterior['data_upload']} ({anterior['nome_arquivo']})",
+                concluida_em=_agora(),
+                duracao_segundos=duracao()
+            )
+            _apagar(importacao["caminho"])
+            continue
+        futuros[id_importacao] = pool.submit(preparar_arquivo, id_importacao)
+
+    preparados = {}
+    falhas = {}
+    for id_importacao, futuro in futuros.items():
+        try:
+            preparados[id_importacao] = futuro.result()
+        except Exception as erro:
+            falhas[id_importacao] = str(erro)
+
+    try:
+        if falhas:
+            raise RuntimeError("Lote cancelado: outro arquivo do lote falhou.")
+
+        # Tudo em uma transação: o lote entra inteiro ou não entra. Lotes
+        # grandes refazem resumo e busca uma vez no final (carga_em_massa),
+        # para o lock de escrita ficar preso o mínimo possível.
+        total = sum(linhas for _, linhas, _, _ in preparados.values())
+        with carga_em_massa(total >= LINHAS_CARGA_EM_MASSA):
+            for id_importacao, (caminho_area, linhas, rejeitadas, abas) in preparados.items():
+                importacao = importacoes[id_importacao]
+                with closing(sqlite3.connect(caminho_area)) as area:
+                    inseridas, repetidas = inserir_descontos(_linhas_da_area(area))
+                    registrar_rejeitadas(id_importacao, _rejeitadas_da_area(area))
+
+                registrar_upload(importacao["nome_arquivo"], importacao["hash_arquivo"], linhas, inseridas, repetidas)
+                atualizar_importacao(
+                    id_importacao,
+                    status="CONCLUIDA",
+                    linhas_lidas=linhas,
+                    linhas_inseridas=inseridas,
+                    linhas_repetidas=repetidas,
+                    linhas_rejeitadas=rejeitadas,
+                    abas=_descrever_abas(abas),
+                    concluida_em=_agora(),
+                    duracao_segundos=duracao()
+                )
+        colunar.atualizar_snapshot()
+    except Exception as erro:
+        for id_importacao in futuros:
+            atualizar_importacao(
+                id_importacao,
+                status="ERRO",
+                erro=falhas.get(id_importacao, str(erro)),
+                concluida_em=_agora(),
+                duracao_segundos=duracao()
+            )
+    finally:
+        for id_importacao in futuros:
+            caminho = importacoes[id_importacao]["caminho"]
+            _apagar(caminho, _caminho_area(caminho))
+
+
+def _iniciar_lote(ids):
+    threading.Thread(target=processar_lote, args=(ids,), daemon=True).start()
+
+
+def _pool_importacao():
+    global _executor
+
+    with _executor_lock:
+        if _executor is None:
+            # "spawn": o processo do Streamlit tem várias threads, e fork com
+            # threads ativas pode travar o filho.
+            _executor = ProcessPoolExecutor(
+                PROCESSOS_IMPORTACAO,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_iniciar_processo,
+                initargs=(database.DB_PATH,)
+            )
+            # Lotes que ficaram pela metade (servidor reiniciado) recomeçam se
+            # os arquivos ainda existirem.
+            lotes = {}
+            for importacao in importacoes_ativas():
+                lotes.setdefault(importacao["lote"], []).append(importacao)
+            for importacoes in lotes.values():
+                if all(os.path.exists(importacao["caminho"] or "") for importacao in importacoes):
+                    _iniciar_lote([importacao["id"] for importacao in importacoes])
+                    continue
+                for importacao in importacoes:
+                    atualizar_importacao(
+                        importacao["id"],
+                        status="ERRO",
+                        erro="Arquivo temporário não encontrado (servidor reiniciado)."
+                    )
+        return _executor
+
+
+def iniciar_fila_importacao():
+    _pool_importacao()
+
+
+def enfileirar_importacoes(arquivos, todas_abas=False):
+    # arquivos: lista de (nome, conteúdo em bytes). Devolve os ids criados;
+    # planilhas que já estão na fila não entram de novo.
+    _pool_importacao()
+    lote = uuid.uuid4().hex
+    ids = []
+
+    os.makedirs(PASTA_IMPORTACOES, exist_ok=True)
+    for nome_arquivo, conteudo in arquivos:
+        hash_arquivo = hashlib.sha256(conteudo).hexdigest()
+        if importacoes_ativas(hash_arquivo):
+            continue
+
+        descritor, caminho = tempfile.mkstemp(suffix=".xlsx", dir=PASTA_IMPORTACOES)
+        with os.fdopen(descritor, "wb") as destino:
+            destino.write(conteudo)
+        ids.append(criar_importacao(nome_arquivo, caminho, hash_arquivo, lote, todas_abas))
+
+    if ids:
+        _iniciar_lote(ids)
+    return ids
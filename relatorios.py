@@ -0,0 +1,222 @@
+import sys
+
+import pandas as pd
+
+import colunar
+import desempenho
+from database import (
+    TABELAS_CONSULTA,
+    cache_por_versao,
+    conexao,
+    ler_tabela,
+    montar_where,
+    origem_consulta
+)
+
+# =========================
+# RELATÓRIOS
+# =========================
+# Os indicadores são calculados no banco (GROUP BY sobre colunas indexadas);
+# só o resultado agregado, com poucas linhas, chega ao pandas e ao navegador.
+# Linhas de detalhe são lidas apenas quando o usuário pede o drill-down.
+# Descontos usam o snapshot colunar (colunar.py) quando ele está ligado e em
+# dia; senão, o SQLite.
+LIMITE_DETALHE = 500
+
+# Rótulo na tela -> coluna agrupada.
+DIMENSOES_DESCONTOS = {
+    "Distribuidora": "DISTRIBUIDORA",
+    "Base": "BASE",
+    "Cidade": "CIDADE",
+    "Período (fechamento)": "FECHAMENTO",
+    "Tipo": "OBSERVACAO",
+}
+
+DIMENSOES_OCORRENCIAS = {
+    "Distribuidora": "distribuidora",
+    "Filial": "filial",
+    "Cidade": "cidade_nf",
+    "Tipo de ocorrência": "ocorrencia",
+    "Status RPG": "status_rpg",
+}
+
+# (rótulo, dias mínimos, dias máximos) desde a emissão da NF.
+FAIXAS_PENDENCIAS = (
+    ("até 7 dias", None, 7),
+    ("8 a 15 dias", 8, 15),
+    ("16 a 30 dias", 16, 30),
+    ("31 a 60 dias", 31, 60),
+    ("mais de 60 dias", 61, None),
+)
+
+
+def _validar_dimensao(dimensao, dimensoes):
+    if dimensao not in dimensoes.values():
+        raise ValueError(f"Dimensão de relatório inválida: {dimensao}")
+
+
+def _where(tabela, filtros):
+    _, colunas_filtro = TABELAS_CONSULTA[tabela]
+    return montar_where(filtros, colunas_filtro)
+
+
+def _consultar(sql, params=()):
+    with conexao() as conn:
+        return pd.read_sql(sql, conn, params=params)
+
+
+# =========================
+# DESCONTOS
+# =========================
+@cache_por_versao("descontos")
+def indicadores_descontos(filtros=None):
+    resultado = colunar.indicadores_descontos(filtros)
+    if resultado is not None:
+        return resultado
+
+    where, params = _where("descontos", filtros)
+    with conexao() as conn:
+        quantidade, total, notas, distribuidoras = conn.execute(f"""
+            SELECT COUNT(*), COALESCE(SUM(VALOR_DESCONTO), 0),
+                   COUNT(DISTINCT NF), COUNT(DISTINCT DISTRIBUIDORA)
+            FROM descontos{where}
+        """, params).fetchone()
+
+    return {
+        "quantidade": quantidade,
+        "total": round(total, 2),
+        "medio": round(total / quantidade, 2) if quantidade else 0.0,
+        "notas": notas,
+        "distribuidoras": distribuidoras,
+    }
+
+
+@cache_por_versao("descontos")
+def descontos_por(dimensao, filtros=None):
+    _validar_dimensao(dimensao, DIMENSOES_DESCONTOS)
+    # Período fica em ordem cronológica; as demais, do maior total para o menor.
+    cronologico = dimensao == "FECHAMENTO"
+
+    # Sem filtros, os totais já estão prontos em resumo_descontos.
+    if not any((filtros or {}).values()):
+        return _consultar(f"""
+            SELECT valor AS {dimensao}, ROUND(total, 2) AS VALOR_DESCONTO, quantidade AS QUANTIDADE
+            FROM resumo_descontos
+            WHERE dimensao = ?
+            ORDER BY {'valor' if cronologico else 'total DESC'}
+        """, (dimensao,))
+
+    resultado = colunar.descontos_por(dimensao, filtros, cronologico)
+    if resultado is not None:
+        return resultado
+
+    where, params = _where("descontos", filtros)
+    where += (" AND " if where else " WHERE ") + f"{dimensao} IS NOT NULL"
+    return _consultar(f"""
+        SELECT {dimensao}, ROUND(SUM(VALOR_DESCONTO), 2) AS VALOR_DESCONTO, COUNT(*) AS QUANTIDADE
+        FROM descontos{where}
+        GROUP BY {dimensao}
+        ORDER BY {dimensao if cronologico else 'VALOR_DESCONTO DESC'}
+    """, params)
+
+
+# =========================
+# OCORRÊNCIAS
+# =========================
+@cache_por_versao("ocorrencias")
+def indicadores_ocorrencias(filtros=None, incluir_arquivo=False):
+    where, params = _where("ocorrencias", filtros)
+    with conexao() as conn:
+        quantidade, valor_nf, valor_ocorrencia, notas = conn.execute(f"""
+            SELECT COUNT(*), COALESCE(SUM(valor_nf), 0), COALESCE(SUM(valor_ocorrencia), 0),
+                   COUNT(DISTINCT nota_fiscal)
+            FROM {origem_consulta("ocorrencias", incluir_arquivo)}{where}
+        """, params).fetchone()
+
+    return {
+        "quantidade": quantidade,
+        "notas": notas,
+        "valor_nf": round(valor_nf, 2),
+        "valor_ocorrencia": round(valor_ocorrencia, 2),
+        "percentual": round(100 * valor_ocorrencia / valor_nf, 2) if valor_nf else 0.0,
+    }
+
+
+@cache_por_versao("ocorrencias")
+def ocorrencias_por(dimensao, filtros=None, incluir_arquivo=False):
+    # percentual: quanto do valor das NFs virou valor de ocorrência.
+    _validar_dimensao(dimensao, DIMENSOES_OCORRENCIAS)
+    where, params = _where("ocorrencias", filtros)
+    where += (" AND " if where else " WHERE ") + f"{dimensao} IS NOT NULL"
+
+    return _consultar(f"""
+        SELECT {dimensao},
+               COUNT(*) AS quantidade,
+               ROUND(SUM(valor_nf), 2) AS valor_nf,
+               ROUND(SUM(valor_ocorrencia), 2) AS valor_ocorrencia,
+               ROUND(100.0 * SUM(valor_ocorrencia) / NULLIF(SUM(valor_nf), 0), 2) AS percentual
+        FROM {origem_consulta("ocorrencias", incluir_arquivo)}{where}
+        GROUP BY {dimensao}
+        ORDER BY valor_ocorrencia DESC
+    """, params)
+
+
+# =========================
+# PENDÊNCIAS (ENVELHECIMENTO)
+# =========================
+def _expressao_faixa():
+    dias = "CAST(julianday(:referencia) - julianday(emissao) AS INTEGER)"
+    casos = " ".join(
+        f"WHEN {dias} <= {maximo} THEN '{rotulo}'"
+        for rotulo, _, maximo in FAIXAS_PENDENCIAS if maximo is not None
+    )
+    return f"CASE WHEN emissao IS NULL THEN 'sem data' {casos} ELSE '{FAIXAS_PENDENCIAS[-1][0]}' END"
+
+
+@cache_por_versao("pendencias_comprovante")
+def envelhecimento_pendencias(referencia, incluir_regularizadas=False):
+    # referencia (data ISO) entra na chave do cache: muda uma vez por dia.
+    # As regularizadas antigas estão no arquivo; só entram se pedidas.
+    where = "" if incluir_regularizadas else " WHERE COALESCE(status, '') <> 'REGULARIZADO'"
+    df = _consultar(f"""
+        SELECT {_expressao_faixa()} AS faixa, status, COUNT(*) AS quantidade
+        FROM {origem_consulta("pendencias_comprovante", incluir_regularizadas)}{where}
+        GROUP BY faixa, status
+    """, {"referencia": referencia})
+
+    if df.empty:
+        return pd.DataFrame()
+
+    ordem = [rotulo for rotulo, _, _ in FAIXAS_PENDENCIAS] + ["sem data"]
+    tabela = df.pivot_table(index="faixa", columns="status", values="quantidade", aggfunc="sum", fill_value=0)
+    return tabela.reindex([faixa for faixa in ordem if faixa in tabela.index])
+
+
+@cache_por_versao("pendencias_comprovante")
+def pendencias_na_faixa(referencia, faixa, incluir_regularizadas=False, limite=LIMITE_DETALHE):
+    # Converte a faixa em um intervalo de datas de emissão para usar o índice.
+    clausulas = []
+    params = {"referencia": referencia, "limite": limite}
+    if faixa == "sem data":
+        clausulas.append("emissao IS NULL")
+    else:
+        _, minimo, maximo = next(f for f in FAIXAS_PENDENCIAS if f[0] == faixa)
+        if minimo is not None:
+            clausulas.append("emissao <= date(:referencia, :ate)")
+            params["ate"] = f"-{minimo} days"
+        if maximo is not None:
+            clausulas.append("emissao >= date(:referencia, :desde)")
+            params["desde"] = f"-{maximo} days"
+    if not incluir_regularizadas:
+        clausulas.append("COALESCE(status, '') <> 'REGULARIZADO'")
+
+    return ler_tabela(
+        "pendencias_comprovante",
+        f"SELECT * FROM {origem_consulta('pendencias_comprovante', incluir_regularizadas)} "
+        f"WHERE {' AND '.join(clausulas)} "
+        f"ORDER BY emissao, id LIMIT :limite",
+        params
+    )
+
+
+desempenho.instrumentar_modulo(sys.modules[__name__], "relatorios")
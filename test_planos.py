@@ -0,0 +1,43 @@
+import pytest
+
+import database
+
+# =========================
+# PLANOS DE CONSULTA
+# =========================
+# As consultas mais usadas pelas telas precisam continuar usando índice: se
+# uma migração ou mudança de consulta fizer alguma cair em varredura completa
+# da tabela, o teste falha.
+CONSULTAS_QUENTES = [
+    ("SELECT * FROM ocorrencias WHERE nota_fiscal IN (?)", ("NF1",)),
+    ("SELECT * FROM ocorrencias WHERE distribuidora IN (?) AND status_rpg IN (?)", ("D1", "ABERTO")),
+    ("SELECT * FROM ocorrencias WHERE emissao_nf BETWEEN ? AND ?", ("2024-01-01", "2024-01-31")),
+    ("SELECT DISTINCT distribuidora FROM ocorrencias WHERE distribuidora IS NOT NULL", ()),
+    ("SELECT filial AS valor, COUNT(*) FROM ocorrencias WHERE filial IS NOT NULL GROUP BY filial", ()),
+    ("SELECT * FROM descontos WHERE NF = ?", ("1",)),
+    ("SELECT * FROM descontos WHERE DISTRIBUIDORA = ? AND FECHAMENTO = ?", ("A", "2024-01")),
+    ("SELECT * FROM pendencias_comprovante WHERE nota_fiscal = ?", ("NF1",)),
+    ("SELECT * FROM pendencias_comprovante WHERE status = ? ORDER BY emissao", ("PENDENTE",)),
+]
+
+
+@pytest.fixture(scope="module")
+def banco(tmp_path_factory, monkeypatch_module):
+    database.fechar_conexoes()
+    monkeypatch_module.setattr(database, "DB_PATH", str(tmp_path_factory.mktemp("planos") / "planos.db"))
+    database.migrar()
+    yield
+    database.fechar_conexoes()
+
+
+@pytest.fixture(scope="module")
+def monkeypatch_module():
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        yield monkeypatch
+
+
+@pytest.mark.parametrize("sql, params", CONSULTAS_QUENTES)
+def test_consulta_quente_usa_indice(banco, sql, params):
+    plano = database.plano_consulta(sql, params)
+    usa_indice = any("USING INDEX" in passo or "USING COVERING INDEX" in passo for passo in plano)
+    assert usa_indice, f"Varredura completa: {sql}\n{' | '.join(plano)}"